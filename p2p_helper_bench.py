@@ -0,0 +1,608 @@
+"""
+Benchmarks for P2P Connection Helper.
+
+Usage:
+    python p2p_helper_bench.py [scenario ...] [--json] [--budget-ms MS]
+                               [--origin-config FILE] [--fail-rate R]
+                               [--save-baseline FILE] [--baseline FILE [--tolerance T]]
+
+Every scenario runs in a throwaway working directory, so real settings are never touched.
+Scenarios that build the GUI need a display.
+
+The network scenarios (update_programs, freshness, link_test, select_programs) never
+leave the machine: OriginEmulator serves every host the helper talks to from a local
+HTTP server, with per-host latency, bandwidth and failure injection (ORIGIN_PROFILES,
+overridable with --origin-config; --fail-rate makes a share of all requests fail).
+Their results include the requests and bytes served.
+
+--save-baseline writes the results to a JSON file; --baseline compares against one and
+fails when a time, request count, byte count or peak RSS grows by more than the
+tolerance (default 25%).
+
+cold_start launches fresh interpreters, so module imports are included. With --budget-ms
+(or P2P_HELPER_STARTUP_BUDGET_MS) it fails when the median time to the first painted
+window goes over the budget, which makes it usable as a startup regression test.
+"""
+import argparse
+import collections
+import hashlib
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+STARTED = time.perf_counter() # Origin for --probe-startup
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+NETWORKS = ["Gnutella", "eDonkey/Kadmille", "GnuCDNA/Gnutella2", "OpenNapster", "WinMX"]
+
+
+def make_programs(count):
+    """Returns `count` synthetic program dictionaries spread over the known networks."""
+    programs = []
+    for i in range(count):
+        network = NETWORKS[i % len(NETWORKS)]
+        programs.append({
+            "DisplayName": f"Client {i:04d} ({network})",
+            "ExecutablePath": f"C:\\Program Files\\Client{i}\\client.exe",
+            "InstallLocation": f"C:\\Program Files\\Client{i}",
+            "Network": network,
+            "Source": "Registry" if i % 2 else "Manual",
+            "RegistryKey": f"Client{i}" if i % 2 else None,
+            "ServerListTargetPaths": {f"http://example.invalid/{i % 7}/server.met": [f"C:\\Program Files\\Client{i}\\server.met"]},
+        })
+    return programs
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process so far, in KB (None where it can't be read, e.g. Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak # Bytes on macOS, KB elsewhere
+
+
+# --- Offline origin emulator ---
+
+# How each emulated host behaves: latency_ms passes before the response headers,
+# bandwidth_kbps throttles the body (absent: unlimited), fail_rate is the share of
+# requests answered with 503, and dead hosts refuse connections. "*" is every other host.
+ORIGIN_PROFILES = {
+    "raw.githubusercontent.com": {"latency_ms": 40, "bandwidth_kbps": 4000},
+    "api.github.com": {"latency_ms": 120},
+    "upd.emule-security.org": {"latency_ms": 150, "bandwidth_kbps": 300},
+    "slow.example": {"latency_ms": 1500, "bandwidth_kbps": 40},
+    "dead.example": {"dead": True},
+    "*": {"latency_ms": 60, "bandwidth_kbps": 2000},
+}
+FILE_SIZES = {".met": 24 * 1024, ".dat": 8 * 1024, ".dll": 160 * 1024, ".reg": 2 * 1024, ".wsx": 4 * 1024}
+DEFAULT_FILE_SIZE = 12 * 1024
+LAST_MODIFIED = "Mon, 05 Feb 2024 10:00:00 GMT" # Of every emulated file; also the emulated commit date
+
+
+class OriginEmulator:
+    """
+    A local HTTP server standing in for every host the helper talks to. While it runs,
+    urllib requests for http(s) URLs are routed to it, the host name becoming the first
+    path segment, so scenarios exercise the real download code without a network. Files
+    are generated from their URL (sized by extension) with an ETag and Last-Modified,
+    conditional requests get 304, and api.github.com answers commit queries.
+    """
+
+    def __init__(self, profiles=None, fail_rate=0.0, seed=1):
+        self.profiles = {**ORIGIN_PROFILES, **(profiles or {})}
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed) # Failures are injected reproducibly
+        self._lock = threading.Lock()
+        self._bodies = {}
+        self.reset_counters()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.statuses = collections.Counter()
+
+    def counters(self):
+        with self._lock:
+            return {"requests": self.requests, "bytes": self.bytes_sent, "statuses": dict(self.statuses)}
+
+    def profile(self, host):
+        return self.profiles.get(host, self.profiles["*"])
+
+    def __enter__(self):
+        # Imported here: the startup probe runs this file, and must not preload what the GUI defers
+        import socket
+        import urllib.parse
+        import urllib.request
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        from p2p_helper_core import install_url_handlers
+
+        emulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                emulator._respond(self, head=False)
+
+            def do_HEAD(self):
+                emulator._respond(self, head=True)
+
+            def log_message(self, format, *args):
+                pass
+
+        class RouteToEmulator(urllib.request.BaseHandler):
+            handler_order = 100 # Before the stock handlers, which then connect to the rewritten host
+
+            def http_request(self, request):
+                parts = urllib.parse.urlsplit(request.full_url)
+                port = emulator.dead_port if emulator.profile(parts.hostname).get("dead") else emulator.port
+                query = f"?{parts.query}" if parts.query else ""
+                request.full_url = f"http://127.0.0.1:{port}/{parts.hostname}{parts.path}{query}"
+                return request
+
+            https_request = http_request
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        # Bound but never listening: connecting to it is refused, as with a dead host
+        self._dead_socket = socket.socket()
+        self._dead_socket.bind(("127.0.0.1", 0))
+        self.dead_port = self._dead_socket.getsockname()[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        install_url_handlers(urllib.request.ProxyHandler({}), RouteToEmulator())
+        return self
+
+    def __exit__(self, *exc_info):
+        from p2p_helper_core import install_url_handlers
+
+        install_url_handlers()
+        self.server.shutdown()
+        self.server.server_close()
+        self._dead_socket.close()
+
+    def _body(self, path):
+        body = self._bodies.get(path)
+        if body is None:
+            size = FILE_SIZES.get(os.path.splitext(path.split("?")[0])[1].lower(), DEFAULT_FILE_SIZE)
+            seed = hashlib.sha256(path.encode("utf-8")).hexdigest().encode("ascii")
+            body = self._bodies[path] = (seed * (size // len(seed) + 1))[:size]
+        return body
+
+    def _respond(self, handler, head):
+        host, _, rest = handler.path.lstrip("/").partition("/")
+        path = "/" + rest
+        profile = self.profile(host)
+        with self._lock:
+            self.requests += 1
+            failed = self.rng.random() < profile.get("fail_rate", self.fail_rate)
+        time.sleep(profile.get("latency_ms", 0) / 1000)
+
+        headers = {}
+        if failed:
+            status, body = 503, b""
+        elif host == "api.github.com":
+            status, body = 200, json.dumps([{"commit": {"committer": {"date": "2024-02-05T10:00:00Z"}}}]).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        else:
+            body = self._body(host + path)
+            etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+            headers.update({"ETag": etag, "Last-Modified": LAST_MODIFIED})
+            status = 304 if handler.headers.get("If-None-Match") == etag else 200
+            if status == 304:
+                body = b""
+        handler.send_response(status)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        with self._lock:
+            self.statuses[status] += 1
+        if not head:
+            bandwidth = profile.get("bandwidth_kbps")
+            for offset in range(0, len(body), 8192):
+                chunk = body[offset:offset + 8192]
+                if bandwidth: # Before the write, so the response is complete when the last byte is counted
+                    time.sleep(len(chunk) / (bandwidth * 1024))
+                try:
+                    handler.wfile.write(chunk)
+                except OSError:
+                    break # The client gave up
+                with self._lock:
+                    self.bytes_sent += len(chunk)
+
+
+def make_update_programs(count, target_root):
+    """
+    Returns `count` programs configured like real ones: eDonkey clients, Gnutella host
+    caches, GnucDNA cache sets and WinMX patches, many sharing sources, plus some with
+    sources on slow and dead hosts. Their targets are under `target_root`.
+    """
+    programs = []
+    raw = "https://raw.githubusercontent.com/GamerA1-99"
+    for i in range(count):
+        folder = os.path.join(target_root, f"client{i:03d}")
+        flavour = i % 5
+        if flavour == 0:
+            program = {"DisplayName": f"eMule {i}", "Network": "eDonkey/Kadmille",
+                       "ServerListTargetPaths": {"eMule Security": [os.path.join(folder, "server.met")]},
+                       "NodesListURL": "eMule Security", "NodesListTargetPath": os.path.join(folder, "nodes.dat")}
+        elif flavour == 1:
+            program = {"DisplayName": f"LimeWire {i}", "Network": "Gnutella",
+                       "ServerListTargetPaths": {f"{raw}/gnutella.net/main/gnutella.net": [os.path.join(folder, "gnutella.net")]}}
+        elif flavour == 2:
+            branch = ("Gnucleus", "Phex", "MyNapster")[i % 3]
+            program = {"DisplayName": f"{branch} {i}", "Network": "GnuCDNA/Gnutella2",
+                       "ServerListTargetPaths": {f"{raw}/GnucDNA/{branch}/{name}": [os.path.join(folder, "Data", name)]
+                                                 for name in ("WebCache.net", "gnucache.net", "GnuCache.net", "host.net")}}
+        elif flavour == 3:
+            program = {"DisplayName": f"WinMX {i}", "Network": "WinMX",
+                       "ServerListTargetPaths": {f"{raw}/Open-Napster-WSX/main/Public.wsx": [os.path.join(folder, "Public.wsx")]},
+                       "WinMXPatchURL": f"{raw}/WinMX-Patch/main/oledlg.dll", "WinMXPatchTarget": os.path.join(folder, "OLEDLG.DLL")}
+        else:
+            program = {"DisplayName": f"Lphant {i}", "Network": "eDonkey/Kadmille",
+                       "ServerListTargetPaths": {f"http://slow.example/list{i % 3}.met": [os.path.join(folder, "server.met")],
+                                                 "http://dead.example/server.met": [os.path.join(folder, "backup", "server.met")],
+                                                 f"http://mirror{i % 4}.example/{i}/server.met": [os.path.join(folder, "mirror.met")]}}
+        program.update({"ExecutablePath": os.path.join(folder, "client.exe"), "InstallLocation": folder, "Source": "Manual"})
+        programs.append(program)
+    return programs
+
+
+def _program_plan(programs):
+    from p2p_helper_core import EDONKEY_SERVER_LISTS, EMULE_NODES_LISTS, plan_program_downloads
+    return [item for program in programs for item in plan_program_downloads(program, EDONKEY_SERVER_LISTS, EMULE_NODES_LISTS)]
+
+
+def bench_update_programs(count=50, profiles=None, fail_rate=0.0):
+    """Update All over `count` programs against the emulated origins: a first run, then one where every source is unchanged (304)."""
+    from p2p_helper_core import DownloadJournal, ParallelUpdateRunner, UpdateEngine, build_update_jobs
+
+    results = {"programs": count}
+    plan = _program_plan(make_update_programs(count, os.path.abspath("targets")))
+    journal = DownloadJournal("p2p_helper_journal.jsonl")
+    engine = UpdateEngine(journal)
+    with OriginEmulator(profiles, fail_rate) as origin:
+        for run in ("first", "unchanged"):
+            jobs = build_update_jobs(plan)
+            validators = {job.url: journal.last_validator(job.url) for job in jobs} if run == "unchanged" else None
+            origin.reset_counters()
+            started = time.perf_counter()
+            outcomes = ParallelUpdateRunner(engine).run(jobs, validators=validators)
+            counters = origin.counters()
+            results[f"{run}_wall_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            results[f"{run}_requests"] = counters["requests"]
+            results[f"{run}_bytes"] = counters["bytes"]
+            results[f"{run}_failed_targets"] = sum(1 for o in outcomes if not o.ok)
+        results["sources"] = len(jobs)
+        results["targets"] = len(outcomes)
+    results["peak_rss_kb"] = peak_rss_kb()
+    return results
+
+
+def bench_freshness(count=50, profiles=None, fail_rate=0.0):
+    """The "Server Update" lookups selecting each of `count` programs starts, one thread per lookup as in the GUI."""
+    from p2p_helper_core import remote_last_modified
+
+    plan = _program_plan(make_update_programs(count, os.path.abspath("targets")))
+    urls = [item.url for item in plan]
+    samples = []
+
+    def lookup(url):
+        started = time.perf_counter()
+        remote_last_modified(url)
+        samples.append((time.perf_counter() - started) * 1000)
+
+    with OriginEmulator(profiles, fail_rate) as origin:
+        started = time.perf_counter()
+        threads = [threading.Thread(target=lookup, args=(url,)) for url in urls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counters = origin.counters()
+    samples.sort()
+    return {"lookups": len(urls), "wall_ms": round((time.perf_counter() - started) * 1000, 1),
+            "lookup_p50_ms": round(samples[len(samples) // 2], 1), "lookup_max_ms": round(samples[-1], 1),
+            "requests": counters["requests"], "bytes": counters["bytes"], "peak_rss_kb": peak_rss_kb()}
+
+
+def bench_link_test(profiles=None, fail_rate=0.0):
+    """Test All Links on the Downloads tab against the emulated origins."""
+    import p2p_helper_gui
+    from p2p_helper_core import check_links
+
+    urls = list(p2p_helper_gui.P2PHelperApp.CLIENT_DOWNLOADS.values())
+    with OriginEmulator(profiles, fail_rate) as origin:
+        started = time.perf_counter()
+        dead = check_links(urls)
+        wall_ms = (time.perf_counter() - started) * 1000
+        counters = origin.counters()
+    return {"links": len(urls), "dead": len(dead), "wall_ms": round(wall_ms, 1),
+            "requests": counters["requests"], "peak_rss_kb": peak_rss_kb()}
+
+
+def bench_select_programs(count=100, profiles=None, fail_rate=0.0):
+    """Selects `count` programs one after another in the GUI, then waits for their "Server Update" lookups."""
+    import p2p_helper_gui
+
+    app = p2p_helper_gui.P2PHelperApp()
+    app.withdraw()
+    try:
+        with OriginEmulator(profiles, fail_rate) as origin:
+            app.installed_programs = make_update_programs(count, os.path.abspath("targets"))
+            app._update_program_list_ui()
+            app.update_idletasks()
+            rows = [(tree, item) for tree in app.network_trees.values() for item in tree.get_children()]
+            origin.reset_counters()
+            started = time.perf_counter()
+            for tree, item in rows:
+                tree.selection_set(item)
+                app.update()
+            select_ms = (time.perf_counter() - started) * 1000
+            lookup_vars = (app.remote_last_updated_var, app.nodes_remote_last_updated_var, app.winmx_remote_last_updated_var)
+            while any(var.get() == "Checking..." for var in lookup_vars) and time.perf_counter() - started < 60:
+                app.update()
+                time.sleep(0.01)
+            settled_ms = (time.perf_counter() - started) * 1000
+            counters = origin.counters()
+    finally:
+        app.shutdown_settings()
+        app.destroy()
+    return {"selected": len(rows), "select_all_ms": round(select_ms, 1), "per_select_ms": round(select_ms / max(len(rows), 1), 2),
+            "settled_ms": round(settled_ms, 1), "requests": counters["requests"], "peak_rss_kb": peak_rss_kb()}
+
+
+def _timed(func, repeat):
+    """Runs `func` `repeat` times and returns (median_ms, min_ms)."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(samples), 2), round(min(samples), 2)
+
+
+def bench_tree_refresh(count=1000, repeat=5):
+    """Cost of _update_program_list_ui() for a full build and for small changes."""
+    import p2p_helper_gui
+
+    app = p2p_helper_gui.P2PHelperApp()
+    app.withdraw()
+    results = {"programs": count}
+    try:
+        def refresh():
+            app._update_program_list_ui()
+            app.update_idletasks()
+
+        def full_build():
+            app.installed_programs = []
+            refresh()
+            app.installed_programs = make_programs(count)
+            refresh()
+        results["full_build_ms"] = _timed(full_build, repeat)
+
+        results["no_change_ms"] = _timed(refresh, repeat)
+
+        counter = [0]
+        def edit_one():
+            counter[0] += 1
+            app.installed_programs[count // 2]["DisplayName"] = f"Renamed client {counter[0]}"
+            refresh()
+        results["edit_one_ms"] = _timed(edit_one, repeat)
+
+        def remove_and_add_one():
+            program = app.installed_programs.pop(count // 3)
+            refresh()
+            app.installed_programs.append(program)
+            refresh()
+        results["remove_and_add_one_ms"] = _timed(remove_and_add_one, repeat)
+
+        def rescan():
+            # A registry rescan produces fresh dicts with the same content
+            app.installed_programs = [dict(p) for p in app.installed_programs]
+            refresh()
+        results["rescan_ms"] = _timed(rescan, repeat)
+    finally:
+        app.shutdown_settings()
+        app.destroy()
+    return results
+
+
+def bench_startup(repeat=5):
+    """Time until the main window is first drawn, plus the cost of the screens built on demand."""
+    import p2p_helper_gui
+
+    timelines = []
+    lazy = {"downloads_tab_ms": [], "faq_first_open_ms": [], "faq_reopen_ms": []}
+    for _ in range(repeat):
+        p2p_helper_gui.STARTUP_STARTED = time.perf_counter()
+        app = p2p_helper_gui.P2PHelperApp()
+        try:
+            while app.startup_timeline.get("first paint") is None:
+                app.update()
+            timelines.append(app.startup_timeline.as_dict())
+
+            started = time.perf_counter()
+            app._create_downloads_tab_widgets(app.downloads_tab)
+            app.downloads_tab_built = True
+            app.update_idletasks()
+            lazy["downloads_tab_ms"].append((time.perf_counter() - started) * 1000)
+
+            for key in ("faq_first_open_ms", "faq_reopen_ms"):
+                started = time.perf_counter()
+                app.show_faq_window()
+                app.update_idletasks()
+                lazy[key].append((time.perf_counter() - started) * 1000)
+                app.faq_window.withdraw()
+        finally:
+            app.shutdown_settings()
+            app.destroy()
+
+    results = {label: round(statistics.median(t[label] for t in timelines), 1) for label in timelines[0]}
+    results.update({key: round(statistics.median(samples), 2) for key, samples in lazy.items()})
+    return results
+
+
+def probe_startup():
+    """Runs in a fresh interpreter: builds the window once and prints its startup timeline as JSON."""
+    from p2p_helper_core import ImportTimer
+
+    timer = ImportTimer()
+    timer.start()
+    try:
+        import p2p_helper_gui
+    finally:
+        timer.stop()
+    p2p_helper_gui.STARTUP_STARTED = STARTED # Count this script's imports too
+    app = p2p_helper_gui.P2PHelperApp()
+    try:
+        while app.startup_timeline.get("first paint") is None:
+            app.update()
+        print(json.dumps({"timeline": app.startup_timeline.as_dict(), "imports": timer.slowest()}))
+    finally:
+        app.shutdown_settings()
+        app.destroy()
+
+
+def bench_cold_start(repeat=3, budget_ms=None):
+    """Time to the first painted window in fresh interpreters, with the slowest imports."""
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        probe = subprocess.run([sys.executable, os.path.abspath(__file__), "--probe-startup"],
+                               capture_output=True, text=True)
+        if probe.returncode:
+            raise RuntimeError((probe.stderr.strip().splitlines() or ["startup probe failed"])[-1])
+        run = json.loads(probe.stdout.strip().splitlines()[-1])
+        run["process_ms"] = (time.perf_counter() - started) * 1000
+        runs.append(run)
+
+    results = {label: round(statistics.median(r["timeline"][label] for r in runs), 1) for label in runs[0]["timeline"]}
+    results["process_ms"] = round(statistics.median(r["process_ms"] for r in runs), 1)
+    results["slowest_imports_ms"] = runs[-1]["imports"]
+    if budget_ms:
+        results["budget_ms"] = budget_ms
+        if results["first paint"] > budget_ms:
+            results["error"] = f"First paint took {results['first paint']} ms, over the {budget_ms} ms budget"
+    return results
+
+
+SCENARIOS = {
+    "startup": bench_startup,
+    "cold_start": bench_cold_start,
+    "tree_refresh": bench_tree_refresh,
+    "update_programs": bench_update_programs,
+    "freshness": bench_freshness,
+    "link_test": bench_link_test,
+    "select_programs": bench_select_programs,
+}
+ORIGIN_SCENARIOS = ("update_programs", "freshness", "link_test", "select_programs") # Run against OriginEmulator
+BASELINE_TOLERANCE = 0.25
+
+
+def _lower_is_better(key):
+    return key.endswith("_ms") or key.endswith("requests") or key.endswith("bytes") or key == "peak_rss_kb"
+
+
+def compare_to_baseline(results, baseline, tolerance=BASELINE_TOLERANCE):
+    """Returns a line per metric that grew by more than `tolerance` (a fraction) since `baseline`."""
+    regressions = []
+    for scenario, old_metrics in baseline.items():
+        new_metrics = results.get(scenario)
+        if not isinstance(new_metrics, dict) or "error" in new_metrics:
+            continue
+        for key, old in old_metrics.items():
+            new = new_metrics.get(key)
+            # _timed() results are [median, min]; the median is compared
+            old, new = (value[0] if isinstance(value, list) else value for value in (old, new))
+            if (_lower_is_better(key) and isinstance(old, (int, float)) and isinstance(new, (int, float))
+                    and old > 0 and new > old * (1 + tolerance)):
+                regressions.append(f"{scenario}.{key}: {old} -> {new} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="P2P Connection Helper benchmarks")
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run (default: all). Available: {', '.join(SCENARIOS)}")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("P2P_HELPER_STARTUP_BUDGET_MS", 0)) or None,
+                        help="Fail cold_start when the median time to first paint exceeds this")
+    parser.add_argument("--origin-config", metavar="FILE", help="JSON file of per-host profiles overriding ORIGIN_PROFILES")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of emulated requests answered with 503 (0-1)")
+    parser.add_argument("--save-baseline", metavar="FILE", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", metavar="FILE", help="Fail if a result regressed against this saved baseline")
+    parser.add_argument("--tolerance", type=float, default=BASELINE_TOLERANCE, help="Allowed growth over the baseline (default: 0.25)")
+    parser.add_argument("--probe-startup", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.probe_startup: # Child process of cold_start; runs in the parent's working directory
+        probe_startup()
+        return 0
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenario(s): {', '.join(unknown)}")
+    profiles = None
+    if args.origin_config:
+        with open(args.origin_config, "r", encoding="utf-8") as f:
+            profiles = json.load(f)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix="p2p_helper_bench_")
+    old_cwd = os.getcwd()
+    try:
+        os.chdir(work_dir)
+        # Keep the startup dialogs out of the way
+        with open("p2p_helper_settings.json", "w", encoding="utf-8") as f:
+            json.dump({"show_disclaimer": False, "show_bearshare_test_warning": False}, f)
+        for name in args.scenarios or SCENARIOS:
+            try:
+                if name == "cold_start":
+                    results[name] = bench_cold_start(budget_ms=args.budget_ms)
+                elif name in ORIGIN_SCENARIOS:
+                    results[name] = SCENARIOS[name](profiles=profiles, fail_rate=args.fail_rate)
+                else:
+                    results[name] = SCENARIOS[name]()
+            except Exception as e:
+                results[name] = {"error": str(e)}
+    finally:
+        os.chdir(old_cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    regressions = compare_to_baseline(results, baseline, args.tolerance) if baseline else []
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.json:
+        print(json.dumps(dict(results, regressions=regressions) if baseline else results, indent=2))
+    else:
+        for name, result in results.items():
+            print(f"{name}:")
+            for key, value in result.items():
+                print(f"  {key}: {value}")
+        if baseline:
+            print("Regressions against the baseline:" if regressions else "No regressions against the baseline.")
+            for line in regressions:
+                print(f"  {line}")
+    return 1 if regressions or any("error" in r for r in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
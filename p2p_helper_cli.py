@@ -0,0 +1,313 @@
+"""
+Headless command line interface for P2P Connection Helper.
+
+Usage:
+    python p2p_helper_gui.py --cli update (--all | --program NAME [--program NAME ...]) [--jobs N] [--dry-run] [--json] [-v]
+    python p2p_helper_gui.py --cli schedule [--json]
+    python p2p_helper_gui.py --cli service [--once] [--json] [--metrics-port PORT [--metrics-host HOST]] [-v]
+    python p2p_helper_gui.py --cli diagnostics [--json]
+
+Works on the settings in the current directory, like the GUI, and runs the same
+UpdateEngine, with the sources downloaded in parallel (see ParallelUpdateRunner).
+Neither tkinter nor Pillow is imported, so it can be scripted or run at logon. Targets
+that need administrator rights are reported as failures; run it from an elevated
+prompt to write them.
+
+`service` keeps the sources refreshed on the same schedule as the GUI's automatic
+refresh (see RefreshScheduler), sharing its schedule file; `schedule` prints it.
+With --metrics-port, `service` serves Prometheus metrics (downloads by outcome, cache
+hits, per-host latency and bytes, scheduler lag, queue depth) at /metrics.
+`update` and `service` add the phase timings of their HTTP requests to the trace file
+the GUI's Diagnostics tab reads; `diagnostics` prints its per-host summary.
+
+Exit codes: 0 when every target was written, 1 when any target failed, 2 for usage
+or settings errors. With --dry-run nothing is downloaded or written; the plan is
+printed instead, and the exit code is 1 if any target could not be written.
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from datetime import datetime
+
+from p2p_helper_core import (
+    EDONKEY_SERVER_LISTS, EMULE_NODES_LISTS, LAST_UPDATED_FIELDS,
+    METRICS, DownloadJournal, MetricsServer, ParallelUpdateRunner, RefreshScheduler, UpdateEngine, build_update_jobs, dry_run_plan,
+    http_tracer, is_admin, metrics, open_settings_store, plan_program_downloads,
+)
+
+SETTINGS_FILE = "p2p_helper_settings.json"
+JOURNAL_FILE = "p2p_helper_journal.jsonl"
+SCHEDULE_FILE = "p2p_helper_schedule.json"
+HTTP_TRACE_FILE = "p2p_helper_http.jsonl"
+SERVICE_MAX_SLEEP = 300 # Seconds; the settings are re-read at least this often
+
+
+def plan_updates(settings, program_names=None):
+    """Returns (plan, unknown names) for the named programs, or for all programs when no names are given."""
+    programs = settings.get("programs", [])
+    unknown = []
+    if program_names:
+        by_name = {}
+        for program in programs:
+            by_name.setdefault(program.get("DisplayName", "").lower(), []).append(program)
+        selected = []
+        for name in program_names:
+            matches = by_name.get(name.lower())
+            if matches:
+                selected.extend(matches)
+            else:
+                unknown.append(name)
+        programs = selected
+    custom_lists = settings.get("custom_server_lists", {})
+    plan = []
+    for program in programs:
+        server_lists = {**EDONKEY_SERVER_LISTS, **custom_lists.get(program.get("Network"), {})}
+        plan.extend(plan_program_downloads(program, server_lists, EMULE_NODES_LISTS))
+    return plan, unknown
+
+
+def outcome_to_dict(outcome):
+    return {"program": outcome.program.get("DisplayName"), "kind": outcome.kind, "url": outcome.url,
+            "target": outcome.target, "ok": outcome.ok, "error": outcome.error, "unchanged": outcome.unchanged}
+
+
+def make_reporter(args, out):
+    """Returns an on_outcome callback printing each TargetOutcome as text or JSON."""
+    def report(outcome):
+        if args.json:
+            print(json.dumps(outcome_to_dict(outcome)), file=out, flush=True)
+        else:
+            status = "SAME  " if outcome.unchanged else "OK    " if outcome.ok else "FAILED"
+            line = f"{status} {outcome.program.get('DisplayName')}: {outcome.target}"
+            print(line if outcome.ok else f"{line} ({outcome.error})", file=out, flush=True)
+    return report
+
+
+def stamp_outcomes(outcomes):
+    """Stamps every download that wrote at least one target, as the GUI does. Returns True if any was stamped."""
+    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    stamped = False
+    for outcome in outcomes:
+        if outcome.ok and not outcome.unchanged:
+            outcome.program[LAST_UPDATED_FIELDS[outcome.kind]] = now_str
+            stamped = True
+    return stamped
+
+
+def make_engine(journal, store):
+    logger = logging.getLogger("p2p_helper.cli")
+    return UpdateEngine(journal, store, broker=None, log=lambda message, level=logging.INFO: logger.log(level, message))
+
+
+def format_size(size):
+    return "unknown size" if size is None else f"{size / 1024:.0f} KB" if size >= 1024 else f"{size} bytes"
+
+
+def print_dry_run(sources, args, out):
+    """Prints a dry_run_plan() as a table or JSON. Returns the number of targets that can't be written."""
+    statuses = [target.status for source in sources for target in source.targets]
+    summary = {"sources": len(sources), "targets": len(statuses),
+               "estimated_bytes": sum(source.estimated_bytes or 0 for source in sources),
+               "unknown_sizes": sum(1 for source in sources if source.estimated_bytes is None),
+               "needs_elevation": statuses.count("elevation"), "blocked": statuses.count("blocked")}
+    if args.json:
+        for source in sources:
+            print(json.dumps(dict(source._asdict(), targets=[t._asdict() for t in source.targets])), file=out)
+        print(json.dumps({"summary": summary}), file=out)
+        return summary["blocked"]
+    for source in sources:
+        cost = format_size(source.estimated_bytes)
+        if source.estimated_ms is not None:
+            cost += f", ~{source.estimated_ms / 1000:.1f} s"
+        if source.estimate_from:
+            cost += f" (from the {source.estimate_from})"
+        print(f"{source.url} [{source.kind}] {cost}", file=out)
+        print(f"    for {', '.join(source.programs)}", file=out)
+        for target in source.targets:
+            line = f"    {target.status:<9}  {target.path}"
+            print(f"{line}  ({target.note})" if target.note else line, file=out)
+    print(f"{summary['sources']} source(s) to download once each, about {format_size(summary['estimated_bytes'])}"
+          f"{' plus ' + str(summary['unknown_sizes']) + ' of unknown size' if summary['unknown_sizes'] else ''}; "
+          f"{summary['targets']} target(s), {summary['needs_elevation']} needing administrator rights, "
+          f"{summary['blocked']} that can't be written.", file=out)
+    return summary["blocked"]
+
+
+def cmd_update(args, out):
+    store = open_settings_store(SETTINGS_FILE, read_only=args.dry_run) # A dry run creates and migrates nothing
+    if not store.exists():
+        print(f"No settings found in {SETTINGS_FILE}.", file=sys.stderr)
+        return 2
+    try:
+        settings, loaded_path = store.load()
+        plan, unknown = plan_updates(settings, None if args.all else args.program)
+        if unknown:
+            print(f"Unknown program(s): {', '.join(unknown)}", file=sys.stderr)
+            return 2
+        if args.dry_run:
+            blocked = print_dry_run(dry_run_plan(plan, DownloadJournal(JOURNAL_FILE), store, is_admin()), args, out)
+            return 1 if blocked else 0
+
+        report = make_reporter(args, out)
+        report_lock = threading.Lock() # Jobs finish on the pool's threads
+
+        def on_change(job):
+            if job.finished_state:
+                with report_lock:
+                    for outcome in job.outcomes:
+                        report(outcome)
+
+        journal = DownloadJournal(JOURNAL_FILE)
+        runner = ParallelUpdateRunner(make_engine(journal, store), max_workers=args.jobs)
+        outcomes = runner.run(build_update_jobs(plan), on_change=on_change)
+        if stamp_outcomes(outcomes):
+            store.save(settings)
+        journal.save_index()
+    finally:
+        store.close()
+
+    failed = sum(1 for o in outcomes if not o.ok)
+    summary = {"programs": len({id(item.program) for item in plan}), "targets": len(outcomes),
+               "ok": len(outcomes) - failed, "failed": failed}
+    if args.json:
+        print(json.dumps({"summary": summary}), file=out)
+    else:
+        print(f"{summary['ok']} of {summary['targets']} target(s) updated for {summary['programs']} program(s).", file=out)
+    return 1 if failed else 0
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M") if timestamp else "-"
+
+
+def cmd_schedule(args, out):
+    store = open_settings_store(SETTINGS_FILE, read_only=True) # A status query creates and migrates nothing
+    try:
+        settings = store.load()[0] if store.exists() else {}
+    finally:
+        store.close()
+    scheduler = RefreshScheduler(SCHEDULE_FILE)
+    # Only in memory: saving would rewrite the file the GUI or service is using
+    scheduler.sync(plan_updates(settings)[0], settings.get("refresh_intervals"))
+    rows = scheduler.status()
+    if args.json:
+        print(json.dumps({"auto_refresh": settings.get("auto_refresh", True), "sources": rows}, indent=2), file=out)
+        return 0
+    for row in rows:
+        status = row["last_status"] or "never run"
+        if row["failures"]:
+            status += f", {row['failures']} failure(s): {row['last_error']}"
+        print(f"{format_time(row['next_run'])}  every {row['interval_h']:g} h  {row['url']}  "
+              f"(last: {format_time(row['last_run'])}, {status})", file=out)
+    if not rows:
+        print("No download sources are configured.", file=out)
+    return 0
+
+
+def cmd_service(args, out):
+    """Refreshes due sources until interrupted (or once with --once), re-reading the settings every cycle."""
+    scheduler = RefreshScheduler(SCHEDULE_FILE)
+    journal = DownloadJournal(JOURNAL_FILE)
+    report = make_reporter(args, out)
+    failed = 0
+    metrics_server = None
+    if args.metrics_port is not None:
+        try:
+            metrics_server = MetricsServer(metrics, args.metrics_port, args.metrics_host)
+        except OSError as e:
+            print(f"Could not serve metrics on {args.metrics_host}:{args.metrics_port}: {e}", file=sys.stderr)
+            return 2
+        logging.getLogger("p2p_helper.cli").info(
+            f"Serving {len(METRICS)} metrics at http://{metrics_server.host}:{metrics_server.port}/metrics")
+    try:
+        while True:
+            store = open_settings_store(SETTINGS_FILE)
+            try:
+                settings = store.load()[0] if store.exists() else {}
+                plan = plan_updates(settings)[0]
+                scheduler.sync(plan, settings.get("refresh_intervals"))
+                outcomes = scheduler.run_due(plan, make_engine(journal, store), on_outcome=report)
+                if stamp_outcomes(outcomes):
+                    store.save(settings)
+            finally:
+                store.close()
+            journal.save_index()
+            failed += sum(1 for o in outcomes if not o.ok)
+            if args.once:
+                break
+            next_run = scheduler.next_run()
+            delay = SERVICE_MAX_SLEEP if next_run is None else next_run - time.time()
+            time.sleep(min(max(delay, 1), SERVICE_MAX_SLEEP))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if metrics_server:
+            metrics_server.close()
+    return 1 if failed else 0
+
+
+def cmd_diagnostics(args, out):
+    http_tracer.load(HTTP_TRACE_FILE)
+    rows = http_tracer.summary()
+    if args.json:
+        print(json.dumps({"hosts": rows, "failures": http_tracer.failures()}, indent=2), file=out)
+        return 0
+
+    def ms(value):
+        return "-" if value is None else f"{value:.0f}"
+
+    print(f"{'Host':<32} {'Reqs':>5} {'Errs':>5} {'KB':>7} {'p50':>6} {'p95':>6} {'p99':>6}  p95 per phase (ms)", file=out)
+    for row in rows:
+        phases = ", ".join(f"{phase} {ms(value)}" for phase, value in row["phase_p95_ms"].items() if value is not None)
+        print(f"{row['host']:<32} {row['requests']:>5} {row['errors']:>5} {row['bytes'] / 1024:>7.0f} "
+              f"{ms(row['p50_ms']):>6} {ms(row['p95_ms']):>6} {ms(row['p99_ms']):>6}  {phases}", file=out)
+    if not rows:
+        print(f"No HTTP requests recorded in {HTTP_TRACE_FILE}.", file=out)
+    failures = http_tracer.failures(10)
+    if failures:
+        print("\nRecent failures:", file=out)
+    for record in failures:
+        phase = f"HTTP {record.get('status')}" if record.get("error_phase") == "status" else record.get("error_phase")
+        print(f"{format_time(record.get('ts'))}  {record.get('op')}  {record.get('url')}: {phase} after "
+              f"{ms(record.get('total_ms'))} ms ({record.get('error')})", file=out)
+    return 0
+
+
+def main(argv=None, out=None):
+    parser = argparse.ArgumentParser(prog="p2p_helper_gui.py --cli", description="P2P Connection Helper (headless)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log progress to stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+    update = commands.add_parser("update", help="Download the configured server lists, nodes.dat files and patches")
+    which = update.add_mutually_exclusive_group(required=True)
+    which.add_argument("--all", action="store_true", help="Update every program")
+    which.add_argument("--program", action="append", metavar="NAME", help="Update the program with this display name (repeatable)")
+    update.add_argument("--jobs", type=int, metavar="N", help=f"Download up to N sources at once (default: {ParallelUpdateRunner.MAX_WORKERS})")
+    update.add_argument("--dry-run", action="store_true", help="Show what would be downloaded and written, and where, without doing it")
+    update.add_argument("--json", action="store_true", help="Print one JSON object per target (per source with --dry-run), then a summary object")
+    schedule = commands.add_parser("schedule", help="Show when each download source is refreshed next")
+    schedule.add_argument("--json", action="store_true", help="Print the schedule as JSON")
+    service = commands.add_parser("service", help="Keep the download sources refreshed on their schedule")
+    service.add_argument("--once", action="store_true", help="Refresh the sources that are due, then exit")
+    service.add_argument("--json", action="store_true", help="Print one JSON object per target")
+    service.add_argument("--metrics-port", type=int, metavar="PORT", help="Serve Prometheus metrics at http://HOST:PORT/metrics")
+    service.add_argument("--metrics-host", default="127.0.0.1", metavar="HOST", help="Address for the metrics endpoint (default: 127.0.0.1)")
+    diagnostics = commands.add_parser("diagnostics", help="Show per-host timings of the recorded HTTP requests")
+    diagnostics.add_argument("--json", action="store_true", help="Print the per-host summary and recent failures as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(levelname)s: %(message)s")
+    command = {"update": cmd_update, "schedule": cmd_schedule, "service": cmd_service,
+               "diagnostics": cmd_diagnostics}[args.command]
+    if args.command in ("update", "service") and not getattr(args, "dry_run", False):
+        http_tracer.open_log(HTTP_TRACE_FILE)
+    try:
+        return command(args, out or sys.stdout)
+    finally:
+        http_tracer.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3557 @@
+"""
+Non-GUI building blocks for the P2P Connection Helper.
+
+Nothing in this module may import tkinter or Pillow at module level, so it can be
+used by background threads and by tooling that runs without a display.
+"""
+import collections
+import contextlib
+import functools
+import glob
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from bisect import bisect_left, insort
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    import winreg # Only available on Windows
+except ImportError:
+    winreg = None
+
+UNINSTALL_SUBKEYS = (
+    r"Software\Microsoft\Windows\CurrentVersion\Uninstall",
+    r"Software\Wow6432Node\Microsoft\Windows\CurrentVersion\Uninstall", # For 32-bit apps on 64-bit Windows
+)
+UNINSTALL_VALUES = ("DisplayName", "InstallLocation", "DisplayIcon")
+
+
+class AssetIndex:
+    """
+    Case-insensitive, in-memory index of the icon assets shipped with the app.
+
+    The asset folder is listed once when the index is built. After that every
+    lookup is a dictionary access, so resolving icons never touches the disk.
+    """
+    ASSET_EXTENSIONS = (".ico", ".png")
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self._by_name = {}  # "limewire.ico" -> "LimeWire.ico" (real filename on disk)
+        self._by_stem = {}  # "limewire" -> "LimeWire.ico"
+        self.refresh()
+
+    @staticmethod
+    def _normalize(name):
+        """Reduces a logical icon name to lowercase letters and digits only."""
+        stem = os.path.splitext(os.path.basename(name))[0] if name.lower().endswith(AssetIndex.ASSET_EXTENSIONS) else name
+        return re.sub(r'[^a-z0-9]', '', stem.lower())
+
+    def refresh(self):
+        """(Re)builds the index from a single listing of the asset folder."""
+        self._by_name.clear()
+        self._by_stem.clear()
+        try:
+            entries = list(os.scandir(self.base_dir))
+        except OSError:
+            return
+        for entry in sorted(entries, key=lambda e: e.name):
+            if not entry.name.lower().endswith(self.ASSET_EXTENSIONS):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            self._by_name.setdefault(entry.name.lower(), entry.name)
+            # .ico files win over other formats for the same logical name
+            stem_key = self._normalize(entry.name)
+            if stem_key not in self._by_stem or entry.name.lower().endswith(".ico"):
+                self._by_stem[stem_key] = entry.name
+
+    def resolve(self, *names):
+        """
+        Returns the real filename of the first name that exists, or None.
+        Names are matched case-insensitively, first by exact filename and then
+        by logical name, so "eDonkey.ico", "edonkey" and "EDONKEY.ICO" are equivalent.
+        """
+        for name in names:
+            if not name:
+                continue
+            name = os.path.basename(name)
+            found = self._by_name.get(name.lower()) or self._by_stem.get(self._normalize(name))
+            if found:
+                return found
+        return None
+
+    def path(self, *names):
+        """Like resolve(), but returns the full path to the asset."""
+        found = self.resolve(*names)
+        return os.path.join(self.base_dir, found) if found else None
+
+    def names(self):
+        """Returns the real filenames of every indexed asset."""
+        return sorted(self._by_name.values())
+
+    def __contains__(self, name):
+        return self.resolve(name) is not None
+
+    def __len__(self):
+        return len(self._by_name)
+
+
+class IconAtlas:
+    """
+    All icon assets pre-rendered at one size into a single PNG sprite sheet.
+
+    The sheet and a JSON manifest (cell positions plus the mtime/size of every source
+    file) are cached on disk, so normally startup only reads one small PNG, which Tk
+    can load without Pillow. When an asset changes, the sheet is rebuilt with Pillow,
+    using the ICO frame that already has the right size where there is one. prepare()
+    does the file work and is meant to run on a background thread.
+    """
+    MANIFEST_VERSION = 1
+    COLUMNS = 16
+
+    def __init__(self, assets, cache_prefix, size=16):
+        self.assets = assets
+        self.size = size
+        self.image_path = f"{cache_prefix}_{size}.png"
+        self.manifest_path = f"{cache_prefix}_{size}.json"
+        self.cells = {} # asset filename -> (x, y) of its cell in the sheet
+        self.errors = {} # asset filename -> why it couldn't be rendered
+        self.rebuilt = False
+
+    def _sources(self):
+        sources = {}
+        for name in self.assets.names():
+            try:
+                st = os.stat(os.path.join(self.assets.base_dir, name))
+            except OSError:
+                continue
+            sources[name] = [st.st_mtime_ns, st.st_size]
+        return sources
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("version") != self.MANIFEST_VERSION or manifest.get("size") != self.size or not os.path.exists(self.image_path):
+            return None
+        return manifest
+
+    def prepare(self):
+        """
+        Makes sure the sheet on disk is current and loads its cell positions. Returns True
+        if a usable sheet exists. Without Pillow an out-of-date sheet is used as it is.
+        """
+        sources = self._sources()
+        manifest = self._read_manifest()
+        if manifest and manifest.get("sources") == sources:
+            self.cells = {name: tuple(xy) for name, xy in manifest["cells"].items()}
+            return True
+        try:
+            self._build(sources)
+            self.rebuilt = True
+            return True
+        except ImportError:
+            if manifest: # Better a slightly stale sheet than no icons
+                self.cells = {name: tuple(xy) for name, xy in manifest["cells"].items()}
+                return True
+            return False
+
+    def _render(self, path):
+        """Decodes one asset to a size x size RGBA image, preferring a native frame of that size."""
+        from PIL import Image
+
+        img = Image.open(path)
+        if img.format == "ICO":
+            frame_sizes = sorted(img.info.get("sizes") or img.ico.sizes())
+            wanted = (self.size, self.size)
+            if wanted not in frame_sizes:
+                # The smallest frame that is still big enough scales down best
+                bigger = [s for s in frame_sizes if s[0] >= self.size and s[1] >= self.size]
+                wanted = bigger[0] if bigger else frame_sizes[-1]
+            img = img.ico.getimage(wanted)
+        img = img.convert("RGBA")
+        if img.size != (self.size, self.size):
+            img = img.resize((self.size, self.size), Image.Resampling.LANCZOS)
+        return img
+
+    def _build(self, sources):
+        from PIL import Image # Raises ImportError without Pillow
+
+        names = list(sources)
+        rows = max(1, -(-len(names) // self.COLUMNS))
+        sheet = Image.new("RGBA", (self.COLUMNS * self.size, rows * self.size))
+        cells, errors = {}, {}
+        for index, name in enumerate(names):
+            x, y = (index % self.COLUMNS) * self.size, (index // self.COLUMNS) * self.size
+            try:
+                sheet.paste(self._render(os.path.join(self.assets.base_dir, name)), (x, y))
+                cells[name] = (x, y)
+            except Exception as e:
+                errors[name] = str(e)
+
+        temp_image = self.image_path + ".tmp"
+        sheet.save(temp_image, format="PNG", optimize=True)
+        os.replace(temp_image, self.image_path)
+        temp_manifest = self.manifest_path + ".tmp"
+        with open(temp_manifest, "w", encoding="utf-8") as f:
+            json.dump({"version": self.MANIFEST_VERSION, "size": self.size, "sources": sources, "cells": cells}, f)
+        os.replace(temp_manifest, self.manifest_path)
+        self.cells, self.errors = cells, errors
+
+    def start(self, on_ready):
+        """Runs prepare() on a background thread and then calls on_ready(available) from that thread."""
+        def worker():
+            try:
+                available = self.prepare()
+            except Exception as e:
+                self.errors["*"] = str(e)
+                available = False
+            on_ready(available)
+        threading.Thread(target=worker, name="IconAtlas", daemon=True).start()
+
+
+def read_windows_uninstall_entries(on_error=None):
+    """
+    Reads the uninstall entries from the native Windows Registry (HKLM and HKCU).
+    Returns a list of (registry_key_name, {value_name: value}) tuples. Returns an
+    empty list when the winreg module is not available.
+    """
+    if winreg is None:
+        return []
+
+    entries = []
+    for hkey in (winreg.HKEY_LOCAL_MACHINE, winreg.HKEY_CURRENT_USER):
+        for subkey_path in UNINSTALL_SUBKEYS:
+            try:
+                key = winreg.OpenKey(hkey, subkey_path, 0, winreg.KEY_READ)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                if on_error:
+                    on_error(e)
+                continue
+            try:
+                i = 0
+                while True:
+                    try:
+                        name = winreg.EnumKey(key, i)
+                    except OSError:
+                        break
+                    i += 1
+                    values = {}
+                    try:
+                        subkey = winreg.OpenKey(key, name)
+                    except OSError:
+                        continue
+                    for value_name in UNINSTALL_VALUES:
+                        try:
+                            values[value_name] = winreg.QueryValueEx(subkey, value_name)[0]
+                        except FileNotFoundError:
+                            pass
+                    winreg.CloseKey(subkey)
+                    entries.append((name, values))
+            finally:
+                winreg.CloseKey(key)
+    return entries
+
+
+# --- Wine prefix registry support ---
+
+_REG_ESCAPE_RE = re.compile(r'\\(x[0-9a-fA-F]{1,4}|[0-7]{1,3}|.)')
+_REG_SIMPLE_ESCAPES = {'n': '\n', 'r': '\r', 't': '\t', 'a': '\a', 'b': '\b', 'e': '\x1b', 'f': '\f', 'v': '\v'}
+
+
+def _unescape_reg_string(text):
+    """Reverses the escaping Wine applies to key names and string values in .reg hives."""
+    if '\\' not in text:
+        return text
+
+    def replace(match):
+        code = match.group(1)
+        if code[0] == 'x' and len(code) > 1:
+            return chr(int(code[1:], 16))
+        if code[0] in '01234567':
+            return chr(int(code, 8))
+        return _REG_SIMPLE_ESCAPES.get(code, code)
+    return _REG_ESCAPE_RE.sub(replace, text)
+
+
+def _split_quoted(text):
+    """
+    Splits a line that starts with a quoted, escaped string.
+    Returns (raw_string_without_quotes, rest_of_line) or (None, text) if unterminated.
+    """
+    i = 1
+    length = len(text)
+    while i < length:
+        c = text[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '"':
+            return text[1:i], text[i + 1:]
+        i += 1
+    return None, text
+
+
+def _parse_reg_value(data):
+    """Converts the data part of a Wine .reg value line into a Python value."""
+    if data.startswith('"'):
+        raw, _ = _split_quoted(data)
+        return _unescape_reg_string(raw) if raw is not None else None
+    if data.startswith('str('):
+        # str(2):"..." (REG_EXPAND_SZ) or str(7):"..." (REG_MULTI_SZ)
+        colon = data.find(':')
+        raw, _ = _split_quoted(data[colon + 1:]) if colon != -1 else (None, '')
+        if raw is None:
+            return None
+        value = _unescape_reg_string(raw)
+        return [v for v in value.split('\0') if v] if data.startswith('str(7)') else value
+    if data.startswith('dword:'):
+        try:
+            return int(data[6:], 16)
+        except ValueError:
+            return None
+    return None # Binary (hex:) values are not needed by the helper
+
+
+def parse_wine_hive(path, wanted_prefixes):
+    """
+    Streams a Wine registry hive (system.reg / user.reg) and returns only the keys
+    that live below one of `wanted_prefixes`.
+
+    Keys outside those subtrees are skipped with a single startswith() check per
+    line, which keeps large hives (tens of MB) fast to scan.
+    Returns {key_path: {value_name: value}}, with key paths relative to the hive root.
+    """
+    wanted = tuple(p.lower().rstrip('\\') for p in wanted_prefixes)
+    keys = {}
+    current = None
+    pending = ''
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if line[0] == '[':
+                pending = ''
+                end = line.rfind(']')
+                key_path = _unescape_reg_string(line[1:end]) if end != -1 else ''
+                lowered = key_path.lower()
+                if any(lowered == p or lowered.startswith(p + '\\') for p in wanted):
+                    current = keys.setdefault(key_path, {})
+                else:
+                    current = None
+                continue
+            if current is None:
+                continue
+
+            line = line.rstrip('\r\n')
+            if pending:
+                line = pending + line.lstrip()
+                pending = ''
+            if line.endswith('\\') and not line.endswith('\\\\'):
+                # Long hex values are continued on the next line
+                pending = line[:-1]
+                continue
+
+            if line.startswith('@='):
+                current[''] = _parse_reg_value(line[2:])
+            elif line.startswith('"'):
+                raw_name, rest = _split_quoted(line)
+                if raw_name is None or not rest.startswith('='):
+                    continue
+                current[_unescape_reg_string(raw_name)] = _parse_reg_value(rest[1:])
+    return keys
+
+
+class _HiveCache:
+    """Caches parsed hives per file, invalidated by the file's mtime and size."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {} # (path, wanted_prefixes) -> (mtime_ns, size, parsed)
+
+    def get(self, path, wanted_prefixes):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return {}
+        cache_key = (os.path.abspath(path), tuple(wanted_prefixes))
+        with self._lock:
+            cached = self._entries.get(cache_key)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        parsed = parse_wine_hive(path, wanted_prefixes)
+        with self._lock:
+            self._entries[cache_key] = (st.st_mtime_ns, st.st_size, parsed)
+        return parsed
+
+
+_hive_cache = _HiveCache()
+
+
+class WinePrefix:
+    """A Wine prefix whose registry hives are read as plain text instead of via winreg."""
+    SHELL_FOLDERS_KEY = r"Software\Microsoft\Windows\CurrentVersion\Explorer\Shell Folders"
+
+    def __init__(self, path):
+        self.path = os.path.abspath(os.path.expanduser(path))
+
+    def __repr__(self):
+        return f"WinePrefix({self.path!r})"
+
+    @property
+    def drive_c(self):
+        return os.path.join(self.path, "drive_c")
+
+    def is_valid(self):
+        return os.path.isfile(os.path.join(self.path, "system.reg"))
+
+    def _hive(self, name, wanted_prefixes):
+        return _hive_cache.get(os.path.join(self.path, name), wanted_prefixes)
+
+    def uninstall_entries(self):
+        """
+        Returns (registry_key_name, values) tuples from system.reg (HKLM) and
+        user.reg (HKCU), in the same shape as read_windows_uninstall_entries().
+        """
+        entries = []
+        for hive_name in ("system.reg", "user.reg"):
+            hive = self._hive(hive_name, UNINSTALL_SUBKEYS)
+            for key_path, values in hive.items():
+                parent, _, name = key_path.rpartition('\\')
+                # Only direct children of an Uninstall key describe a program
+                if name and parent.lower() in (k.lower() for k in UNINSTALL_SUBKEYS):
+                    entries.append((name, {v: values[v] for v in UNINSTALL_VALUES if isinstance(values.get(v), str)}))
+        return entries
+
+    def map_path(self, windows_path):
+        """
+        Maps a Windows path from inside the prefix (e.g. "C:\\Program Files\\eMule")
+        onto the host filesystem. Paths that are not drive-absolute are returned unchanged.
+        """
+        if not windows_path or len(windows_path) < 2 or windows_path[1] != ':' or not windows_path[0].isalpha():
+            return windows_path
+        drive = windows_path[0].lower()
+        rest = [part for part in re.split(r'[\\/]+', windows_path[2:]) if part]
+        if drive == 'c':
+            root = self.drive_c
+        else:
+            root = os.path.join(self.path, "dosdevices", f"{drive}:")
+        return os.path.join(root, *rest)
+
+    def environment(self):
+        """
+        Returns the Windows environment variables the prefill logic relies on,
+        mapped onto the host filesystem.
+        """
+        shell_folders = self._hive("user.reg", (self.SHELL_FOLDERS_KEY,)).get(self.SHELL_FOLDERS_KEY, {})
+        program_files = os.path.join(self.drive_c, "Program Files")
+        program_files_x86 = os.path.join(self.drive_c, "Program Files (x86)")
+        if not os.path.isdir(program_files_x86):
+            program_files_x86 = program_files # 32-bit prefixes only have "Program Files"
+
+        app_data = shell_folders.get("AppData")
+        local_app_data = shell_folders.get("Local AppData")
+        user_dir = os.path.join(self.drive_c, "users", os.environ.get("USER", "user"))
+        return {
+            "ProgramFiles": program_files,
+            "ProgramFiles(x86)": program_files_x86,
+            "APPDATA": self.map_path(app_data) if app_data else os.path.join(user_dir, "AppData", "Roaming"),
+            "LOCALAPPDATA": self.map_path(local_app_data) if local_app_data else os.path.join(user_dir, "AppData", "Local"),
+        }
+
+
+def default_wine_prefixes():
+    """Finds the Wine prefixes that exist in their usual locations on this machine."""
+    if sys.platform == "win32":
+        return []
+    candidates = []
+    if os.environ.get("WINEPREFIX"):
+        candidates.append(os.environ["WINEPREFIX"])
+    candidates.append("~/.wine")
+    candidates.extend(sorted(glob.glob(os.path.expanduser("~/.local/share/wineprefixes/*"))))
+    found = []
+    for candidate in candidates:
+        prefix = WinePrefix(candidate)
+        if prefix.is_valid() and prefix.path not in (p.path for p in found):
+            found.append(prefix)
+    return found
+
+
+def scan_wine_prefixes(prefixes, max_workers=8, on_error=None):
+    """
+    Reads the uninstall entries of many Wine prefixes in parallel.
+    Returns a list of (WinePrefix, entries) in the order the prefixes were given.
+    Unchanged hives are served from the per-file mtime cache.
+    """
+    prefixes = [p if isinstance(p, WinePrefix) else WinePrefix(p) for p in prefixes]
+    prefixes = [p for p in prefixes if p.is_valid()]
+    if not prefixes:
+        return []
+
+    def scan(prefix):
+        try:
+            return prefix.uninstall_entries()
+        except Exception as e:
+            if on_error:
+                on_error(prefix, e)
+            return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(prefixes))) as pool:
+        return list(zip(prefixes, pool.map(scan, prefixes)))
+
+
+# --- Settings persistence ---
+
+class JsonSettingsStore:
+    """
+    Persists the settings dictionary as JSON without blocking the caller.
+
+    save() takes a snapshot of the settings (compact JSON) in the calling thread and
+    hands it to a background writer. If several saves arrive while a write is in
+    progress, only the newest snapshot is written. Every write goes to a temp file
+    that is fsync'ed and then moved into place with os.replace(), and the previous
+    good file is kept as a ".bak" backup, so a crash mid-write can't corrupt settings.
+    """
+
+    def __init__(self, path, on_saved=None, on_error=None):
+        self.path = path
+        self.backup_path = path + ".bak"
+        self.on_saved = on_saved # Called from the writer thread with the write latency in ms
+        self.on_error = on_error # Called from the writer thread with the exception
+        self._cond = threading.Condition()
+        self._pending = None # Newest snapshot that has not been written yet
+        self._writing = False
+        self._closed = False
+        self._thread = None
+        self._stats = {"save_requests": 0, "writes": 0, "coalesced": 0, "failures": 0,
+                       "last_latency_ms": 0.0, "max_latency_ms": 0.0, "total_latency_ms": 0.0}
+
+    def exists(self):
+        return os.path.exists(self.path) or os.path.exists(self.backup_path)
+
+    def load(self):
+        """
+        Loads the settings. Falls back to the last-good backup if the main file is
+        missing or unreadable. Returns (settings_dict, loaded_path), or ({}, None) if
+        there is nothing to load. Raises the original error if both files are bad.
+        """
+        first_error = None
+        for candidate in (self.path, self.backup_path):
+            if not os.path.exists(candidate):
+                continue
+            try:
+                with open(candidate, 'r', encoding='utf-8') as f:
+                    return json.load(f), candidate
+            except (ValueError, OSError) as e:
+                first_error = first_error or e
+        if first_error:
+            raise first_error
+        return {}, None
+
+    def save(self, settings):
+        """Snapshots `settings` and schedules it to be written in the background."""
+        payload = json.dumps(settings, separators=(',', ':'))
+        with self._cond:
+            if self._closed:
+                return
+            self._stats["save_requests"] += 1
+            if self._pending is not None:
+                self._stats["coalesced"] += 1
+            self._pending = payload
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._writer_loop, name="SettingsWriter", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def flush(self, timeout=5.0):
+        """Blocks until every pending snapshot has been written. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending is not None or self._writing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, discard=False):
+        """
+        Stops accepting saves. Pending data is written first unless `discard` is True;
+        either way no write is in progress when this returns.
+        """
+        with self._cond:
+            if discard:
+                self._pending = None
+            self._closed = True
+            self._cond.notify_all()
+        if not discard:
+            self.flush()
+        elif self._thread is not None:
+            # The queued data is dropped, but a write already under way finishes before
+            # this returns, so it can't recreate the files after the caller deletes them
+            self._thread.join()
+
+    def delete(self):
+        """Removes the settings file and its backup. Returns True if anything was deleted."""
+        deleted = False
+        for candidate in (self.path, self.backup_path):
+            if os.path.exists(candidate):
+                os.remove(candidate)
+                deleted = True
+        return deleted
+
+    def stats(self):
+        """Returns a copy of the save counters and latencies."""
+        with self._cond:
+            stats = dict(self._stats)
+        stats["avg_latency_ms"] = stats["total_latency_ms"] / stats["writes"] if stats["writes"] else 0.0
+        return stats
+
+    def _writer_loop(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._pending is None:
+                    self._cond.notify_all()
+                    return
+                payload, self._pending = self._pending, None
+                self._writing = True
+
+            started = time.perf_counter()
+            error = None
+            try:
+                self._write_atomically(payload)
+            except Exception as e:
+                error = e
+            latency_ms = (time.perf_counter() - started) * 1000
+
+            with self._cond:
+                self._writing = False
+                if error:
+                    self._stats["failures"] += 1
+                else:
+                    self._stats["writes"] += 1
+                    self._stats["last_latency_ms"] = latency_ms
+                    self._stats["total_latency_ms"] += latency_ms
+                    self._stats["max_latency_ms"] = max(self._stats["max_latency_ms"], latency_ms)
+                self._cond.notify_all()
+
+            if error and self.on_error:
+                self.on_error(error)
+            elif not error and self.on_saved:
+                self.on_saved(latency_ms)
+
+    def _write_atomically(self, payload):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        # The current file was itself written atomically, so it is the last good copy.
+        if os.path.exists(self.path):
+            os.replace(self.path, self.backup_path)
+        os.replace(temp_path, self.path)
+
+
+def program_key(program):
+    """
+    Returns a stable identifier for a program dictionary, assigning a new one the
+    first time a program is seen. The id is stored in the program itself ("Id"),
+    so it survives restarts and edits.
+    """
+    key = program.get("Id")
+    if not key:
+        key = program["Id"] = uuid.uuid4().hex
+    return key
+
+
+def parse_local_timestamp(value):
+    """Parses the "%Y-%m-%d %H:%M:%S" strings stored in LastUpdated fields. Returns epoch seconds or None."""
+    if not value or value == "N/A":
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+
+class ProgramSearchIndex:
+    """
+    In-memory search over the programs' names, networks, matched keywords, install
+    paths and source URLs.
+
+    Every query term must match. A term matches a word prefix through a sorted word
+    list (bisect), or anywhere in a program's fields through one pre-lowered string
+    per program. update() only re-indexes programs whose searchable fields changed.
+    """
+    WORD_SPLIT = re.compile(r"[^0-9a-z]+")
+
+    def __init__(self):
+        self._docs = {} # key -> (fields, haystack, words, lowered display name)
+        self._words = [] # Sorted (word, key) pairs
+        self.programs = {} # key -> program dict
+
+    @staticmethod
+    def fields(program):
+        """Returns the searchable strings of a program."""
+        values = [program.get("DisplayName"), program.get("Network"), *program.get("AlsoInNetworks", []),
+                  program.get("MatchedKeyword"), program.get("InstallLocation"), program.get("ExecutablePath"),
+                  program.get("ServerListURL"), *(program.get("ServerListTargetPaths") or {}),
+                  program.get("NodesListURL"), program.get("WinMXPatchURL")]
+        return tuple(v for v in values if v)
+
+    def update(self, programs):
+        """Brings the index in line with `programs` ({key: program dict})."""
+        for key in [k for k in self._docs if k not in programs]:
+            self.remove(key)
+        for key, program in programs.items():
+            fields = self.fields(program)
+            doc = self._docs.get(key)
+            if doc is None or doc[0] != fields:
+                self._index(key, program, fields)
+        self.programs = dict(programs)
+
+    def remove(self, key):
+        doc = self._docs.pop(key, None)
+        self.programs.pop(key, None)
+        if doc:
+            for word in doc[2]:
+                index = bisect_left(self._words, (word, key))
+                if index < len(self._words) and self._words[index] == (word, key):
+                    del self._words[index]
+
+    def _index(self, key, program, fields):
+        self.remove(key)
+        haystack = "\n".join(fields).lower()
+        words = set(self.WORD_SPLIT.split(haystack)) - {""}
+        for word in words:
+            insort(self._words, (word, key))
+        self._docs[key] = (fields, haystack, words, (program.get("DisplayName") or "").lower())
+        self.programs[key] = program
+
+    def search(self, query, limit=None):
+        """
+        Returns the keys of the programs matching every term of `query`, best first:
+        names starting with the query, then programs with more word-prefix matches, then by name.
+        """
+        query = query.strip().lower()
+        terms = query.split()
+        if not terms:
+            return []
+        candidates = None
+        prefix_hits = collections.Counter()
+        for term in terms:
+            hits = set()
+            index = bisect_left(self._words, (term,))
+            while index < len(self._words) and self._words[index][0].startswith(term):
+                hits.add(self._words[index][1])
+                index += 1
+            prefix_hits.update(hits)
+            pool = self._docs if candidates is None else candidates
+            hits.update(key for key in pool if key not in hits and term in self._docs[key][1])
+            candidates = hits if candidates is None else candidates & hits
+            if not candidates:
+                return []
+        ranked = sorted(candidates, key=lambda key: (not self._docs[key][3].startswith(query),
+                                                     -prefix_hits[key], self._docs[key][3]))
+        return ranked[:limit] if limit else ranked
+
+
+class SqliteSettingsStore:
+    """
+    Optional SQLite storage engine with the same interface as JsonSettingsStore.
+
+    Programs, their sources and targets, URL validators and download events live in
+    separate, indexed tables. save() diffs the settings against the previous save in
+    the calling thread and only the changed rows are written, in one transaction, by
+    a background thread.
+
+    A `read_only` store opens an existing database without creating or changing
+    anything (no schema setup, no journal mode change); it can't save.
+    """
+    SCHEMA_VERSION = 1
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS programs (
+            id TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            display_name TEXT,
+            network TEXT,
+            source TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS sources (
+            program_id TEXT NOT NULL REFERENCES programs(id) ON DELETE CASCADE,
+            url TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            PRIMARY KEY (program_id, url, kind)
+        );
+        CREATE TABLE IF NOT EXISTS targets (
+            program_id TEXT NOT NULL REFERENCES programs(id) ON DELETE CASCADE,
+            url TEXT NOT NULL,
+            path TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            last_updated REAL,
+            PRIMARY KEY (program_id, url, path)
+        );
+        CREATE TABLE IF NOT EXISTS validators (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            content_length INTEGER,
+            sha256 TEXT,
+            checked_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS download_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            program_id TEXT,
+            url TEXT NOT NULL,
+            status TEXT NOT NULL,
+            bytes INTEGER,
+            duration_ms REAL,
+            target TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_programs_network ON programs(network);
+        CREATE INDEX IF NOT EXISTS idx_sources_url ON sources(url);
+        CREATE INDEX IF NOT EXISTS idx_targets_last_updated ON targets(last_updated);
+        CREATE INDEX IF NOT EXISTS idx_targets_url ON targets(url);
+        CREATE INDEX IF NOT EXISTS idx_events_url_ts ON download_events(url, ts);
+        CREATE INDEX IF NOT EXISTS idx_events_ts ON download_events(ts);
+    """
+
+    def __init__(self, path, on_saved=None, on_error=None, read_only=False):
+        self.path = path
+        self.on_saved = on_saved
+        self.on_error = on_error
+        self.read_only = read_only
+        self._cond = threading.Condition()
+        self._pending = None # Merged changeset waiting to be written
+        self._failed = None # Changeset whose write failed; merged into the next one
+        self._writing = False
+        self._closed = False
+        self._thread = None
+        self._connections = {} # thread -> its connection; each thread reuses one
+        self._connections_lock = threading.Lock()
+        self._saved_rows = {} # program id -> row tuple as of the last save() call
+        self._saved_settings = {} # top-level key -> JSON as of the last save() call
+        self._stats = {"save_requests": 0, "writes": 0, "coalesced": 0, "failures": 0, "rows_written": 0,
+                       "last_latency_ms": 0.0, "max_latency_ms": 0.0, "total_latency_ms": 0.0}
+        if read_only:
+            return
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('schema_version', ?)", (str(self.SCHEMA_VERSION),))
+
+    def _connect(self):
+        """
+        The calling thread's connection, opened on first use. `with conn:` only commits,
+        so connections stay open for reuse and are closed by close(), or once their thread
+        has finished (e.g. the worker pool of an update).
+        """
+        thread = threading.current_thread()
+        with self._connections_lock:
+            conn = self._connections.get(thread)
+            if conn is not None:
+                return conn
+            finished = [self._connections.pop(t) for t in list(self._connections) if not t.is_alive()]
+        for old in finished:
+            old.close()
+        conn = self._open_connection()
+        with self._connections_lock:
+            self._connections[thread] = conn
+        return conn
+
+    def _open_connection(self):
+        import sqlite3 # Optional engine: only loaded when a database is in use
+
+        # check_same_thread=False only so close() can close every thread's connection;
+        # each connection is still used by its own thread alone
+        if self.read_only:
+            import urllib.request
+
+            return sqlite3.connect(f"file:{urllib.request.pathname2url(os.path.abspath(self.path))}?mode=ro",
+                                   timeout=10, uri=True, check_same_thread=False)
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _close_connections(self):
+        with self._connections_lock:
+            connections, self._connections = list(self._connections.values()), {}
+        for conn in connections:
+            conn.close()
+
+    # --- Interface shared with JsonSettingsStore ---
+
+    def exists(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM settings UNION ALL SELECT 1 FROM programs LIMIT 1").fetchone() is not None
+
+    def load(self):
+        """Returns (settings_dict, path) in the same shape as the JSON settings file."""
+        with self._connect() as conn:
+            settings = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM settings")}
+            rows = conn.execute("SELECT id, position, display_name, network, source, data FROM programs ORDER BY position").fetchall()
+        programs = [json.loads(row[5]) for row in rows]
+        settings["programs"] = programs
+        # Remember what is on disk, so the first save() only writes real changes.
+        self._saved_rows = {row[0]: row[1:] for row in rows}
+        self._saved_settings = {k: json.dumps(v, sort_keys=True) for k, v in settings.items() if k != "programs"}
+        return settings, self.path
+
+    def save(self, settings):
+        """Diffs `settings` against the last save and schedules the changed rows to be written."""
+        rows = {}
+        for position, program in enumerate(settings.get("programs", [])):
+            pid = program_key(program) # Assigned before serializing, so the id is stored too
+            rows[pid] = (position, program.get("DisplayName"), program.get("Network"),
+                          program.get("Source"), json.dumps(program, sort_keys=True))
+        upserts = {pid: row for pid, row in rows.items() if self._saved_rows.get(pid) != row}
+        deletes = set(self._saved_rows) - set(rows)
+
+        top_level = {k: json.dumps(v, sort_keys=True) for k, v in settings.items() if k != "programs"}
+        settings_upserts = {k: v for k, v in top_level.items() if self._saved_settings.get(k) != v}
+        settings_deletes = set(self._saved_settings) - set(top_level)
+
+        self._saved_rows = rows
+        self._saved_settings = top_level
+        changeset = {"upserts": upserts, "deletes": deletes, "settings_upserts": settings_upserts,
+                     "settings_deletes": settings_deletes}
+
+        with self._cond:
+            if self._closed or not (upserts or deletes or settings_upserts or settings_deletes or self._failed):
+                return
+            self._stats["save_requests"] += 1
+            if self._pending is None:
+                # A failed write is retried with the next save, older changes first
+                self._pending, self._failed = self._failed or self._empty_changeset(), None
+            else:
+                self._stats["coalesced"] += 1
+            self._merge_changeset(self._pending, changeset)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._writer_loop, name="SqliteSettingsWriter", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def flush(self, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending is not None or self._writing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, discard=False):
+        with self._cond:
+            if discard:
+                self._pending = None
+            elif self._failed:
+                # One last try for a changeset that failed to write
+                failed, self._failed = self._failed, None
+                if self._pending is not None:
+                    self._merge_changeset(failed, self._pending)
+                self._pending = failed
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._writer_loop, name="SqliteSettingsWriter", daemon=True)
+                    self._thread.start()
+            self._closed = True
+            self._cond.notify_all()
+        if not discard:
+            self.flush()
+        elif self._thread is not None:
+            # The queued data is dropped, but a write already under way finishes before
+            # this returns, so it can't recreate the files after the caller deletes them
+            self._thread.join()
+        self._close_connections()
+
+    def delete(self):
+        deleted = False
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+                deleted = True
+        return deleted
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+        stats["avg_latency_ms"] = stats["total_latency_ms"] / stats["writes"] if stats["writes"] else 0.0
+        return stats
+
+    # --- SQLite-only features ---
+
+    def migrate_from_json(self, json_path):
+        """
+        One-time import of an existing p2p_helper_settings.json. Does nothing if the
+        database already holds data or the migration has run before. Returns True if data was imported.
+        """
+        with self._connect() as conn:
+            if conn.execute("SELECT value FROM meta WHERE key = 'migrated_from'").fetchone():
+                return False
+        if self.exists() or not os.path.exists(json_path):
+            return False
+        settings, _ = JsonSettingsStore(json_path).load()
+        self._write_changeset(self._full_changeset(settings))
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from', ?)", (os.path.abspath(json_path),))
+        return True
+
+    def targets_older_than(self, days, include_never_updated=True):
+        """Returns target rows (program name, kind, url, path, last_updated) not updated in `days` days."""
+        cutoff = time.time() - days * 86400
+        query = ("SELECT p.display_name, t.kind, t.url, t.path, t.last_updated FROM targets t "
+                 "JOIN programs p ON p.id = t.program_id WHERE t.last_updated < ?")
+        if include_never_updated:
+            query += " OR t.last_updated IS NULL"
+        with self._connect() as conn:
+            return conn.execute(query + " ORDER BY t.last_updated", (cutoff,)).fetchall()
+
+    def programs_using_url(self, url):
+        """Returns the display names of the programs that download from `url`."""
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute(
+                "SELECT DISTINCT p.display_name FROM sources s JOIN programs p ON p.id = s.program_id WHERE s.url = ?", (url,))]
+
+    def get_validator(self, url):
+        """Returns the cached validators for `url` as a dict, or None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT etag, last_modified, content_length, sha256, checked_at FROM validators WHERE url = ?", (url,)).fetchone()
+        if not row:
+            return None
+        return dict(zip(("etag", "last_modified", "content_length", "sha256", "checked_at"), row))
+
+    def set_validator(self, url, etag=None, last_modified=None, content_length=None, sha256=None):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO validators (url, etag, last_modified, content_length, sha256, checked_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", (url, etag, last_modified, content_length, sha256, time.time()))
+
+    def record_download_event(self, url, status, program=None, target=None, size=None, duration_ms=None, ts=None):
+        """
+        Appends one row to the download history. Without a `program`, the event is
+        attributed to the program that has `target` for `url`, or else to the only
+        program using `url` (NULL when several do).
+        """
+        with self._connect() as conn:
+            conn.execute("INSERT INTO download_events (ts, program_id, url, status, bytes, duration_ms, target) VALUES "
+                         "(?, COALESCE(?, (SELECT program_id FROM targets WHERE url = ? AND path = ? LIMIT 1), "
+                         "(SELECT MIN(program_id) FROM sources WHERE url = ? HAVING COUNT(DISTINCT program_id) = 1)), "
+                         "?, ?, ?, ?, ?)",
+                         (ts or time.time(), program_key(program) if program else None, url, target, url,
+                          url, status, size, duration_ms, target))
+
+    def download_history(self, url=None, limit=100):
+        """Returns the newest download events, optionally for a single URL."""
+        query = "SELECT ts, url, status, bytes, duration_ms, target FROM download_events"
+        params = ()
+        if url:
+            query += " WHERE url = ?"
+            params = (url,)
+        with self._connect() as conn:
+            return conn.execute(query + " ORDER BY ts DESC LIMIT ?", params + (limit,)).fetchall()
+
+    # --- Internals ---
+
+    @staticmethod
+    def _empty_changeset():
+        return {"upserts": {}, "deletes": set(), "settings_upserts": {}, "settings_deletes": set()}
+
+    @staticmethod
+    def _merge_changeset(into, newer):
+        """Applies changeset `newer` on top of `into`, in place."""
+        for pid in newer["deletes"]:
+            into["upserts"].pop(pid, None)
+            into["deletes"].add(pid)
+        for pid, row in newer["upserts"].items():
+            into["deletes"].discard(pid)
+            into["upserts"][pid] = row
+        for key in newer["settings_deletes"]:
+            into["settings_upserts"].pop(key, None)
+            into["settings_deletes"].add(key)
+        for key, value in newer["settings_upserts"].items():
+            into["settings_deletes"].discard(key)
+            into["settings_upserts"][key] = value
+
+    def _full_changeset(self, settings):
+        self._saved_rows = {}
+        self._saved_settings = {}
+        upserts = {}
+        for position, program in enumerate(settings.get("programs", [])):
+            pid = program_key(program) # Assigned before serializing, so the id is stored too
+            upserts[pid] = (position, program.get("DisplayName"), program.get("Network"),
+                             program.get("Source"), json.dumps(program, sort_keys=True))
+        settings_upserts = {k: json.dumps(v, sort_keys=True) for k, v in settings.items() if k != "programs"}
+        return {"upserts": upserts, "deletes": set(), "settings_upserts": settings_upserts, "settings_deletes": set()}
+
+    @staticmethod
+    def _program_links(program):
+        """Expands a program into its (url, kind) sources and (url, path, kind, last_updated) targets."""
+        sources, targets = [], []
+        server_updated = parse_local_timestamp(program.get("LastUpdated"))
+        for url, paths in (program.get("ServerListTargetPaths") or {}).items():
+            sources.append((url, "server_list"))
+            for path in paths:
+                targets.append((url, path, "server_list", server_updated))
+        if program.get("NodesListURL"):
+            sources.append((program["NodesListURL"], "nodes"))
+            if program.get("NodesListTargetPath"):
+                targets.append((program["NodesListURL"], program["NodesListTargetPath"], "nodes",
+                                parse_local_timestamp(program.get("NodesLastUpdated"))))
+        if program.get("WinMXPatchURL"):
+            sources.append((program["WinMXPatchURL"], "patch"))
+            if program.get("WinMXPatchTarget"):
+                targets.append((program["WinMXPatchURL"], program["WinMXPatchTarget"], "patch",
+                                parse_local_timestamp(program.get("WinMXPatchLastUpdated"))))
+        return sources, targets
+
+    def _write_changeset(self, changeset):
+        rows_written = 0
+        conn = self._connect()
+        with conn: # One transaction per changeset
+            for pid in changeset["deletes"]:
+                conn.execute("DELETE FROM programs WHERE id = ?", (pid,))
+                rows_written += 1
+            for pid, row in changeset["upserts"].items():
+                conn.execute("INSERT OR REPLACE INTO programs (id, position, display_name, network, source, data) VALUES (?, ?, ?, ?, ?, ?)",
+                             (pid,) + row)
+                conn.execute("DELETE FROM sources WHERE program_id = ?", (pid,))
+                conn.execute("DELETE FROM targets WHERE program_id = ?", (pid,))
+                sources, targets = self._program_links(json.loads(row[4]))
+                conn.executemany("INSERT OR IGNORE INTO sources (program_id, url, kind) VALUES (?, ?, ?)",
+                                 [(pid,) + source for source in sources])
+                conn.executemany("INSERT OR IGNORE INTO targets (program_id, url, path, kind, last_updated) VALUES (?, ?, ?, ?, ?)",
+                                 [(pid,) + target for target in targets])
+                rows_written += 1 + len(sources) + len(targets)
+            for key in changeset["settings_deletes"]:
+                conn.execute("DELETE FROM settings WHERE key = ?", (key,))
+                rows_written += 1
+            conn.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", changeset["settings_upserts"].items())
+            rows_written += len(changeset["settings_upserts"])
+        return rows_written
+
+    def _writer_loop(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._pending is None:
+                    self._cond.notify_all()
+                    return
+                changeset, self._pending = self._pending, None
+                self._writing = True
+
+            started = time.perf_counter()
+            error = None
+            rows_written = 0
+            try:
+                rows_written = self._write_changeset(changeset)
+            except Exception as e:
+                error = e
+            latency_ms = (time.perf_counter() - started) * 1000
+
+            with self._cond:
+                self._writing = False
+                if error:
+                    # Newer changes go on top of the failed ones: with the write already queued,
+                    # else with the next save (or close()), so a failing database isn't retried in a loop
+                    if self._failed is not None:
+                        self._merge_changeset(self._failed, changeset)
+                        changeset = self._failed
+                    if self._pending is not None:
+                        self._merge_changeset(changeset, self._pending)
+                        self._pending, self._failed = changeset, None
+                    else:
+                        self._failed = changeset
+                    self._stats["failures"] += 1
+                else:
+                    self._stats["writes"] += 1
+                    self._stats["rows_written"] += rows_written
+                    self._stats["last_latency_ms"] = latency_ms
+                    self._stats["total_latency_ms"] += latency_ms
+                    self._stats["max_latency_ms"] = max(self._stats["max_latency_ms"], latency_ms)
+                self._cond.notify_all()
+
+            if error and self.on_error:
+                self.on_error(error)
+            elif not error and self.on_saved:
+                self.on_saved(latency_ms)
+
+
+def open_settings_store(json_path, on_saved=None, on_error=None, read_only=False):
+    """
+    Returns the settings store to use. The SQLite engine is used when the
+    P2P_HELPER_STORAGE environment variable is "sqlite" or a settings database
+    already exists; the existing JSON settings are migrated into it once.
+    Otherwise the JSON store is used.
+
+    With `read_only` nothing is created or migrated: an existing database holding
+    settings is opened read-only, otherwise (also if it can't be read) the JSON
+    settings are read as they are.
+    """
+    db_path = os.path.splitext(json_path)[0] + ".db"
+    if read_only:
+        if os.path.exists(db_path):
+            import sqlite3
+
+            store = SqliteSettingsStore(db_path, read_only=True)
+            try:
+                if store.exists() or not os.path.exists(json_path):
+                    return store
+            except sqlite3.Error:
+                pass # Not a settings database (yet), e.g. empty or never set up
+            store.close()
+        return JsonSettingsStore(json_path)
+    if os.environ.get("P2P_HELPER_STORAGE", "").lower() == "sqlite" or os.path.exists(db_path):
+        store = SqliteSettingsStore(db_path, on_saved=on_saved, on_error=on_error)
+        store.migrate_from_json(json_path)
+        return store
+    return JsonSettingsStore(json_path, on_saved=on_saved, on_error=on_error)
+
+
+# Metrics exported by MetricsServer: name (without the "p2p_helper_" prefix) -> (type, help)
+METRICS = {
+    "downloads_total": ("counter", "Source fetches by outcome, as recorded in the download journal"),
+    "cache_lookups_total": ("counter", "Fetches by cache result: not_modified (conditional 304), same_hash "
+                                       "(downloaded again, content unchanged) or changed"),
+    "http_requests_total": ("counter", "HTTP requests by host, operation and result (2xx to 5xx, or error)"),
+    "http_bytes_total": ("counter", "Response body bytes received, by host"),
+    "http_request_duration_seconds": ("histogram", "Total time of HTTP requests, by host"),
+    "scan_duration_seconds": ("histogram", "Duration of program scans"),
+    "ui_stall_seconds": ("histogram", "Stalls of the GUI's event loop found by StallWatchdog"),
+    "scheduler_lag_seconds": ("histogram", "How long after their scheduled time due sources were refreshed"),
+    "scheduler_due_sources": ("gauge", "Sources that were due at the last scheduler run"),
+    "update_queue_depth": ("gauge", "Update jobs waiting to start"),
+    "update_jobs_running": ("gauge", "Update jobs downloading now"),
+}
+
+
+class MetricsRegistry:
+    """
+    In-process counters, gauges and histograms, rendered in the Prometheus text format.
+    An update is one dictionary change under a lock held for nothing else; render()
+    copies the values under that lock and formats them after releasing it.
+    """
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300) # Histogram upper bounds, in seconds
+
+    def __init__(self, definitions, prefix="p2p_helper_"):
+        self.definitions = definitions
+        self.prefix = prefix
+        self._values = {} # (name, sorted label items) -> value; histograms: [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect_left(self.BUCKETS, value) # The first bucket with value <= its bound
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.BUCKETS) + 1) + [0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+
+    @staticmethod
+    def _labels(items, extra=()):
+        items = list(items) + list(extra)
+        if not items:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in items)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + "}"
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format (version 0.0.4)."""
+        values = self.snapshot()
+        lines = []
+        for name, (kind, help_text) in self.definitions.items():
+            full_name = self.prefix + name
+            lines += [f"# HELP {full_name} {help_text}", f"# TYPE {full_name} {kind}"]
+            for (metric, labels), value in sorted(values.items(), key=lambda item: item[0]):
+                if metric != name:
+                    continue
+                if kind != "histogram":
+                    lines.append(f"{full_name}{self._labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS + ("+Inf",), value[:-1]):
+                    cumulative += count
+                    lines.append(f"{full_name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{full_name}_sum{self._labels(labels)} {value[-1]}")
+                lines.append(f"{full_name}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry(METRICS)
+
+
+class MetricsServer:
+    """
+    Serves a MetricsRegistry at http://HOST:PORT/metrics for Prometheus to scrape, from
+    a daemon thread. Binds to localhost unless told otherwise; port 0 picks a free port.
+    """
+
+    def __init__(self, registry, port, host="127.0.0.1"):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer # Deferred, only service mode needs them
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address[:2]
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class HttpTrace:
+    """
+    Timings of one HTTP operation. `phases` holds milliseconds per phase: dns,
+    connect, tls (https only), ttfb (request sent until the response headers) and
+    transfer (reading the body); redirects add to the same phases and to `connections`.
+    """
+    PHASES = ("dns", "connect", "tls", "ttfb", "transfer")
+
+    def __init__(self, url, op):
+        self.url = url
+        self.host = urllib.parse.urlsplit(url).hostname or ""
+        self.op = op # "download", "head", "link_check" or "github_api"
+        self.ts = time.time()
+        self.phases = {}
+        self.status = None # Of the last response
+        self.bytes = 0
+        self.connections = 0
+        self.total_ms = None
+        self.error = None
+        self.error_phase = None # The phase in progress when it failed, or "status" for an HTTP error status
+        self._started = self._last = time.perf_counter()
+        self._phase = None # The last phase marked
+
+    def mark(self, phase):
+        """Ends `phase`: the time since the previous mark is added to it."""
+        now = time.perf_counter()
+        self.phases[phase] = round(self.phases.get(phase, 0) + (now - self._last) * 1000, 2)
+        self._last = now
+        self._phase = phase
+
+    def pending_phase(self):
+        """The phase that follows the last one marked."""
+        if self._phase is None:
+            return "dns"
+        if self._phase == "connect" and self.url.startswith("https:"):
+            return "tls"
+        return {"dns": "connect", "connect": "ttfb", "tls": "ttfb"}.get(self._phase, "transfer")
+
+    def fail(self, error):
+        self.error = str(error) or type(error).__name__
+        if isinstance(getattr(error, "code", None), int): # urllib.error.HTTPError: the server answered
+            self.status = error.code
+            self.error_phase = "status"
+        else:
+            self.error_phase = self.pending_phase()
+
+    def finish(self):
+        if self.error is None and self._phase in ("ttfb", "transfer"):
+            self.mark("transfer")
+        self.total_ms = round((time.perf_counter() - self._started) * 1000, 2)
+
+    def to_dict(self):
+        return {"ts": round(self.ts, 3), "op": self.op, "url": self.url, "host": self.host, "status": self.status,
+                "bytes": self.bytes, "total_ms": self.total_ms, "phases": self.phases, "connections": self.connections,
+                "error": self.error, "error_phase": self.error_phase}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values` (None when empty)."""
+    values = sorted(values)
+    if not values:
+        return None
+    return values[max(0, min(len(values) - 1, -(-len(values) * pct // 100) - 1))]
+
+
+class HttpTracer:
+    """
+    Collects an HttpTrace for every HTTP operation made through open_url() inside
+    trace(). The connection classes of the opener find the trace of their thread and
+    mark the phases on it. Finished traces are kept in memory (the newest `keep`) and,
+    once open_log() was called, appended as JSON lines to a rotating trace file by a
+    QueueListener thread, like LogSink does for the activity log.
+    """
+
+    def __init__(self, keep=5000):
+        self._local = threading.local()
+        self._records = collections.deque(maxlen=keep) # to_dict() of finished traces, oldest first
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger("p2p_helper.http")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self._listener = None
+        self._queue_handler = None
+        self._opened_at = None # When open_log() was called; older records in the file are history
+
+    def current(self):
+        """The trace running on this thread, or None."""
+        return getattr(self._local, "trace", None)
+
+    def last(self):
+        """The last trace this thread finished, or None."""
+        return getattr(self._local, "last", None)
+
+    @contextlib.contextmanager
+    def trace(self, url, op):
+        """Traces the HTTP operation of the block. Yields the HttpTrace (None for local files)."""
+        if not url.startswith(("http:", "https:")):
+            yield None
+            return
+        trace = HttpTrace(url, op)
+        self._local.trace = trace
+        try:
+            yield trace
+        except BaseException as e:
+            trace.fail(e)
+            raise
+        finally:
+            self._local.trace = None
+            trace.finish()
+            self._local.last = trace
+            self.record(trace.to_dict())
+
+    def record(self, record):
+        with self._lock:
+            self._records.append(record)
+        host = record["host"]
+        status = record.get("status") # Also set for HTTP error statuses; None when no response came
+        metrics.inc("http_requests_total", host=host, op=record["op"], result=f"{status // 100}xx" if status else "error")
+        metrics.inc("http_bytes_total", record.get("bytes") or 0, host=host)
+        metrics.observe("http_request_duration_seconds", (record.get("total_ms") or 0) / 1000, host=host)
+        if self._listener:
+            self.logger.info(json.dumps(record))
+
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def load(self, path):
+        """
+        Puts the records of a trace file before the ones kept in memory (corrupt lines are
+        skipped). Once open_log() was called only records from before that are taken, as
+        the later ones are in memory already.
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                lines = f.readlines()[-self._records.maxlen:]
+        except OSError:
+            return
+        loaded = []
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and record.get("host") is not None:
+                if self._opened_at is None or record.get("ts", 0) < self._opened_at:
+                    loaded.append(record)
+        with self._lock:
+            self._records = collections.deque(loaded + list(self._records), maxlen=self._records.maxlen)
+
+    def open_log(self, path, max_bytes=1024 * 1024, backup_count=1):
+        """Appends every trace from now on to the rotating file at `path`. Earlier traces in it can be load()ed."""
+        if self._listener:
+            return
+        self._opened_at = time.time()
+        file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                            encoding="utf-8", delay=True)
+        file_handler.setFormatter(logging.Formatter("%(message)s"))
+        log_queue = queue.SimpleQueue()
+        self._queue_handler = logging.handlers.QueueHandler(log_queue)
+        self.logger.addHandler(self._queue_handler)
+        self._listener = logging.handlers.QueueListener(log_queue, file_handler)
+        self._listener.start()
+
+    def close(self):
+        """Stops the file writer after it has written everything queued so far."""
+        if self._listener:
+            self._listener.stop()
+            self.logger.removeHandler(self._queue_handler)
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+
+    def summary(self, records=None):
+        """
+        Per-host statistics of `records` (default: all kept), busiest host first:
+        requests, errors, bytes, p50/p95/p99 of the total time and the p95 of every phase.
+        """
+        by_host = collections.defaultdict(list)
+        for record in self.records() if records is None else records:
+            by_host[record.get("host") or "?"].append(record)
+        rows = []
+        for host, host_records in by_host.items():
+            totals = [r["total_ms"] for r in host_records if r.get("total_ms") is not None]
+            rows.append({
+                "host": host, "requests": len(host_records),
+                "errors": sum(1 for r in host_records if r.get("error")),
+                "bytes": sum(r.get("bytes") or 0 for r in host_records),
+                "p50_ms": percentile(totals, 50), "p95_ms": percentile(totals, 95), "p99_ms": percentile(totals, 99),
+                "phase_p95_ms": {phase: percentile([r["phases"][phase] for r in host_records if phase in (r.get("phases") or {})], 95)
+                                 for phase in HttpTrace.PHASES},
+            })
+        rows.sort(key=lambda row: (-row["requests"], row["host"]))
+        return rows
+
+    def failures(self, limit=50):
+        """The newest `limit` failed records, newest first."""
+        return [r for r in reversed(self.records()) if r.get("error")][:limit]
+
+
+http_tracer = HttpTracer()
+
+
+def describe_failed_trace(url):
+    """Returns ' (failed during PHASE after N ms)' if the last trace of this thread is a failed request for `url`, else ''."""
+    trace = http_tracer.last()
+    if trace is None or trace.url != url or trace.error is None:
+        return ""
+    if trace.error_phase == "status":
+        return f" (HTTP {trace.status} after {trace.total_ms:.0f} ms)"
+    return f" (failed during {trace.error_phase} after {trace.total_ms:.0f} ms)"
+
+
+_url_handlers = ()
+_url_opener = None
+_url_opener_lock = threading.Lock()
+
+
+def _build_url_opener(handlers):
+    """An urllib opener whose http(s) connections mark the phases of the running HttpTrace."""
+    import http.client
+    import socket
+    import urllib.request
+
+    def traced_create_connection(trace, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+        # socket.create_connection() split in two, so the DNS lookup is timed on its own
+        host, port = address
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        trace.mark("dns")
+        error = OSError(f"getaddrinfo returned nothing for {host}")
+        for family, socktype, proto, _name, sockaddr in infos:
+            try:
+                sock = socket.create_connection(sockaddr[:2], timeout, source_address)
+            except OSError as e:
+                error = e
+                continue
+            trace.mark("connect")
+            return sock
+        raise error
+
+    class TracedConnectionMixin:
+        def connect(self):
+            trace = http_tracer.current()
+            if trace is not None:
+                trace.connections += 1
+                self._create_connection = lambda *args, **kwargs: traced_create_connection(trace, *args, **kwargs)
+            super().connect()
+            if trace is not None and isinstance(self, http.client.HTTPSConnection):
+                trace.mark("tls")
+
+        def getresponse(self):
+            response = super().getresponse()
+            trace = http_tracer.current()
+            if trace is not None:
+                trace.mark("ttfb")
+                trace.status = response.status
+            return response
+
+    class TracedHTTPConnection(TracedConnectionMixin, http.client.HTTPConnection):
+        pass
+
+    class TracedHTTPSConnection(TracedConnectionMixin, http.client.HTTPSConnection):
+        pass
+
+    class TracedHTTPHandler(urllib.request.HTTPHandler):
+        def http_open(self, req):
+            return self.do_open(TracedHTTPConnection, req)
+
+    class TracedHTTPSHandler(urllib.request.HTTPSHandler):
+        def https_open(self, req):
+            return self.do_open(TracedHTTPSConnection, req, context=self._context)
+
+    return urllib.request.build_opener(*handlers, TracedHTTPHandler(), TracedHTTPSHandler())
+
+
+def install_url_handlers(*handlers):
+    """Adds urllib handlers (a ProxyHandler, say) to the opener behind open_url(); no arguments restores the default."""
+    global _url_handlers, _url_opener
+    with _url_opener_lock:
+        _url_handlers = handlers
+        _url_opener = None
+
+
+def open_url(request, timeout):
+    """urllib.request.urlopen() through the traced opener: inside http_tracer.trace() the phases are timed."""
+    global _url_opener
+    with _url_opener_lock:
+        if _url_opener is None:
+            _url_opener = _build_url_opener(_url_handlers)
+        opener = _url_opener
+    return opener.open(request, timeout=timeout)
+
+
+class FetchResult:
+    """What fetch_to_file() downloaded: where it went, its size, hash and HTTP validators."""
+
+    def __init__(self, url, path, size, sha256, duration_ms, status=None, etag=None, last_modified=None):
+        self.url = url
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.duration_ms = duration_ms
+        self.status = status
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def validator(self):
+        """The HTTP validators as a dict (empty for local files)."""
+        return {k: v for k, v in (("etag", self.etag), ("last_modified", self.last_modified)) if v}
+
+
+def file_sha256(path, chunk_size=64 * 1024):
+    """The SHA-256 of a local file as hex, or None if it can't be read."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def replace_file(source_path, target_path):
+    """
+    Copies `source_path` over `target_path` in one step: the copy goes to a temp file
+    beside the target and is then renamed over it, so readers never see a half-written
+    file. The target keeps its permission bits; a new file gets the usual umask default.
+    """
+    target_dir = os.path.dirname(os.path.abspath(target_path))
+    os.makedirs(target_dir, exist_ok=True)
+    try:
+        mode = os.stat(target_path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = None
+    # A plain exclusive open (not mkstemp, which makes the file 0600), so a new target
+    # gets the umask default without touching the process-wide umask
+    temp_path = os.path.join(target_dir, f".p2p_helper_{uuid.uuid4().hex}.part")
+    try:
+        with open(source_path, "rb") as src, open(temp_path, "xb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        if mode is not None:
+            os.chmod(temp_path, mode)
+        os.replace(temp_path, target_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+
+def fetch_to_file(url, dest_path=None, timeout=60, chunk_size=64 * 1024, validator=None, on_progress=None):
+    """
+    Downloads `url` (http, https or file) and returns a FetchResult. Replaces
+    urllib.request.urlretrieve(): the body is hashed while it streams, and a
+    `dest_path` is only replaced once the download is complete. Without a
+    `dest_path` the data goes to a temporary file the caller must remove.
+
+    With a `validator` ({"etag", "last_modified"} from an earlier fetch) the request is
+    conditional; if the server answers 304 Not Modified, nothing is written and the
+    result has status 304 and no path.
+
+    `on_progress(bytes_so_far, total_bytes)` is called after every chunk; the total is
+    None when the server doesn't send a Content-Length.
+
+    HTTP downloads are traced by http_tracer (op "download"); a 304 is not an error.
+    """
+    with http_tracer.trace(url, "download") as trace:
+        result = _fetch_to_file(url, dest_path, timeout, chunk_size, validator, on_progress)
+        if trace is not None:
+            trace.bytes = result.size
+        return result
+
+
+def _fetch_to_file(url, dest_path, timeout, chunk_size, validator, on_progress):
+    import urllib.error # Deferred, the GUI doesn't need these until the first download
+    import urllib.request
+
+    started = time.perf_counter()
+    request = url
+    if validator and (validator.get("etag") or validator.get("last_modified")):
+        headers = {}
+        if validator.get("etag"):
+            headers["If-None-Match"] = validator["etag"]
+        if validator.get("last_modified"):
+            headers["If-Modified-Since"] = validator["last_modified"]
+        request = urllib.request.Request(url, headers=headers)
+    if dest_path:
+        fd, temp_path = tempfile.mkstemp(prefix=".p2p_helper_", suffix=".part", dir=os.path.dirname(os.path.abspath(dest_path)))
+    else:
+        fd, temp_path = tempfile.mkstemp(prefix="p2p_helper_")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out, open_url(request, timeout) as response:
+            headers = response.headers
+            total = int(headers["Content-Length"]) if (headers.get("Content-Length") or "").isdigit() else None
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                out.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+                if on_progress:
+                    on_progress(size, total)
+        if dest_path:
+            os.replace(temp_path, dest_path)
+            temp_path = dest_path
+    except urllib.error.HTTPError as e:
+        os.remove(temp_path)
+        if e.code != 304:
+            raise
+        return FetchResult(url, None, 0, None, (time.perf_counter() - started) * 1000, status=304,
+                           etag=validator.get("etag"), last_modified=validator.get("last_modified"))
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return FetchResult(url, temp_path, size, digest.hexdigest(), (time.perf_counter() - started) * 1000,
+                       status=getattr(response, "status", None), etag=headers.get("ETag"),
+                       last_modified=headers.get("Last-Modified"))
+
+
+def remote_last_modified(url, timeout=10):
+    """
+    Returns when the file at `url` last changed on the server, as a local datetime, or
+    None if that can't be told. raw.githubusercontent.com files are looked up through the
+    GitHub API (date of the last commit touching the file), other URLs by the
+    Last-Modified header of a HEAD request. Local file URLs are not checked.
+    """
+    import urllib.request
+
+    if url.startswith("file:"):
+        return None
+    try:
+        if "raw.githubusercontent.com" in url:
+            # https://raw.githubusercontent.com/USER/REPO/BRANCH/PATH/TO/FILE
+            parts = urllib.parse.urlparse(url).path.split("/")
+            if len(parts) < 5:
+                return None
+            user, repo, branch, file_path = parts[1], parts[2], parts[3], "/".join(parts[4:])
+            api_url = f"https://api.github.com/repos/{user}/{repo}/commits?path={file_path}&sha={branch}&per_page=1"
+            # The GitHub API requires a User-Agent header
+            request = urllib.request.Request(api_url, headers={"User-Agent": "P2P-Connection-Helper"})
+            with http_tracer.trace(api_url, "github_api") as trace, open_url(request, timeout) as response:
+                body = response.read()
+                trace.bytes = len(body)
+            data = json.loads(body)
+            if not data:
+                return None
+            # ISO 8601, e.g. "2023-10-27T18:30:00Z"
+            committed = data[0]["commit"]["committer"]["date"]
+            return datetime.fromisoformat(committed.replace("Z", "+00:00")).astimezone(None)
+        with http_tracer.trace(url, "head"), open_url(urllib.request.Request(url, method="HEAD"), timeout) as response:
+            # Only Last-Modified; the Date header is usually just the current time
+            last_modified = response.headers.get("Last-Modified")
+        return datetime.strptime(last_modified, "%a, %d %b %Y %H:%M:%S %Z") if last_modified else None
+    except Exception:
+        return None
+
+
+def check_links(urls, timeout=10, max_workers=8, on_progress=None):
+    """
+    Checks `urls` with HEAD requests, several at a time, and returns the ones that
+    don't answer with a 2xx or 3xx status (redirects are followed), in their original
+    order. `on_progress(done, total)` is called from the worker threads as checks finish.
+    """
+    import urllib.request
+
+    def responds(url):
+        try:
+            with http_tracer.trace(url, "link_check"), open_url(urllib.request.Request(url, method="HEAD"), timeout) as response:
+                return 200 <= response.getcode() < 400
+        except Exception:
+            return False
+
+    urls = list(urls)
+    if not urls:
+        return []
+    dead = set()
+    done = 0
+    progress_lock = threading.Lock()
+
+    def check(url):
+        nonlocal done
+        alive = responds(url)
+        with progress_lock:
+            done += 1
+            if not alive:
+                dead.add(url)
+            if on_progress:
+                on_progress(done, len(urls))
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as pool:
+        list(pool.map(check, urls))
+    return [url for url in urls if url in dead]
+
+
+class DownloadJournal:
+    """
+    Append-only log of download events (one JSON object per line, one event per
+    source fetch) with an in-memory per-URL index for staleness/failure/speed queries.
+
+    The index is also saved next to the journal together with the byte offset it
+    covers, so opening the journal only replays events appended since then. When the
+    journal grows past `max_bytes` it is compacted to the newest `keep_per_url`
+    events of every URL.
+    """
+    SLOW_EWMA_WEIGHT = 0.3 # Weight of the newest duration in the moving average
+    NOT_MODIFIED = "not_modified" # A conditional fetch found the targets up to date
+
+    def __init__(self, path, max_bytes=2 * 1024 * 1024, keep_per_url=20):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.max_bytes = max_bytes
+        self.keep_per_url = keep_per_url
+        self._lock = threading.Lock()
+        self._urls = {} # url -> summary dict, see _apply()
+        self._offset = 0 # Bytes of the journal covered by the index
+        self._load()
+
+    # --- Writing ---
+
+    def record(self, url, status, size=None, duration_ms=None, validator=None, sha256=None, targets=(), error=None, ts=None):
+        """
+        Appends one event. `status` is "ok" when the source was fetched and written
+        to every target, or NOT_MODIFIED when a conditional fetch found them current;
+        anything else counts as a failure. Safe to call from any thread.
+        """
+        event = {"ts": round(ts or time.time(), 3), "url": url, "status": status}
+        for key, value in (("bytes", size), ("duration_ms", round(duration_ms, 1) if duration_ms is not None else None),
+                           ("validator", validator or None), ("sha256", sha256), ("targets", list(targets) or None),
+                           ("error", str(error) if error else None)):
+            if value is not None:
+                event[key] = value
+        line = (json.dumps(event, separators=(',', ':')) + "\n").encode("utf-8")
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(line)
+            self._offset += len(line)
+            self._apply(event)
+            if self._offset > self.max_bytes:
+                self._compact_locked()
+        return event
+
+    def record_fetch(self, result, targets=(), status="ok"):
+        """Shortcut for recording a FetchResult."""
+        return self.record(result.url, status, size=result.size, duration_ms=result.duration_ms,
+                           validator=result.validator, sha256=result.sha256, targets=targets)
+
+    def compact(self):
+        with self._lock:
+            self._compact_locked()
+
+    def save_index(self):
+        """Writes the index snapshot so the next start doesn't replay the whole journal."""
+        with self._lock:
+            self._save_index_locked()
+
+    # --- Queries (answered from the index) ---
+
+    def summary(self, url):
+        with self._lock:
+            info = self._urls.get(url)
+            return json.loads(json.dumps(info)) if info else None
+
+    def last_validator(self, url):
+        """
+        The validators and hash of the last successful fetch of `url`, or None. "targets"
+        maps each target to the hash of what was last written to it.
+        """
+        with self._lock:
+            info = self._urls.get(url)
+            if not info or not info.get("last_ok_ts"):
+                return None
+            return dict(info.get("validator") or {}, sha256=info.get("sha256"), bytes=info.get("bytes"),
+                        targets=dict(info.get("target_sha256") or {}))
+
+    def stale_targets(self, max_age_days, expected=None):
+        """
+        Returns [(url, target, last_ok_ts)] for targets not written successfully in
+        `max_age_days` days. `expected` is an optional {url: [targets]} mapping of what
+        should exist; targets in it that were never written are reported with None.
+        """
+        cutoff = time.time() - max_age_days * 86400
+        stale = []
+        with self._lock:
+            if expected is None:
+                expected = {url: list(info["targets"]) for url, info in self._urls.items()}
+            for url, targets in expected.items():
+                written = self._urls.get(url, {}).get("targets", {})
+                for target in targets:
+                    last_ok = written.get(target)
+                    if last_ok is None or last_ok < cutoff:
+                        stale.append((url, target, last_ok))
+        return sorted(stale, key=lambda item: item[2] or 0)
+
+    def failing(self, min_consecutive=1):
+        """Returns [(url, consecutive_failures, last_error)] for sources whose latest fetches failed."""
+        with self._lock:
+            result = [(url, info["consecutive_failures"], info.get("last_error"))
+                      for url, info in self._urls.items() if info["consecutive_failures"] >= min_consecutive]
+        return sorted(result, key=lambda item: -item[1])
+
+    def slow(self, threshold_ms=5000, top=None):
+        """Returns [(url, avg_duration_ms)] for sources whose moving average fetch time exceeds `threshold_ms`."""
+        with self._lock:
+            result = [(url, info["avg_duration_ms"]) for url, info in self._urls.items()
+                      if info.get("avg_duration_ms") is not None and info["avg_duration_ms"] >= threshold_ms]
+        result.sort(key=lambda item: -item[1])
+        return result[:top] if top else result
+
+    def events(self, url=None):
+        """Reads events back from the journal (full scan, for export/debugging only)."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue # Torn last line after a crash
+                if url is None or event.get("url") == url:
+                    yield event
+
+    # --- Internals ---
+
+    def _journal_size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def _apply(self, event):
+        info = self._urls.get(event["url"])
+        if info is None:
+            info = self._urls[event["url"]] = {"events": 0, "failures": 0, "consecutive_failures": 0, "targets": {},
+                                               "last_ts": None, "last_status": None, "last_ok_ts": None,
+                                               "avg_duration_ms": None}
+        info["events"] += 1
+        info["last_ts"] = event["ts"]
+        info["last_status"] = event["status"]
+        if event["status"] in ("ok", self.NOT_MODIFIED):
+            info["consecutive_failures"] = 0
+            info["last_ok_ts"] = event["ts"]
+            info.pop("last_error", None)
+            for key in ("bytes", "sha256", "validator"):
+                if key in event:
+                    info[key] = event[key]
+            for target in event.get("targets") or ():
+                info["targets"][target] = event["ts"]
+            duration = event.get("duration_ms")
+            # A 304 says nothing about how long the download takes
+            if duration is not None and event["status"] == "ok":
+                average = info["avg_duration_ms"]
+                info["avg_duration_ms"] = duration if average is None else round(
+                    average + self.SLOW_EWMA_WEIGHT * (duration - average), 1)
+        else:
+            info["failures"] += 1
+            info["consecutive_failures"] += 1
+            if event.get("error"):
+                info["last_error"] = event["error"]
+        # The hash of what each target holds, so a later fetch is only made conditional when that is current
+        if event["status"] in ("ok", "partial"):
+            sha256 = event.get("sha256")
+        elif event["status"] == self.NOT_MODIFIED:
+            sha256 = info.get("sha256") # The targets were checked to hold it before the conditional fetch
+        else:
+            sha256 = None
+        if sha256:
+            target_sha256 = info.setdefault("target_sha256", {})
+            for target in event.get("targets") or ():
+                target_sha256[target] = sha256
+
+    def _load(self):
+        size = self._journal_size()
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            # The snapshot is only usable if the journal hasn't been truncated or replaced since.
+            if snapshot.get("offset", 0) <= size and snapshot.get("size", 0) <= size:
+                self._urls = snapshot.get("urls", {})
+                self._offset = snapshot.get("offset", 0)
+        except (OSError, ValueError):
+            pass
+        if size <= self._offset:
+            self._offset = size
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break # Torn last line, it will be overwritten by compaction eventually
+                self._offset += len(line)
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, KeyError):
+                    continue
+
+    def _compact_locked(self):
+        """Rewrites the journal keeping the newest `keep_per_url` events of every URL. Caller holds the lock."""
+        kept = {}
+        for event in self.events():
+            kept.setdefault(event.get("url"), []).append(event)
+        events = sorted((e for url_events in kept.values() for e in url_events[-self.keep_per_url:]), key=lambda e: e["ts"])
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            for event in events:
+                f.write((json.dumps(event, separators=(',', ':')) + "\n").encode("utf-8"))
+        os.replace(temp_path, self.path)
+        # The index summarizes all history, so it stays as it is; only the offset moves.
+        self._offset = self._journal_size()
+        self._save_index_locked()
+
+    def _save_index_locked(self):
+        snapshot = {"offset": self._offset, "size": self._journal_size(), "urls": self._urls}
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(temp_path, self.index_path)
+
+
+# Severity names shown in the log filter, mapped to logging levels
+LOG_LEVELS = {"Debug": logging.DEBUG, "Info": logging.INFO, "Warning": logging.WARNING, "Error": logging.ERROR}
+
+
+class LogSink:
+    """
+    Thread-safe sink for the activity log.
+
+    log() can be called from any thread: it appends the record to a bounded buffer
+    that the UI drains on its own schedule, and hands it to a QueueListener thread
+    that writes the full log to a rotating file. Nothing in log() touches the disk or a widget.
+    """
+    FILE_FORMAT = "%(asctime)s %(levelname)-7s %(message)s"
+
+    def __init__(self, log_path=None, max_bytes=1024 * 1024, backup_count=3, buffer_size=5000, name="p2p_helper"):
+        self._lock = threading.Lock() # Guards _pending and dropped
+        self._pending = collections.deque(maxlen=buffer_size) # (timestamp, level, message) not drained yet
+        self.dropped = 0 # Records pushed out of the buffer before the UI drained them
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+        self._listener = None
+        self._queue_handler = None
+        if log_path:
+            file_handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count,
+                                                                encoding="utf-8", delay=True)
+            file_handler.setFormatter(logging.Formatter(self.FILE_FORMAT))
+            log_queue = queue.SimpleQueue()
+            self._queue_handler = logging.handlers.QueueHandler(log_queue)
+            self.logger.addHandler(self._queue_handler)
+            self._listener = logging.handlers.QueueListener(log_queue, file_handler)
+            self._listener.start()
+
+    def log(self, message, level=logging.INFO):
+        record = (time.time(), level, message)
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append(record)
+        self.logger.log(level, message)
+
+    def drain(self):
+        """Returns and removes every record logged since the last call."""
+        with self._lock:
+            records = list(self._pending)
+            self._pending.clear()
+        return records
+
+    def take_dropped(self):
+        """Returns how many records were dropped since the last call, and resets the count."""
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+    def close(self):
+        """Stops the file writer after it has written everything queued so far."""
+        if self._listener:
+            self._listener.stop()
+            self.logger.removeHandler(self._queue_handler)
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+
+
+class StartupTimeline:
+    """Records how long each startup phase took, as milliseconds since `origin` (a time.perf_counter() value)."""
+
+    def __init__(self, origin=None):
+        self.origin = origin if origin is not None else time.perf_counter()
+        self.marks = [] # (label, ms since origin), in order
+
+    def mark(self, label, at=None):
+        """Records `label` as reached now, or at `at` (a time.perf_counter() value)."""
+        elapsed_ms = ((at if at is not None else time.perf_counter()) - self.origin) * 1000
+        self.marks.append((label, elapsed_ms))
+        return elapsed_ms
+
+    def get(self, label):
+        """Returns the time of the first mark called `label`, or None."""
+        for mark_label, elapsed_ms in self.marks:
+            if mark_label == label:
+                return elapsed_ms
+        return None
+
+    def as_dict(self):
+        return {label: round(elapsed_ms, 1) for label, elapsed_ms in self.marks}
+
+    def summary(self):
+        return ", ".join(f"{label} {elapsed_ms:.0f} ms" for label, elapsed_ms in self.marks)
+
+
+class ImportTimer:
+    """
+    Times module imports in-process, like `python -X importtime`, so the numbers can be
+    read next to the startup timeline. Only first imports made on the thread that called
+    start() are timed. Records are (name, depth, self_ms, cumulative_ms) in completion
+    order, where cumulative_ms includes the modules imported along the way.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._stack = [] # Time spent in nested imports, per open import
+        self._original = None
+        self._thread = None
+
+    def start(self):
+        import builtins
+        self._original = builtins.__import__
+        self._thread = threading.get_ident()
+        builtins.__import__ = self._import
+
+    def stop(self):
+        import builtins
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original or __import__
+        if level or threading.get_ident() != self._thread:
+            return original(name, globals, locals, fromlist, level)
+        # `from package import submodule` may load the submodule even if the package is loaded
+        if name in sys.modules:
+            new = [f"{name}.{item}" for item in fromlist or () if f"{name}.{item}" not in sys.modules and item != "*"]
+            if not new:
+                return original(name, globals, locals, fromlist, level)
+            label = ", ".join(new)
+        else:
+            label = name
+        started = time.perf_counter()
+        self._stack.append(0.0)
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            nested_ms = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed_ms
+            self.records.append((label, len(self._stack), elapsed_ms - nested_ms, elapsed_ms))
+
+    def slowest(self, count=10):
+        """Returns the `count` slowest top-level imports as {name: cumulative ms}."""
+        top = sorted((r for r in self.records if r[1] == 0), key=lambda r: -r[3])[:count]
+        return {name: round(cumulative_ms, 1) for name, depth, self_ms, cumulative_ms in top}
+
+
+class OperationProfiler:
+    """
+    Opt-in profiling of whole operations: a program scan, a program list rebuild, a
+    batch of downloads. While CPU and/or memory profiling is on, every run of an
+    operation wrapped with @profiled(name) writes a sorted text report, and with CPU
+    profiling a .prof file for pstats or snakeviz, into `folder`. While both are off
+    the wrapper costs one attribute lookup.
+
+    cProfile only sees the thread that runs the operation. tracemalloc traces every
+    thread, so the memory figures of overlapping operations include each other's.
+    Operations nested in another one on the same thread are part of its report.
+    """
+    REPORT_LINES = 40 # Functions per pstats listing
+    MEMORY_LINES = 25 # Allocation sites in the memory report
+
+    def __init__(self, folder="p2p_helper_diagnostics", cpu=False, memory=False, on_report=None):
+        self.folder = folder
+        self.cpu = cpu
+        self.memory = memory
+        self.on_report = on_report # Called with (name, elapsed ms, [paths written]) from the operation's thread
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._memory_users = 0
+        self._started_tracemalloc = False
+        self._sequence = 0
+
+    @property
+    def enabled(self):
+        return self.cpu or self.memory
+
+    def configure(self, spec):
+        """Turns profiling on from a spec like "cpu", "memory", "cpu,memory" or "all" (off for "", "0" or "off")."""
+        modes = {mode.strip().lower() for mode in (spec or "").split(",")} - {"", "0", "off", "no", "false"}
+        if modes & {"all", "1", "on", "yes", "true"}:
+            modes = {"cpu", "memory"}
+        self.cpu = "cpu" in modes
+        self.memory = "memory" in modes
+
+    def run(self, name, func, *args, **kwargs):
+        """Calls func(*args, **kwargs) under the enabled profilers and writes the reports."""
+        if not self.enabled or getattr(self._local, "active", False):
+            return func(*args, **kwargs)
+        self._local.active = True
+        memory_before = self._start_memory() if self.memory else None
+        profile = None
+        if self.cpu:
+            import cProfile
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError: # Another profiler is active (sys.monitoring allows only one)
+                profile = None
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if profile:
+                profile.disable()
+            try:
+                self._write_reports(name, elapsed_ms, profile, memory_before)
+            except OSError:
+                pass # Profiling must never break the operation
+            finally:
+                if memory_before is not None:
+                    self._stop_memory()
+                self._local.active = False
+
+    def _start_memory(self):
+        import tracemalloc
+
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            if self._memory_users == 0:
+                tracemalloc.reset_peak()
+            self._memory_users += 1
+        return tracemalloc.get_traced_memory()[0], tracemalloc.take_snapshot()
+
+    def _stop_memory(self):
+        import tracemalloc
+
+        with self._lock:
+            self._memory_users -= 1
+            if self._memory_users == 0 and self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+    def _write_reports(self, name, elapsed_ms, profile, memory_before):
+        import io
+
+        os.makedirs(self.folder, exist_ok=True)
+        with self._lock:
+            self._sequence += 1
+            base = os.path.join(self.folder, f"{name}-{datetime.now():%Y%m%d-%H%M%S}-{self._sequence}")
+        lines = [f"Operation: {name}", f"Thread: {threading.current_thread().name}",
+                 f"Finished: {datetime.now():%Y-%m-%d %H:%M:%S}", f"Wall time: {elapsed_ms:.1f} ms", ""]
+        paths = []
+        if profile:
+            import pstats
+
+            profile.dump_stats(base + ".prof")
+            paths.append(base + ".prof")
+            for sort_key in ("cumulative", "tottime"):
+                stream = io.StringIO()
+                pstats.Stats(profile, stream=stream).strip_dirs().sort_stats(sort_key).print_stats(self.REPORT_LINES)
+                lines += [f"--- CPU, sorted by {sort_key} ---", stream.getvalue()]
+        if memory_before is not None:
+            import tracemalloc
+
+            current_before, snapshot_before = memory_before
+            current, peak = tracemalloc.get_traced_memory()
+            differences = tracemalloc.take_snapshot().compare_to(snapshot_before, "lineno")
+            lines += ["--- Memory (tracemalloc) ---",
+                      f"Net change: {(current - current_before) / 1024:+.1f} KB, peak traced: {peak / 1024:.1f} KB",
+                      f"Top {self.MEMORY_LINES} allocation sites by growth:"]
+            lines += [f"  {difference}" for difference in differences[:self.MEMORY_LINES]]
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        paths.insert(0, base + ".txt")
+        if self.on_report:
+            self.on_report(name, elapsed_ms, paths)
+
+
+operation_profiler = OperationProfiler()
+
+
+def profiled(name):
+    """Decorator: runs the function through operation_profiler as operation `name`."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not operation_profiler.enabled:
+                return func(*args, **kwargs)
+            return operation_profiler.run(name, func, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class StallWatchdog:
+    """
+    Detects stalls of an event loop thread. That thread calls heartbeat() every
+    `heartbeat_ms` (from a Tk after() loop); a helper thread checks how late the next
+    beat is. Once it is `threshold_ms` late, the helper samples the loop thread's stack
+    with sys._current_frames() on every check until the loop beats again, then calls
+    `on_stall(duration_ms, stack)` from the helper thread with the stall's length and
+    the most often sampled stack ("file:line in function" strings, innermost last).
+    """
+    HEARTBEAT_MS = 100
+    CHECK_MS = 50
+    THRESHOLD_MS = 250
+    STACK_DEPTH = 10 # Innermost frames reported
+
+    def __init__(self, on_stall, threshold_ms=None, heartbeat_ms=None):
+        self.on_stall = on_stall
+        self.threshold_ms = threshold_ms or self.THRESHOLD_MS
+        self.heartbeat_ms = heartbeat_ms or self.HEARTBEAT_MS
+        self._thread_ident = None
+        self._last_beat = None
+        self._longest_gap = 0.0 # Longest time between two beats since the helper last looked, in seconds
+        self._stop = threading.Event()
+        self._helper = None
+
+    def start(self):
+        """Starts watching the calling thread, which must then call heartbeat() every `heartbeat_ms`."""
+        self._thread_ident = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._stop.clear()
+        self._helper = threading.Thread(target=self._watch, name="stall-watchdog", daemon=True)
+        self._helper.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._helper:
+            self._helper.join()
+            self._helper = None
+
+    def heartbeat(self):
+        now = time.perf_counter()
+        self._longest_gap = max(self._longest_gap, now - self._last_beat)
+        self._last_beat = now
+
+    def _stack(self):
+        frame = sys._current_frames().get(self._thread_ident)
+        if frame is None:
+            return None
+        import traceback
+
+        return tuple(f"{os.path.basename(f.filename)}:{f.lineno} in {f.name}"
+                     for f in traceback.extract_stack(frame)[-self.STACK_DEPTH:])
+
+    def _watch(self):
+        samples = collections.Counter() # stack -> times sampled during the current stall
+        stalled = False
+        while not self._stop.wait(self.CHECK_MS / 1000):
+            late_ms = (time.perf_counter() - self._last_beat) * 1000 - self.heartbeat_ms
+            if late_ms >= self.threshold_ms:
+                if not stalled:
+                    stalled = True
+                    samples.clear()
+                stack = self._stack()
+                if stack:
+                    samples[stack] += 1
+            elif stalled:
+                stalled = False
+                duration_ms = self._longest_gap * 1000 - self.heartbeat_ms
+                self._longest_gap = 0.0
+                metrics.observe("ui_stall_seconds", duration_ms / 1000)
+                stack = samples.most_common(1)[0][0] if samples else ()
+                try:
+                    self.on_stall(duration_ms, list(stack))
+                except Exception:
+                    pass # A broken reporter must not stop the watchdog
+            else:
+                self._longest_gap = 0.0
+
+
+# Events carried by UiEventBus
+ProgressEvent = collections.namedtuple("ProgressEvent", "task done total message")
+ValueEvent = collections.namedtuple("ValueEvent", "target value")
+PopupEvent = collections.namedtuple("PopupEvent", "kind title message parent")
+CallEvent = collections.namedtuple("CallEvent", "func args kwargs")
+
+
+class UiEventBus:
+    """
+    The one channel worker threads use to reach the UI thread.
+
+    Workers post typed events from any thread and the UI thread drain()s them on a
+    timer, in the order they were posted. Progress is coalesced per task and value
+    updates per target, so only the newest survives until the next drain no matter
+    how often a worker reports; it takes the place of its latest post in the order.
+    Popups are queued rather than shown, so the UI can merge a burst into one summary.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> event, in posting order. Progress is keyed by task and values by target,
+        # so a newer post replaces the older one; calls and popups get a unique key.
+        self._events = {}
+        self._seq = 0
+        self.posted = 0
+        self.coalesced = 0
+
+    def _post(self, key, event):
+        """Appends `event` under `key`, dropping an older event with the same key. Call with the lock held."""
+        self.posted += 1
+        if key is None:
+            self._seq += 1
+            key = self._seq
+        elif self._events.pop(key, None) is not None:
+            self.coalesced += 1
+        self._events[key] = event
+
+    def call(self, func, *args, **kwargs):
+        """Runs func(*args, **kwargs) on the UI thread, in posting order."""
+        with self._lock:
+            self._post(None, CallEvent(func, args, kwargs))
+
+    def progress(self, task, done, total=None, message=None):
+        with self._lock:
+            self._post(("progress", task), ProgressEvent(task, done, total, message))
+
+    def set_value(self, target, value):
+        """Calls target.set(value) on the UI thread; only the newest value per target is applied."""
+        with self._lock:
+            # Tk variables aren't hashable, hence id()
+            self._post(("value", id(target)), ValueEvent(target, value))
+
+    def popup(self, kind, title, message, parent=None):
+        """Queues a message box. `kind` is "info", "warning" or "error"."""
+        with self._lock:
+            self._post(None, PopupEvent(kind, title, message, parent))
+
+    def drain(self):
+        """Returns and clears the events posted since the last drain, oldest first."""
+        with self._lock:
+            events, self._events = list(self._events.values()), {}
+        return events
+
+
+class BrokerError(Exception):
+    """The elevated helper could not be started or stopped responding."""
+
+
+def run_broker_op(op):
+    """Carries out one operation sent to the elevated helper. Returns None or an error message."""
+    try:
+        kind = op.get("op")
+        if kind == "makedirs":
+            os.makedirs(op["path"], exist_ok=True)
+        elif kind == "copy":
+            replace_file(op["src"], op["dst"])
+        elif kind == "remove":
+            if os.path.exists(op["path"]):
+                os.remove(op["path"])
+        elif kind == "reg_import":
+            import subprocess
+            process = subprocess.run(["reg", "import", op["path"]], capture_output=True, text=True,
+                                     creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+            if process.returncode:
+                return process.stderr.strip() or f"reg import returned {process.returncode}"
+        else:
+            return f"Unsupported operation: {kind!r}"
+    except Exception as e:
+        return str(e)
+    return None
+
+
+def run_broker(address, authkey_path):
+    """
+    Main loop of the elevated helper (started with --broker). Connects back to the GUI and
+    runs each batch of operations it receives until the GUI disconnects. Messages are
+    JSON rather than pickles, so the elevated side never unpickles data.
+    """
+    from multiprocessing.connection import Client
+
+    with open(authkey_path, "rb") as f:
+        authkey = f.read()
+    with Client(address, authkey=authkey) as conn:
+        while True:
+            try:
+                batch = json.loads(conn.recv_bytes())
+            except EOFError:
+                break
+            if batch is None:
+                break
+            conn.send_bytes(json.dumps([run_broker_op(op) for op in batch]).encode("utf-8"))
+
+
+class ElevatedBroker:
+    """
+    Client side of the elevated helper that performs writes the GUI isn't allowed to do.
+
+    Nothing is elevated until run() is first called: `launcher(arguments)` then starts the
+    helper with administrator rights (showing the UAC prompt) and returns 0 or an error
+    code. The helper is kept for the rest of the session, so later batches need no prompt.
+    """
+    CONNECT_TIMEOUT = 120 # Seconds to wait for the helper; the user has to answer the UAC prompt
+
+    def __init__(self, launcher):
+        self.launcher = launcher
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._conn is not None
+
+    def run(self, ops):
+        """Sends a batch of operations and returns one result (None or an error message) per operation."""
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._start()
+            try:
+                self._conn.send_bytes(json.dumps(list(ops)).encode("utf-8"))
+                return json.loads(self._conn.recv_bytes())
+            except (EOFError, OSError) as e:
+                self._conn = None
+                raise BrokerError(f"Lost the connection to the elevated helper: {e}")
+
+    def _start(self):
+        from multiprocessing.connection import Listener
+
+        authkey = os.urandom(32)
+        listener = Listener(family="AF_PIPE" if sys.platform == "win32" else "AF_UNIX", authkey=authkey)
+        # The key goes through a file in the user's temp folder rather than the command line
+        fd, key_path = tempfile.mkstemp(prefix="p2p_helper_broker_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(authkey)
+            code = self.launcher(["--broker", listener.address, key_path])
+            if code == 1223: # ERROR_CANCELLED
+                raise BrokerError("Administrator rights were not granted.")
+            if code:
+                raise BrokerError(f"Could not start the elevated helper (error {code}).")
+            accepted = []
+            acceptor = threading.Thread(target=lambda: accepted.append(listener.accept()), daemon=True)
+            acceptor.start()
+            acceptor.join(self.CONNECT_TIMEOUT)
+            if not accepted:
+                raise BrokerError("The elevated helper did not connect.")
+            return accepted[0]
+        finally:
+            if os.path.exists(key_path):
+                os.remove(key_path)
+            listener.close() # The accepted connection stays open
+
+    def close(self):
+        """Stops the helper, if it was started."""
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.send_bytes(b"null")
+                    self._conn.close()
+                except OSError:
+                    pass
+                self._conn = None
+
+
+# Program fields stamped with the time of the last successful download, per kind of download
+LAST_UPDATED_FIELDS = {"server_list": "LastUpdated", "nodes": "NodesLastUpdated", "winmx_patch": "WinMXPatchLastUpdated"}
+
+PlannedDownload = collections.namedtuple("PlannedDownload", "program kind url targets")
+
+
+def plan_program_downloads(program, server_lists=None, nodes_lists=None):
+    """
+    Returns the PlannedDownloads configured for a program: each server list source with
+    its target paths, the nodes.dat and the WinMX patch. `server_lists` and `nodes_lists`
+    map the friendly list names that may be stored instead of a URL to their URLs.
+    """
+    server_lists = server_lists or {}
+    nodes_lists = nodes_lists or {}
+    plan = []
+    for url, targets in (program.get("ServerListTargetPaths") or {}).items():
+        url = server_lists.get(url, url)
+        if url and targets:
+            plan.append(PlannedDownload(program, "server_list", url, list(targets)))
+    nodes_url = nodes_lists.get(program.get("NodesListURL"), program.get("NodesListURL"))
+    if nodes_url and program.get("NodesListTargetPath"):
+        plan.append(PlannedDownload(program, "nodes", nodes_url, [program["NodesListTargetPath"]]))
+    if program.get("WinMXPatchURL") and program.get("WinMXPatchTarget"):
+        plan.append(PlannedDownload(program, "winmx_patch", program["WinMXPatchURL"], [program["WinMXPatchTarget"]]))
+    return plan
+
+
+# Built-in eDonkey server.met and Kademlia nodes.dat sources, by friendly name
+EDONKEY_SERVER_LISTS = {
+    "eMule Security": "http://upd.emule-security.org/server.met",
+    "ShortyPower": "https://shortypower.org/server.met",
+    "GitHub Backup (ShortyPower)": "https://raw.githubusercontent.com/GamerA1-99/Server.met/shortypower/server.met",
+    "GitHub Backup (eMule Security)": "https://raw.githubusercontent.com/GamerA1-99/Server.met/emule-security/server.met",
+}
+EMULE_NODES_LISTS = {
+    "eMule Security": "http://upd.emule-security.org/nodes.dat",
+    "GitHub Backup (eMule Security)": "https://raw.githubusercontent.com/GamerA1-99/Server.met/emule-security/nodes.dat",
+}
+
+REGISTRY_TARGET = "(Windows Registry)" # Pseudo target path: the file is a .reg to import
+
+# `unchanged` is True when a conditional fetch found the target already up to date
+TargetOutcome = collections.namedtuple("TargetOutcome", "program kind url target ok error unchanged", defaults=(False,))
+# What UpdateEngine.preflight() found: {target: error} for targets that can't be written,
+# and the targets that go straight to the elevated helper
+Preflight = collections.namedtuple("Preflight", "refused elevated")
+
+
+class UpdateEngine:
+    """
+    Carries out PlannedDownloads for the GUI and the headless CLI alike.
+
+    Each URL is fetched once and copied to all of its targets. Targets the user can't
+    write are handed to `broker` (an ElevatedBroker, optional) in one batch per source.
+    REGISTRY_TARGET sources are imported with `reg import`. Every source fetch is
+    recorded in `journal` and, for the SQLite engine, in `store`'s history.
+    `log(message, level)` receives the progress messages.
+
+    Before anything is downloaded, all targets are checked in one batch (see
+    preflight()); sources whose targets can't be written aren't downloaded at all.
+    """
+
+    def __init__(self, journal=None, store=None, broker=None, log=None):
+        self.journal = journal
+        self.store = store
+        self.broker = broker
+        self.log = log or (lambda message, level=logging.INFO: None)
+
+    def run(self, plan, on_outcome=None):
+        """Runs every PlannedDownload and returns a TargetOutcome per target, also passed to on_outcome() as they happen."""
+        preflight = self.preflight(target for item in plan for target in item.targets)
+        outcomes = []
+        for item in plan:
+            for outcome in self.run_item(item, preflight=preflight):
+                outcomes.append(outcome)
+                if on_outcome:
+                    on_outcome(outcome)
+        return outcomes
+
+    def preflight(self, targets):
+        """
+        Sorts the targets about to be written, before any download starts (see
+        preflight_targets()). Locked and unwritable targets are refused, as are protected
+        ones when there is no broker; the other protected ones go straight to the broker.
+        """
+        checks = preflight_targets([t for t in targets if t != REGISTRY_TARGET], is_admin())
+        refused = {}
+        elevated = set()
+        for target, (status, note) in checks.items():
+            if status == "elevation" and self.broker is not None:
+                elevated.add(target)
+            elif status == "elevation":
+                refused[target] = "Permission denied (administrator rights are needed)"
+            elif status in ("blocked", "locked"):
+                refused[target] = note
+        if refused or elevated:
+            self.log(f"Preflight: {len(checks) - len(refused) - len(elevated)} target(s) ready, "
+                     f"{len(elevated)} need administrator rights, {len(refused)} can't be written.")
+        for target, error in refused.items():
+            self.log(f"  -> Skipping {target}: {error}", logging.WARNING)
+        return Preflight(refused, elevated)
+
+    def run_item(self, item, validator=None, on_progress=None, preflight=None):
+        """
+        Runs one PlannedDownload. With a `validator` (see DownloadJournal.last_validator())
+        the fetch is conditional, but only when every target holds the last download (see
+        targets_current()); if nothing changed, no target is touched.
+        `on_progress` is passed on to fetch_to_file(). Targets refused by `preflight`
+        (checked here if not given) fail without being downloaded for.
+        """
+        outcomes = []
+        targets = [t for t in item.targets if t != REGISTRY_TARGET]
+        if len(targets) != len(item.targets):
+            error = self.import_reg(item.url)
+            outcomes.append(TargetOutcome(item.program, item.kind, item.url, REGISTRY_TARGET, not error, error))
+        if not targets:
+            return outcomes
+        if preflight is None:
+            preflight = self.preflight(targets)
+        refused = [t for t in targets if t in preflight.refused]
+        outcomes.extend(TargetOutcome(item.program, item.kind, item.url, t, False, preflight.refused[t]) for t in refused)
+        if len(refused) == len(targets):
+            self.record_event(item.url, "preflight_failed", error=preflight.refused[targets[0]])
+            return outcomes
+        all_targets, targets = targets, [t for t in targets if t not in preflight.refused]
+
+        started = time.perf_counter()
+        if validator and not self.targets_current(targets, validator):
+            validator = None # A 304 would leave a missing, new or outdated target as it is
+        self.log(f"Downloading from {item.url}...")
+        try:
+            result = fetch_to_file(item.url, validator=validator, on_progress=on_progress)
+        except Exception as e:
+            self.log(f"FAILED to download from {item.url}: {e}{describe_failed_trace(item.url)}", logging.ERROR)
+            self.record_event(item.url, "download_failed", started=started, error=e)
+            return outcomes + [TargetOutcome(item.program, item.kind, item.url, t, False, str(e)) for t in targets]
+        if result.status == 304:
+            self.log(f"  -> Not modified since the last download: {item.url}")
+            metrics.inc("cache_lookups_total", result="not_modified")
+            self.record_event(item.url, DownloadJournal.NOT_MODIFIED, targets, started, result)
+            return outcomes + [TargetOutcome(item.program, item.kind, item.url, t, True, None, True) for t in targets]
+        previous = self.journal.last_validator(item.url) if self.journal is not None else None
+        same_hash = bool(previous and previous.get("sha256") == result.sha256)
+        metrics.inc("cache_lookups_total", result="same_hash" if same_hash else "changed")
+        try:
+            copy_errors = self.copy_to_targets(result.path, targets, preflight.elevated)
+        finally:
+            os.remove(result.path)
+
+        written = []
+        for target_path in targets:
+            error = copy_errors[target_path]
+            if error:
+                self.log(f"  -> FAILED to copy to {target_path}: {error}", logging.ERROR)
+            else:
+                self.log(f"  -> Successfully copied to: {target_path}")
+                written.append(target_path)
+            outcomes.append(TargetOutcome(item.program, item.kind, item.url, target_path, not error, error))
+        # One journal event per source; a partial copy (or a refused target) still counts as a failure.
+        status = "ok" if len(written) == len(all_targets) else "partial" if written else "copy_failed"
+        self.record_event(item.url, status, written, started, result)
+        return outcomes
+
+    @staticmethod
+    def targets_current(targets, validator):
+        """
+        True if every target holds the content of the fetch `validator` describes: the
+        journal recorded writing that content to it (and the size still matches), or its
+        SHA-256 matches.
+        """
+        sha256 = validator.get("sha256")
+        if not sha256:
+            return False
+        written = validator.get("targets") or {}
+        for target in targets:
+            try:
+                size = os.path.getsize(target)
+            except OSError:
+                return False
+            if written.get(target) == sha256 and size == validator.get("bytes"):
+                continue
+            if file_sha256(target) != sha256:
+                return False
+        return True
+
+    def copy_to_targets(self, source_path, target_paths, elevated=()):
+        """
+        Copies a file to each target path and returns {target_path: None or error message}.
+        Each target is replaced in one step (see replace_file), including those written
+        by the broker, so readers never see a half-written file.
+        Targets in `elevated`, and any refused with PermissionError (e.g. under Program
+        Files), go to the broker in one batch.
+        """
+        errors = {}
+        denied = [t for t in target_paths if t in elevated]
+        for target_path in target_paths:
+            if target_path in elevated:
+                continue
+            try:
+                replace_file(source_path, target_path)
+                errors[target_path] = None
+            except PermissionError:
+                denied.append(target_path)
+            except Exception as e:
+                errors[target_path] = str(e)
+        if denied:
+            if self.broker is None:
+                errors.update((path, "Permission denied (administrator rights are needed)") for path in denied)
+                return errors
+            self.log(f"Administrator rights are needed to write {len(denied)} file(s); passing them to the elevated helper...")
+            try:
+                results = self.broker.run([{"op": "copy", "src": source_path, "dst": path} for path in denied])
+            except BrokerError as e:
+                results = [str(e)] * len(denied)
+            errors.update(zip(denied, results))
+        return errors
+
+    def import_reg(self, url):
+        """Downloads a .reg file and imports it. Returns None or an error message."""
+        import subprocess
+
+        reg_file_path = None
+        result = None
+        try:
+            self.log(f"Downloading .reg file from {url}...")
+            result = fetch_to_file(url)
+            reg_file_path = result.path + ".reg"
+            os.replace(result.path, reg_file_path)
+            self.log(f"Attempting to import registry file: {reg_file_path}", logging.DEBUG)
+            # 'reg import' is silent; CREATE_NO_WINDOW hides the console window
+            process = subprocess.run(["reg", "import", reg_file_path], capture_output=True, text=True,
+                                     creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+            error = (process.stderr.strip() or f"Return code: {process.returncode}") if process.returncode else None
+            if error and self.broker is not None:
+                # Keys under HKEY_LOCAL_MACHINE can only be written with administrator rights
+                self.log("The registry import needs administrator rights; passing it to the elevated helper...")
+                try:
+                    error = self.broker.run([{"op": "reg_import", "path": reg_file_path}])[0]
+                except BrokerError as e:
+                    error = str(e)
+            self.record_event(url, "import_failed" if error else "ok", [REGISTRY_TARGET], result=result, error=error)
+        except Exception as e:
+            error = str(e)
+            self.record_event(url, "failed", [REGISTRY_TARGET], result=result, error=e)
+        finally:
+            if reg_file_path and os.path.exists(reg_file_path):
+                os.remove(reg_file_path)
+        if error:
+            self.log(f"FAILED to import registry file from {url}: {error}", logging.ERROR)
+        else:
+            self.log("Registry file imported successfully.")
+        return error
+
+    def record_event(self, url, status, targets=(), started=None, result=None, error=None):
+        """
+        Adds one source fetch to the download journal (and to the SQLite history, if that
+        engine is in use). Safe to call from worker threads.
+        """
+        duration_ms = result.duration_ms if result else (time.perf_counter() - started) * 1000 if started else None
+        metrics.inc("downloads_total", outcome=status)
+        try:
+            if result and result.status == 304:
+                # Keep the size and hash of the last real download
+                result = FetchResult(result.url, None, None, None, result.duration_ms, 304, result.etag, result.last_modified)
+            if self.journal is not None:
+                if result:
+                    self.journal.record(url, status, size=result.size, duration_ms=duration_ms, validator=result.validator,
+                                        sha256=result.sha256, targets=targets, error=error)
+                else:
+                    self.journal.record(url, status, duration_ms=duration_ms, targets=targets, error=error)
+            record = getattr(self.store, "record_download_event", None)
+            if record:
+                for target in targets or [None]:
+                    record(url, status, target=target, size=result.size if result else None, duration_ms=duration_ms)
+                if result and status == "ok":
+                    self.store.set_validator(url, result.etag, result.last_modified, result.size, result.sha256)
+        except Exception as e:
+            self.log(f"Could not record download history: {e}", logging.WARNING)
+
+
+def is_admin():
+    """Check if the script is running with administrator privileges."""
+    try:
+        import ctypes
+        return bool(ctypes.windll.shell32.IsUserAnAdmin())
+    except Exception:
+        return False
+
+
+def protected_folders():
+    """The folders only administrators can write to (Windows only; elsewhere plain permissions apply)."""
+    if sys.platform != "win32":
+        return []
+    names = ("ProgramFiles", "ProgramFiles(x86)", "ProgramW6432", "SystemRoot")
+    return [os.path.normcase(os.path.abspath(os.environ[name])) for name in names if os.environ.get(name)]
+
+
+def _nearest_existing_folder(folder):
+    """Returns (the closest existing folder at or above `folder`, None) or (None, why there is none)."""
+    while not os.path.isdir(folder):
+        if os.path.exists(folder):
+            return None, f"'{folder}' is a file, not a folder"
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            return None, "The drive does not exist"
+        folder = parent
+    return folder, None
+
+
+def check_target_access(path, admin=False):
+    """
+    Predicts whether `path` can be written, from file metadata alone (nothing is
+    created or opened). Returns (status, note), status being "ready", "elevation"
+    (needs administrator rights), "blocked" (can't be written at all) or "registry"
+    for REGISTRY_TARGET.
+    """
+    if path == REGISTRY_TARGET:
+        return "registry", "Imported with 'reg import'; HKEY_LOCAL_MACHINE keys need administrator rights"
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        return "blocked", "A folder with this name is in the way"
+    folder = os.path.dirname(path)
+    existing, problem = _nearest_existing_folder(folder)
+    if problem:
+        return "blocked", problem
+    note = "" if existing == folder else "The folder will be created"
+    if sys.platform == "win32" and os.path.exists(path) and not os.access(path, os.W_OK):
+        return "blocked", "The file is read-only"
+    can_elevate = sys.platform == "win32" and not admin
+    if not os.access(existing, os.W_OK):
+        return ("elevation" if can_elevate else "blocked"), "No write permission for the folder"
+    normalized = os.path.normcase(existing)
+    if can_elevate and any(normalized == protected or normalized.startswith(protected + os.sep) for protected in protected_folders()):
+        return "elevation", "Protected folder; needs administrator rights"
+    return "ready", note
+
+
+SHARING_VIOLATION_ERRORS = (32, 33) # ERROR_SHARING_VIOLATION, ERROR_LOCK_VIOLATION
+
+
+def is_file_locked(path):
+    """
+    True if another program holds `path` open so that it can't be replaced, e.g. a
+    running client with its server.met open. Windows only; elsewhere open files can
+    always be replaced. The file is opened for writing but not changed.
+    """
+    if sys.platform != "win32" or not os.path.isfile(path):
+        return False
+    try:
+        os.close(os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0)))
+    except OSError as e:
+        return getattr(e, "winerror", None) in SHARING_VIOLATION_ERRORS
+    return False
+
+
+def _probe_folder(folder, admin):
+    """Creates and removes a file in `folder`. Returns (status, note) like check_target_access()."""
+    try:
+        fd, probe_path = tempfile.mkstemp(prefix=".p2p_helper_probe_", dir=folder)
+        os.close(fd)
+        os.remove(probe_path)
+    except PermissionError:
+        return ("elevation" if sys.platform == "win32" and not admin else "blocked"), "No write permission for the folder"
+    except OSError as e:
+        # str(e) names the probe file, which the user never asked about
+        return "blocked", f"Can't write to {folder}: {e.strerror or e}"
+    return "ready", ""
+
+
+def preflight_targets(targets, admin=False):
+    """
+    Checks, before anything is downloaded, that each target can really be written.
+    Unlike check_target_access() this touches the disk: a probe file is created and
+    removed in each target folder (once per folder, however many targets it holds), and
+    existing targets are checked with is_file_locked(). Returns {target: (status, note)}
+    with the statuses of check_target_access() plus "locked".
+    """
+    results = {}
+    probed = {} # folder -> probe result
+    for target in targets:
+        if target in results:
+            continue
+        status, note = check_target_access(target, admin)
+        if status not in ("ready", "elevation"):
+            results[target] = (status, note)
+            continue
+        folder = _nearest_existing_folder(os.path.dirname(os.path.abspath(target)))[0]
+        if folder not in probed:
+            probed[folder] = _probe_folder(folder, admin)
+        # The probe has the final word: protected folders are sometimes writable after all
+        if probed[folder][0] != "ready":
+            results[target] = probed[folder]
+        elif is_file_locked(target):
+            results[target] = ("locked", "In use by another program; close it and try again")
+        else:
+            results[target] = ("ready", note)
+    return results
+
+
+PlannedTarget = collections.namedtuple("PlannedTarget", "path status note")
+# One source of a dry run: what would be fetched (once) and where it would be written
+SourcePlan = collections.namedtuple("SourcePlan", "url kind programs estimated_bytes estimated_ms estimate_from targets")
+
+
+def dry_run_plan(plan, journal=None, store=None, admin=False):
+    """
+    Describes what running `plan` would do without touching the network or writing
+    anything: a SourcePlan per source URL (deduplicated like build_update_jobs()) with
+    the programs using it, every target with its check_target_access() verdict, and the
+    expected size and time. Estimates come from the last download in `journal`, else the
+    validators in `store`'s history, else the size of a target already on disk.
+    """
+    sources = []
+    for job in build_update_jobs(plan):
+        last = journal.last_validator(job.url) if journal is not None else None
+        summary = journal.summary(job.url) if journal is not None else None
+        cached = store.get_validator(job.url) if hasattr(store, "get_validator") else None
+        existing = [t for t in job.owners if t != REGISTRY_TARGET and os.path.isfile(t)]
+        if last and last.get("bytes") is not None:
+            size, estimate_from = last["bytes"], "last download"
+        elif cached and cached.get("content_length") is not None:
+            size, estimate_from = cached["content_length"], "download history"
+        elif existing:
+            size, estimate_from = os.path.getsize(existing[0]), "current file"
+        else:
+            size, estimate_from = None, None
+        targets = [PlannedTarget(target, *check_target_access(target, admin)) for target in job.owners]
+        sources.append(SourcePlan(job.url, job.kind, job.program_names(), size,
+                                  summary.get("avg_duration_ms") if summary else None, estimate_from, targets))
+    return sources
+
+
+class UpdateJob:
+    """
+    One node of an update job graph (see build_update_jobs()): a source URL that is
+    fetched once and written to the targets of every program using it. Its progress
+    attributes are updated by the thread running it and may be read from any thread.
+    """
+    FINISHED_STATES = ("done", "unchanged", "partial", "failed", "cancelled")
+
+    def __init__(self, items):
+        self.items = items # The PlannedDownloads for this URL, in plan order
+        self.url = items[0].url
+        self.kind = items[0].kind
+        self.owners = {} # target path -> the PlannedDownload it came from
+        for item in items:
+            for target in item.targets:
+                self.owners.setdefault(target, item)
+        self.host = (urllib.parse.urlsplit(self.url).hostname or "").lower()
+        self.depends_on = [] # Earlier jobs writing one of the same targets
+        self.state = "queued"
+        self.bytes = 0
+        self.total_bytes = None
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.outcomes = []
+
+    @property
+    def finished_state(self):
+        return self.state in self.FINISHED_STATES
+
+    @property
+    def duration(self):
+        """Seconds spent running so far (or in total, once finished)."""
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def speed(self):
+        """Average download speed in bytes per second."""
+        duration = self.duration
+        return self.bytes / duration if duration > 0 else 0.0
+
+    def program_names(self):
+        names = []
+        for item in self.items:
+            name = item.program.get("DisplayName", "")
+            if name not in names:
+                names.append(name)
+        return names
+
+    def run(self, engine, validator=None, on_change=None, preflight=None):
+        """
+        Runs the job with `engine` and returns its TargetOutcomes. `on_change(job)` is
+        called as it progresses; `preflight` is passed on to UpdateEngine.run_item().
+        """
+        notify = on_change or (lambda job: None)
+        self.state = "running"
+        self.started = time.perf_counter()
+        notify(self)
+
+        def progress(done, total):
+            self.bytes, self.total_bytes = done, total
+            notify(self)
+
+        merged = PlannedDownload(self.items[0].program, self.kind, self.url, list(self.owners))
+        try:
+            outcomes = engine.run_item(merged, validator, on_progress=progress, preflight=preflight)
+        except Exception as e: # run_item reports its own errors; this is a last resort
+            outcomes = [TargetOutcome(merged.program, self.kind, self.url, t, False, str(e)) for t in merged.targets]
+        # Hand each outcome back to the program that asked for that target
+        self.outcomes = [o._replace(program=self.owners[o.target].program, kind=self.owners[o.target].kind) for o in outcomes]
+        errors = [o.error for o in self.outcomes if o.error]
+        self.error = errors[0] if errors else None
+        if self.outcomes and all(o.unchanged for o in self.outcomes):
+            self.state = "unchanged"
+        elif not errors:
+            self.state = "done"
+        else:
+            self.state = "partial" if len(errors) < len(self.outcomes) else "failed"
+        self.finished = time.perf_counter()
+        notify(self)
+        return self.outcomes
+
+
+def build_update_jobs(plan):
+    """
+    Turns PlannedDownloads into an update job graph: one UpdateJob per URL, in plan
+    order. A job depends on every earlier job that writes one of its targets, so when
+    several sources feed the same file the last one in the plan still wins. All .reg
+    imports share REGISTRY_TARGET and therefore run one after another.
+    """
+    items_by_url = {}
+    for item in plan:
+        items_by_url.setdefault(item.url, []).append(item)
+    jobs = [UpdateJob(items) for items in items_by_url.values()]
+    last_writer = {} # target path -> last job writing it so far
+    for job in jobs:
+        for target in job.owners:
+            previous = last_writer.get(target)
+            if previous is not None and previous not in job.depends_on:
+                job.depends_on.append(previous)
+            last_writer[target] = job
+    return jobs
+
+
+class ParallelUpdateRunner:
+    """
+    Runs an update job graph on a bounded thread pool: at most `max_workers` sources at
+    once and at most `per_host` from any one server, and no job before the jobs it
+    depends on have finished. cancel() lets running jobs finish and skips the rest.
+    """
+    MAX_WORKERS = 6
+    PER_HOST = 2 # Old community hosts are small; don't hit one with the whole pool
+
+    def __init__(self, engine, max_workers=None, per_host=None):
+        self.engine = engine
+        self.max_workers = max_workers or self.MAX_WORKERS
+        self.per_host = per_host or self.PER_HOST
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self, jobs, on_change=None, validators=None):
+        """
+        Runs `jobs` and returns their TargetOutcomes in job order. `on_change(job)` is called
+        from the worker threads whenever a job starts, receives data or finishes.
+        `validators` optionally maps URLs to the validator for a conditional fetch.
+        All targets are preflighted together before the first download starts.
+        """
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        notify = on_change or (lambda job: None)
+        validators = validators or {}
+        preflight = self.engine.preflight(target for job in jobs for target in job.owners)
+        pending = list(jobs)
+        running = {} # future -> job
+        per_host = collections.Counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                for job in list(pending):
+                    if self._cancelled.is_set():
+                        pending.remove(job)
+                        job.state = "cancelled"
+                        notify(job)
+                    elif len(running) >= self.max_workers:
+                        break
+                    elif per_host[job.host] < self.per_host and all(dep.finished_state for dep in job.depends_on):
+                        pending.remove(job)
+                        per_host[job.host] += 1
+                        running[pool.submit(job.run, self.engine, validators.get(job.url), notify, preflight)] = job
+                metrics.set("update_queue_depth", len(pending))
+                metrics.set("update_jobs_running", len(running))
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    per_host[running.pop(future).host] -= 1
+        metrics.set("update_queue_depth", 0)
+        metrics.set("update_jobs_running", 0)
+        return [outcome for job in jobs for outcome in job.outcomes]
+
+
+DEFAULT_REFRESH_HOURS = {"server_list": 24, "nodes": 24, "winmx_patch": 7 * 24}
+
+
+@contextlib.contextmanager
+def exclusive_file_lock(path):
+    """Holds an exclusive lock on `path` (created if missing) across processes while the block runs."""
+    with open(path, "a+b") as f:
+        if sys.platform == "win32":
+            import msvcrt
+
+            # Locks the first byte; LK_LOCK retries for about 10 seconds before raising OSError
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class RefreshScheduler:
+    """
+    Decides when each download source is refreshed, for the GUI's timer and the
+    service mode alike.
+
+    Every source URL runs on its own interval (DEFAULT_REFRESH_HOURS for its kind unless
+    overridden) with random jitter, so sources drift apart over time. Failures back off
+    exponentially, never beyond the normal interval. Next-run times are persisted in
+    `state_path`, so a restart carries on with the schedule instead of refreshing
+    everything at once; sources seen for the first time are spread over
+    `initial_spread_min` minutes.
+
+    The GUI and the --cli service share the file, so save() merges in what another
+    process recorded (per URL, the newest last run wins) under a lock file rather than
+    overwriting it, and run_due() reloads it first.
+    """
+    JITTER = 0.1 # Each delay is randomly stretched or shrunk by up to this fraction
+    BACKOFF_BASE_MIN = 15 # Delay after the first failure; doubles with each further one
+
+    def __init__(self, state_path, initial_spread_min=10, clock=time.time, rng=None):
+        self.state_path = state_path
+        self.initial_spread_min = initial_spread_min
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self.lock_path = state_path + ".lock"
+        self.sources = self._read_sources() # url -> {kind, interval_h, next_run, last_run, last_status, last_error, failures}
+
+    # Fields that record a run; the rest of an entry (kind, interval) comes from the settings
+    RUN_FIELDS = ("next_run", "last_run", "last_status", "last_error", "failures")
+
+    def _read_sources(self):
+        """The sources in the schedule file, or {} if it is missing or unreadable."""
+        # No file lock needed: save() replaces the file in one step, so a read never sees half of it
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                sources = json.load(f).get("sources")
+            return sources if isinstance(sources, dict) else {}
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def _merge_locked(self):
+        """Takes over the runs another process recorded since we last looked. Call with the lock held."""
+        for url, theirs in self._read_sources().items():
+            ours = self.sources.get(url)
+            if ours is None or not isinstance(theirs, dict):
+                continue # Sources this process doesn't schedule (any more) are left to sync()
+            if (theirs.get("last_run") or 0) > (ours.get("last_run") or 0):
+                ours.update((field, theirs[field]) for field in self.RUN_FIELDS if field in theirs)
+
+    def reload(self):
+        """Merges in the schedule file, so refreshes another process just ran (and its backoff) are respected."""
+        with self._lock:
+            self._merge_locked()
+
+    def save(self):
+        """
+        Merges in the schedule file (see reload()) and writes the result back atomically.
+        The lock file keeps another process from saving between our read and our write.
+        """
+        with exclusive_file_lock(self.lock_path):
+            with self._lock:
+                self._merge_locked()
+                data = json.dumps({"version": 1, "sources": self.sources}, indent=1)
+            fd, temp_path = tempfile.mkstemp(prefix=".p2p_helper_", dir=os.path.dirname(os.path.abspath(self.state_path)))
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(temp_path, self.state_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+    def sync(self, plan, intervals=None):
+        """
+        Schedules the sources of `plan` (PlannedDownloads) that are new and forgets the ones
+        no longer configured. `intervals` optionally maps URLs to their own interval in hours.
+        """
+        intervals = intervals or {}
+        now = self.clock()
+        kinds = {}
+        for item in plan:
+            kinds.setdefault(item.url, item.kind)
+        with self._lock:
+            for url in [u for u in self.sources if u not in kinds]:
+                del self.sources[url]
+            for url, kind in kinds.items():
+                hours = float(intervals.get(url) or DEFAULT_REFRESH_HOURS.get(kind, 24))
+                entry = self.sources.get(url)
+                if entry is None:
+                    self.sources[url] = {"kind": kind, "interval_h": hours,
+                                         "next_run": now + self.rng.uniform(0, self.initial_spread_min * 60),
+                                         "last_run": None, "last_status": None, "last_error": None, "failures": 0}
+                elif entry["interval_h"] != hours:
+                    entry["interval_h"] = hours
+                    entry["next_run"] = min(entry["next_run"], now + hours * 3600)
+
+    def due(self, now=None):
+        """Returns the URLs whose next run has come, most overdue first."""
+        now = self.clock() if now is None else now
+        with self._lock:
+            return sorted((url for url, entry in self.sources.items() if entry["next_run"] <= now),
+                          key=lambda url: self.sources[url]["next_run"])
+
+    def next_run(self):
+        """Returns the earliest next-run time, or None if nothing is scheduled."""
+        with self._lock:
+            return min((entry["next_run"] for entry in self.sources.values()), default=None)
+
+    def mark_due(self, urls=None):
+        """Makes `urls` (default: every source) due now, e.g. for a manual "refresh now"."""
+        now = self.clock()
+        with self._lock:
+            for url in self.sources if urls is None else urls:
+                if url in self.sources:
+                    self.sources[url]["next_run"] = min(self.sources[url]["next_run"], now)
+
+    def record(self, url, ok, status=None, error=None):
+        """Schedules the next run of `url` after a refresh: one interval later, or backed off after a failure."""
+        now = self.clock()
+        with self._lock:
+            entry = self.sources.get(url)
+            if entry is None:
+                return
+            entry["last_run"] = now
+            entry["last_status"] = status or ("ok" if ok else "failed")
+            entry["last_error"] = None if ok else error
+            interval = entry["interval_h"] * 3600
+            if ok:
+                entry["failures"] = 0
+                delay = interval
+            else:
+                entry["failures"] += 1
+                delay = min(self.BACKOFF_BASE_MIN * 60 * 2 ** (entry["failures"] - 1), interval)
+            entry["next_run"] = now + delay * self.rng.uniform(1 - self.JITTER, 1 + self.JITTER)
+
+    def status(self):
+        """Returns the schedule as a list of dicts (with "url"), soonest first."""
+        with self._lock:
+            rows = [dict(entry, url=url) for url, entry in self.sources.items()]
+        return sorted(rows, key=lambda row: row["next_run"])
+
+    def run_due(self, plan, engine, on_outcome=None):
+        """
+        Refreshes the due sources of `plan` with `engine`: one conditional fetch per URL,
+        written to the targets of every program using it. Records each result, saves the
+        schedule and returns the TargetOutcomes.
+        """
+        self.reload() # Another process may have refreshed some of them already
+        now = self.clock()
+        due = set(self.due(now))
+        with self._lock:
+            for url in due:
+                metrics.observe("scheduler_lag_seconds", max(0, now - self.sources[url]["next_run"]))
+        metrics.set("scheduler_due_sources", len(due))
+        jobs = build_update_jobs([item for item in plan if item.url in due])
+        preflight = engine.preflight(target for job in jobs for target in job.owners)
+        outcomes = []
+        for job in jobs:
+            validator = engine.journal.last_validator(job.url) if engine.journal is not None else None
+            job.run(engine, validator, preflight=preflight)
+            status = DownloadJournal.NOT_MODIFIED if job.state == "unchanged" else "ok" if job.state == "done" else "failed"
+            self.record(job.url, job.state in ("done", "unchanged"), status, job.error)
+            for outcome in job.outcomes:
+                outcomes.append(outcome)
+                if on_outcome:
+                    on_outcome(outcome)
+        self.save()
+        return outcomes
+
+
+INSTANCE_KEY_FILE = "p2p_helper_instance.key"
+
+
+def instance_address(directory=None):
+    """Address of the single-instance channel. There is one per user and settings directory."""
+    directory = os.path.abspath(directory or os.getcwd())
+    user = os.environ.get("USERNAME") or os.environ.get("USER") or ""
+    tag = hashlib.sha256(f"{user}|{directory}".encode("utf-8")).hexdigest()[:16]
+    if sys.platform == "win32":
+        return rf"\\.\pipe\p2p_helper_{tag}"
+    return os.path.join(tempfile.gettempdir(), f"p2p_helper_{tag}.sock")
+
+
+def parse_instance_command(argv):
+    """
+    Turns the command line into the request a launch makes: {"command": "focus"} by
+    default, or "update_all" (--update-all), "update" (--update NAME) or "add_path"
+    (--add-path PATH). Unknown arguments are ignored; the last request given wins.
+    """
+    request = {"command": "focus"}
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg == "--update-all":
+            request = {"command": "update_all"}
+        elif arg == "--update" and args:
+            request = {"command": "update", "program": args.pop(0)}
+        elif arg == "--add-path" and args:
+            request = {"command": "add_path", "path": os.path.abspath(args.pop(0))}
+    return request
+
+
+def forward_to_running_instance(request, timeout=2.0):
+    """
+    Sends `request` to the instance already running for this user and settings directory.
+    Returns its reply, or None when no instance is running.
+    """
+    from multiprocessing import AuthenticationError
+    from multiprocessing.connection import Client
+
+    address = instance_address()
+    if sys.platform != "win32" and not os.path.exists(address):
+        return None
+    try:
+        with open(INSTANCE_KEY_FILE, "rb") as f:
+            authkey = f.read()
+        with Client(address, authkey=authkey) as conn:
+            conn.send_bytes(json.dumps(request).encode("utf-8"))
+            if conn.poll(timeout):
+                return json.loads(conn.recv_bytes())
+            return {"ok": True} # Delivered, just not acknowledged in time
+    except (OSError, EOFError, ValueError, AuthenticationError):
+        return None
+
+
+class InstanceServer:
+    """
+    Makes this process the running instance: later launches find it through
+    instance_address() and forward their request instead of starting another app.
+    Connections are authenticated with a random key kept in INSTANCE_KEY_FILE.
+    """
+
+    def __init__(self):
+        self.listener = None
+        self._thread = None
+
+    def acquire(self):
+        """Starts listening. Returns False if another instance owns the channel."""
+        from multiprocessing.connection import Listener
+
+        address = instance_address()
+        if sys.platform != "win32" and os.path.exists(address):
+            import socket
+            probe = socket.socket(socket.AF_UNIX)
+            try:
+                probe.connect(address)
+                return False # Another instance is listening
+            except ConnectionRefusedError:
+                os.remove(address) # Left behind by an instance that didn't exit cleanly
+            except OSError:
+                return False
+            finally:
+                probe.close()
+        authkey = os.urandom(32)
+        try:
+            self.listener = Listener(address, authkey=authkey)
+        except OSError:
+            return False
+        fd, temp_path = tempfile.mkstemp(prefix=".p2p_helper_", dir=os.path.dirname(os.path.abspath(INSTANCE_KEY_FILE)))
+        with os.fdopen(fd, "wb") as f:
+            f.write(authkey)
+        os.replace(temp_path, INSTANCE_KEY_FILE)
+        return True
+
+    def serve(self, on_request):
+        """Hands every forwarded request to on_request(request) on a background thread; its return value is the reply."""
+        self._thread = threading.Thread(target=self._serve, args=(on_request,), name="InstanceServer", daemon=True)
+        self._thread.start()
+
+    def _serve(self, on_request):
+        from multiprocessing import AuthenticationError
+
+        while self.listener is not None:
+            try:
+                conn = self.listener.accept()
+            except (AuthenticationError, EOFError):
+                continue
+            except OSError:
+                break # Closed
+            with conn:
+                try:
+                    request = json.loads(conn.recv_bytes())
+                    reply = on_request(request) if isinstance(request, dict) else None
+                    conn.send_bytes(json.dumps(reply or {"ok": True}).encode("utf-8"))
+                except (OSError, EOFError, ValueError):
+                    pass
+
+    def close(self):
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            try:
+                listener.close()
+            except OSError:
+                pass
+            try:
+                os.remove(INSTANCE_KEY_FILE)
+            except OSError:
+                pass
@@ -1,18 +1,34 @@
+import time
+STARTUP_STARTED = time.perf_counter() # Origin of the startup timeline
+STARTUP_IMPORT_MARKS = [] # (label, perf_counter() value) recorded while this module's imports run
+
+import sys
+if __name__ == "__main__" and sys.argv[1:2] == ["--cli"]:
+    # Headless mode (see p2p_helper_cli.py): neither tkinter nor Pillow is loaded
+    from p2p_helper_cli import main as cli_main
+    sys.exit(cli_main(sys.argv[2:]))
+if __name__ == "__main__" and sys.argv[1:2] != ["--broker"]:
+    # A second launch hands its request to the running instance and exits before Tk is even loaded
+    from p2p_helper_core import forward_to_running_instance, parse_instance_command
+    if forward_to_running_instance(parse_instance_command(sys.argv[1:])) is not None:
+        sys.exit(0)
+
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
+STARTUP_IMPORT_MARKS.append(("tkinter imported", time.perf_counter()))
 import subprocess
 import traceback
 import os
-import winreg # For Windows Registry access
 import threading
 import json
-import urllib.request
 import re
 from datetime import datetime
 import urllib.parse
-import webbrowser
-import sys
+# urllib.request (which pulls in http.client, email and ssl) and webbrowser are imported
+# by the methods that use them, to keep them off the startup path.
 import shutil # For shutil.which
+import logging
+import collections
 
 # Import ctypes at the top level to ensure it's available for the AppUserModelID call.
 try:
@@ -20,96 +36,148 @@ try:
 except (ImportError, AttributeError):
     ctypes = None # Ensure ctypes is None if it fails to import or on non-windows
 
-try:
-    from PIL import Image, ImageTk
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
-
-class ToolTip:
+import importlib.util
+# Pillow is only imported (by IconAtlas, in the background) when the icon atlas has to be rebuilt
+PIL_AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+from p2p_helper_core import (
+    EDONKEY_SERVER_LISTS, EMULE_NODES_LISTS, LAST_UPDATED_FIELDS, LOG_LEVELS, REGISTRY_TARGET,
+    AssetIndex, CallEvent, DownloadJournal, ElevatedBroker, IconAtlas, InstanceServer, JsonSettingsStore, LogSink, MetricsServer,
+    ParallelUpdateRunner, PlannedDownload, ProgramSearchIndex, ProgressEvent, RefreshScheduler, StallWatchdog, StartupTimeline,
+    UiEventBus, UpdateEngine, ValueEvent, WinePrefix,
+    build_update_jobs, check_links, default_wine_prefixes, dry_run_plan, forward_to_running_instance, http_tracer, is_admin,
+    metrics, open_settings_store, open_url, operation_profiler, parse_instance_command, plan_program_downloads, profiled, program_key,
+    read_windows_uninstall_entries, remote_last_modified, run_broker, scan_wine_prefixes,
+)
+STARTUP_IMPORT_MARKS.append(("modules imported", time.perf_counter()))
+
+HTTP_TRACE_FILE = "p2p_helper_http.jsonl" # Phase timings of every HTTP request; shared with the --cli modes
+DIAGNOSTICS_PHASES = ("dns", "connect", "tls", "ttfb", "transfer") # Columns of the Diagnostics tab
+
+class ToolTipManager:
     """
-    Create a tooltip for a given widget.
+    Shows the tooltips of every registered widget through one shared tip window.
+    It is driven purely by <Enter>/<Leave>/<Motion> events, so nothing runs while the
+    pointer is still, and handlers are bound once per widget instead of per event.
     """
-    def __init__(self, widget, text_func):
-        self.widget = widget
-        self.text_func = text_func
-        self.tip_window = None
-        self.id = None
-        self.x = self.y = 0
-        self.widget.bind("<Enter>", self.enter)
-        self.widget.bind("<Leave>", self.on_leave)
-        self.widget.bind("<ButtonPress>", self.leave) # Hide on click
-
-    def enter(self, event=None):
-        self.schedule()
-
-    def on_leave(self, event=None):
-        # This is called when the mouse leaves the widget.
-        # We unschedule any pending 'showtip' and hide any visible tip.
-        self.leave()
-
-    def leave(self, event=None):
-        self.unschedule()
-        self.hidetip()
-
-    def schedule(self):
-        self.unschedule()
-        self.id = self.widget.after(500, self.showtip)
-
-    def unschedule(self):
-        id = self.id
-        self.id = None
-        if id:
-            self.widget.after_cancel(id)
-
-    def showtip(self, event=None):
-        text = self.text_func()
-        if self.tip_window or not text:
-            return
-        # Use the widget's root coordinates directly, which is more robust
-        # than relying on bbox("insert") which fails on non-text widgets.
-        x = self.widget.winfo_rootx() + 25
-        y = self.widget.winfo_rooty() + self.widget.winfo_height() + 5
-
-        self.tip_window = tw = tk.Toplevel(self.widget)
-        # Make the tooltip appear on top of other windows
-        tw.wm_attributes("-topmost", True)
-
-        tw.wm_overrideredirect(True)
-        tw.wm_geometry(f"+{x}+{y}")
-        label = tk.Label(tw, text=text, justify=tk.LEFT,
-                         background="#ffffe0", relief=tk.SOLID, borderwidth=1,
-                         font=("tahoma", "8", "normal"))
-        label.pack(ipadx=1)
-        # Start a recurring check to hide the tip if the mouse moves away.
-        self.widget.after(100, self.check_mouse_position)
-
-    def hidetip(self):
-        tw = self.tip_window
-        self.tip_window = None
-        if tw:
-            tw.destroy()
+    DELAY_MS = 500
 
-    def check_mouse_position(self):
+    def __init__(self, root):
+        self.root = root
+        self.text_funcs = {} # widget path -> callable returning the tip text
+        self.row_funcs = {} # treeview path -> callable(item_id) returning the row's tip text or None
+        self.tip_window = None
+        self.label = None
+        self.after_id = None
+        self.widget = None # Widget the pending or visible tip belongs to
+        self.row = None # Treeview row under the pointer
+        self.pending = None # Text (or text function) of the pending tip
+        self.position = None # Screen position for row tips; widget tips go under the widget
+
+    def add(self, widget, text_func):
+        """Shows text_func() when the pointer rests on `widget`."""
+        self.text_funcs[str(widget)] = text_func
+        widget.bind("<Enter>", self._on_enter, add="+")
+        self._bind_common(widget)
+
+    def add_tree(self, tree, row_text):
         """
-        Recursively checks if the mouse is still over the widget. If not,
-        hides the tooltip. This is more reliable than relying on <Motion> events.
+        Per-row tooltips for a treeview. row_text(item_id) returns the tip text or None;
+        it is only called when the pointer moves onto a different row.
         """
-        if not self.tip_window:
-            return # Stop checking if the tip is already hidden
+        self.row_funcs[str(tree)] = row_text
+        tree.bind("<Motion>", self._on_tree_motion, add="+")
+        self._bind_common(tree)
 
-        # Get the widget's current screen coordinates and mouse position
-        x, y, w, h = self.widget.winfo_rootx(), self.widget.winfo_rooty(), self.widget.winfo_width(), self.widget.winfo_height()
-        mx, my = self.widget.winfo_pointerxy()
+    def _bind_common(self, widget):
+        widget.bind("<Leave>", self._on_leave, add="+")
+        widget.bind("<ButtonPress>", self._on_leave, add="+") # Hide on click
+        widget.bind("<Destroy>", self._on_destroy, add="+")
 
-        if not (x <= mx <= x + w and y <= my <= y + h):
-            self.leave()
+    def _on_enter(self, event):
+        self._reset()
+        self.widget = event.widget
+        self._schedule(self.text_funcs.get(str(event.widget)))
+
+    def _on_tree_motion(self, event):
+        tree = event.widget
+        row = tree.identify_row(event.y)
+        if tree is self.widget and row == self.row:
+            return # Still on the same row: the tip is already pending or shown
+        self._reset()
+        self.widget, self.row = tree, row
+        row_text = self.row_funcs.get(str(tree))
+        text = row_text(row) if row and row_text else None
+        if text:
+            self.position = (event.x_root + 15, event.y_root + 20)
+            self._schedule(text)
+
+    def _on_leave(self, event=None):
+        self._reset()
+
+    def _on_destroy(self, event):
+        path = str(event.widget)
+        self.text_funcs.pop(path, None)
+        self.row_funcs.pop(path, None)
+        if self.widget is not None and str(self.widget) == path:
+            self._reset()
+
+    def _schedule(self, text):
+        if text:
+            self.pending = text
+            self.after_id = self.root.after(self.DELAY_MS, self._show)
+
+    def _reset(self):
+        """Cancels any pending tip and hides the visible one."""
+        if self.after_id:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+        if self.tip_window is not None:
+            self.tip_window.withdraw()
+        self.widget = self.row = self.pending = self.position = None
+
+    def _show(self):
+        self.after_id = None
+        widget = self.widget
+        if widget is None or not widget.winfo_exists():
+            return
+        text = self.pending() if callable(self.pending) else self.pending
+        if not text:
+            return
+        if self.position:
+            x, y = self.position
         else:
-            # If the mouse is still over, schedule another check
-            self.widget.after(100, self.check_mouse_position)
+            # Use the widget's root coordinates directly, which is more robust
+            # than relying on bbox("insert") which fails on non-text widgets.
+            x = widget.winfo_rootx() + 25
+            y = widget.winfo_rooty() + widget.winfo_height() + 5
+
+        if self.tip_window is None:
+            self.tip_window = tw = tk.Toplevel(self.root)
+            tw.withdraw()
+            # Make the tooltip appear on top of other windows
+            tw.wm_attributes("-topmost", True)
+            tw.wm_overrideredirect(True)
+            self.label = tk.Label(tw, justify=tk.LEFT,
+                                  background="#ffffe0", relief=tk.SOLID, borderwidth=1,
+                                  font=("tahoma", "8", "normal"))
+            self.label.pack(ipadx=1)
+        self.label.config(text=text)
+        self.tip_window.wm_geometry(f"+{x}+{y}")
+        self.tip_window.deiconify()
+        self.tip_window.lift()
 
 class P2PHelperApp(tk.Tk):
     VERSION: str = "1.1"
+    SETTINGS_SAVE_DELAY_MS: int = 250 # Saves requested within this window are written once
+    STALE_TARGET_DAYS: int = 30 # "Download Health" thresholds
+    SLOW_FETCH_MS: int = 10000
+    LOG_FLUSH_INTERVAL_MS: int = 100 # Log lines queued by any thread are shown in one batch per tick
+    LOG_MAX_LINES: int = 2000 # Older lines are trimmed from the log widget (the log file keeps everything)
+    UI_EVENT_INTERVAL_MS: int = 33 # Worker events are applied at most ~30 times per second
+    POPUP_SUMMARY_DELAY_MS: int = 400 # Popups arriving closer together than this are shown as one summary
+    REFRESH_TICK_MS: int = 60000 # How often the automatic refresh looks for due download sources
+    REFRESH_FIRST_TICK_MS: int = 5000 # Keeps the first check clear of startup
     DISCLAIMER_TEXT: str = (
         "This program is intended for educational purposes, fair use, and the legal sharing of content.\n\n"
         "The use of this software and any associated P2P clients for any other purpose, including the "
@@ -120,6 +188,11 @@ class P2PHelperApp(tk.Tk):
 
     def __init__(self):
         super().__init__()
+        self.startup_timeline = StartupTimeline(STARTUP_STARTED)
+        for label, at in STARTUP_IMPORT_MARKS:
+            if at >= STARTUP_STARTED: # The benchmark moves the origin when it builds the window again
+                self.startup_timeline.mark(label, at)
+        self.startup_timeline.mark("tk ready")
         self.title(f"P2P Connection Helper v{self.VERSION}")
         
         # --- Determine base path for assets (for frozen executables) ---
@@ -131,14 +204,33 @@ class P2PHelperApp(tk.Tk):
             # If running as a normal .py script
             self.script_dir = os.path.dirname(os.path.abspath(__file__))
 
+        # Index the bundled icons once, so icon lookups never hit the disk afterwards.
+        self.assets = AssetIndex(self.script_dir)
+
         self.geometry("900x700")
         # --- Menu Bar ---
         menubar = tk.Menu(self)
         self.config(menu=menubar)
 
         # File Menu
+        self.auto_refresh_var = tk.BooleanVar(self, value=True) # Persisted as settings["auto_refresh"]
         file_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="File", menu=file_menu)
+        file_menu.add_command(label="Wine Prefixes...", command=self.manage_wine_prefixes)
+        file_menu.add_command(label="Download Health...", command=self.show_download_health)
+        file_menu.add_command(label="Preview Update All...", command=self.show_update_preview)
+        file_menu.add_command(label="Refresh Schedule...", command=self.show_refresh_schedule)
+        file_menu.add_checkbutton(label="Refresh Sources Automatically", variable=self.auto_refresh_var, command=self.save_settings)
+        # Profiling is opt-in per session: the menu or P2P_HELPER_PROFILE=cpu|memory|all
+        operation_profiler.configure(os.environ.get("P2P_HELPER_PROFILE"))
+        operation_profiler.on_report = lambda name, elapsed_ms, paths: self.log_message(
+            f"Profiled {name} ({elapsed_ms:.0f} ms): {', '.join(paths)}")
+        self.profile_cpu_var = tk.BooleanVar(self, value=operation_profiler.cpu)
+        self.profile_memory_var = tk.BooleanVar(self, value=operation_profiler.memory)
+        profiling_menu = tk.Menu(file_menu, tearoff=0)
+        profiling_menu.add_checkbutton(label="CPU Time (cProfile)", variable=self.profile_cpu_var, command=self._apply_profiling)
+        profiling_menu.add_checkbutton(label="Memory (tracemalloc)", variable=self.profile_memory_var, command=self._apply_profiling)
+        file_menu.add_cascade(label="Profiling", menu=profiling_menu)
         file_menu.add_command(label="Reset Settings...", command=self.reset_settings)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.quit)
@@ -158,38 +250,118 @@ class P2PHelperApp(tk.Tk):
             "Unknown": []  # Fallback for manually added programs
         }
 
-        self.EDONKEY_SERVER_LISTS = {
-            "eMule Security": "http://upd.emule-security.org/server.met",
-            "ShortyPower": "https://shortypower.org/server.met",
-            "GitHub Backup (ShortyPower)": "https://raw.githubusercontent.com/GamerA1-99/Server.met/shortypower/server.met",
-            "GitHub Backup (eMule Security)": "https://raw.githubusercontent.com/GamerA1-99/Server.met/emule-security/server.met",
-        }
-
-        self.EMULE_NODES_LISTS = {
-            "eMule Security": "http://upd.emule-security.org/nodes.dat",
-            "GitHub Backup (eMule Security)": "https://raw.githubusercontent.com/GamerA1-99/Server.met/emule-security/nodes.dat",
-        }
+        self.EDONKEY_SERVER_LISTS = EDONKEY_SERVER_LISTS
+        self.EMULE_NODES_LISTS = EMULE_NODES_LISTS
 
         self.CUSTOM_SERVER_LISTS = {} # To store user-added server lists {network: {name: url}}
         self.installed_programs = [] # To store list of {DisplayName, ..., Network, Source}
         self.hidden_registry_keys = [] # To store registry keys of programs to ignore
+        self.wine_prefixes = [] # Extra Wine prefix folders to scan (Linux/macOS)
         self.settings_file = "p2p_helper_settings.json" # For persistence of manually added programs
+        # JSON by default; SQLite when P2P_HELPER_STORAGE=sqlite or p2p_helper_settings.db exists.
+        self.settings_store = open_settings_store(self.settings_file, on_saved=self._on_settings_saved, on_error=self._on_settings_save_error)
+        self._settings_save_scheduled = False
+        self.download_journal = DownloadJournal("p2p_helper_journal.jsonl") # One event per source fetch
+        http_tracer.open_log(HTTP_TRACE_FILE) # Phase timings of every HTTP request, for the Diagnostics tab
+        # When each download source is refreshed next; shared with the --cli service mode
+        self.refresh_scheduler = RefreshScheduler("p2p_helper_schedule.json")
+        self._refresh_running = False
+        self._queued_update = None # Programs of an update requested while the automatic refresh was running
+        self._refresh_schedule_view = None # Refills the "Refresh Schedule" window while it is open
+        self.update_runner = None # The ParallelUpdateRunner of the update in progress, if any
+        self.update_jobs = [] # UpdateJobs of the current (or last) update, shown in the update window
+        self.update_window = None
         self.selected_program = None
         self.tree_item_to_program = {} # Maps (treeview_widget, item_id) to program dict
         self.network_tabs = {} # Maps network name to its tab frame
+        self.network_trees = {} # Maps network name to its treeview
+        self.tree_rows = {} # Maps network name to {item_id: row values currently shown}
+        self.search_index = ProgramSearchIndex() # Kept in step with the program list by _update_program_list_ui
         self.is_editing = False
         self.download_buttons = {} # Maps URL to button widget for the downloads tab
         self.faq_window = None # To hold a reference to the FAQ window
+        self.tooltips = ToolTipManager(self) # One tip window shared by every widget
+        # The app runs unelevated; writes it isn't allowed to do go through this helper,
+        # which is only started (with a UAC prompt) the first time one is needed.
+        self.broker = ElevatedBroker(lambda arguments: run_as_admin(arguments=arguments))
+        self.instance_server = None # Set by main() when this process is the running instance
+        # Worker threads reach the UI only through this bus (see _pump_ui_events)
+        self.ui_events = UiEventBus()
+        self.progress_handlers = {} # task name -> callable(ProgressEvent) run on the UI thread
+        self._pending_popups = []
+        self._last_popup_at = 0.0
+        self._showing_popups = False
         self.icon_cache = {} # To store loaded PhotoImage objects
+        self._composite_icons = {} # icon_cache key -> asset filenames drawn side by side
+        # Icons are cut from a pre-rendered sprite sheet that is checked (and rebuilt if needed)
+        # in the background. Until then widgets get blank placeholders that are painted in place.
+        self.icon_atlas = IconAtlas(self.assets, "p2p_helper_icons")
+        self.icon_atlas_ready = False
+        self._icon_atlas_image = None
+        self.icons_available = PIL_AVAILABLE or os.path.exists(self.icon_atlas.image_path)
+        if self.icons_available:
+            self.icon_atlas.start(lambda available: self.ui_events.call(self._on_icon_atlas_ready, available))
         self.settings = {} # To hold all loaded settings
+        self.log_sink = LogSink("p2p_helper.log") # Thread-safe; also writes the rotating log file
+        # Logs where the event loop was blocked whenever it stalls; started once the window is up
+        stall_ms = os.environ.get("P2P_HELPER_STALL_MS", "")
+        self.stall_watchdog = StallWatchdog(self._on_ui_stall, threshold_ms=int(stall_ms) if stall_ms.isdigit() else None)
+        self.metrics_server = None # Only with P2P_HELPER_METRICS_PORT; see --cli service --metrics-port
+        if os.environ.get("P2P_HELPER_METRICS_PORT", "").isdigit():
+            try:
+                self.metrics_server = MetricsServer(metrics, int(os.environ["P2P_HELPER_METRICS_PORT"]))
+            except OSError as e:
+                self.log_message(f"Could not start the metrics endpoint: {e}", logging.WARNING)
+        self.log_records = collections.deque(maxlen=self.LOG_MAX_LINES) # What the log widget can show, for re-filtering
+        # Downloads, target writes and .reg imports; the same engine runs headless with --cli
+        self.update_engine = UpdateEngine(self.download_journal, self.settings_store,
+                                          None if is_admin() else self.broker, self.log_message)
 
 
         self.create_widgets()
         self._create_tooltips()
+        self.startup_timeline.mark("widgets created")
+        self.after(self.LOG_FLUSH_INTERVAL_MS, self._drain_log)
+        self.after(self.UI_EVENT_INTERVAL_MS, self._pump_ui_events)
+        self.after(self.REFRESH_FIRST_TICK_MS, self._refresh_tick)
         self.load_settings() # Load persistent settings on startup
+        self.startup_timeline.mark("settings loaded")
+        self.after_idle(self._on_first_idle)
         self.show_bearshare_test_warning() # Show special warning if BearShare Test is found
         self.show_startup_disclaimer() # Show disclaimer after loading settings
 
+    def _apply_profiling(self):
+        """Applies the File > Profiling toggles; reports go to operation_profiler.folder."""
+        operation_profiler.cpu = self.profile_cpu_var.get()
+        operation_profiler.memory = self.profile_memory_var.get()
+        if operation_profiler.enabled:
+            self.log_message(f"Profiling scans, program list rebuilds and downloads into '{operation_profiler.folder}'.")
+        else:
+            self.log_message("Profiling turned off.")
+
+    def _on_first_idle(self):
+        """Runs once the event loop first goes idle, i.e. after the main window has been drawn."""
+        self.startup_timeline.mark("first paint")
+        self.log_message(f"Startup: {self.startup_timeline.summary()}", logging.DEBUG)
+        self.stall_watchdog.start()
+        self._stall_heartbeat()
+
+    def destroy(self):
+        self.stall_watchdog.stop() # Its thread would otherwise keep reporting the missing heartbeats
+        super().destroy()
+
+    def _stall_heartbeat(self):
+        self.stall_watchdog.heartbeat()
+        self.after(self.stall_watchdog.heartbeat_ms, self._stall_heartbeat)
+
+    def _on_ui_stall(self, duration_ms, stack):
+        """Called from the watchdog thread after the event loop was blocked; logs where it was stuck."""
+        if not stack:
+            self.log_message(f"The window was unresponsive for {duration_ms:.0f} ms (no stack sampled).", logging.WARNING)
+            return
+        self.log_message(f"The window was unresponsive for {duration_ms:.0f} ms in {stack[-1]}. "
+                         f"Call path: {' > '.join(stack)}", logging.WARNING)
+
     def create_widgets(self):
         # Main frame
         main_frame = ttk.Frame(self, padding="10")
@@ -207,6 +379,10 @@ class P2PHelperApp(tk.Tk):
         downloads_tab = ttk.Frame(main_notebook)
         main_notebook.add(downloads_tab, text="Client & Server Downloads")
 
+        # --- Tab 3: Diagnostics ---
+        diagnostics_tab = ttk.Frame(main_notebook)
+        main_notebook.add(diagnostics_tab, text="Diagnostics")
+
         # Top section: Program List and Actions
         top_frame = ttk.Frame(manager_tab, padding="10")
         top_frame.pack(fill=tk.BOTH, expand=True)
@@ -218,7 +394,7 @@ class P2PHelperApp(tk.Tk):
         program_list_frame = ttk.LabelFrame(top_frame, text="My P2P Programs", padding="10")
         program_list_frame.grid(row=0, column=0, rowspan=2, sticky="nsew", padx=(0, 10))
         program_list_frame.grid_columnconfigure(0, weight=1)
-        program_list_frame.grid_rowconfigure(1, weight=1)
+        program_list_frame.grid_rowconfigure(3, weight=1)
 
         button_row_frame = ttk.Frame(program_list_frame)
         button_row_frame.grid(row=0, column=0, sticky="ew", pady=(0, 5))
@@ -229,6 +405,9 @@ class P2PHelperApp(tk.Tk):
         self.add_manual_button = ttk.Button(button_row_frame, text="Add Manually...", command=self.add_program_manually)
         self.add_manual_button.pack(side=tk.LEFT, padx=(0, 5))
 
+        self.update_all_button = ttk.Button(button_row_frame, text="Update All", command=self.update_all_programs)
+        self.update_all_button.pack(side=tk.LEFT, padx=(0, 5))
+
         self.edit_button = ttk.Button(button_row_frame, text="Edit", command=self.toggle_edit_mode, state=tk.DISABLED)
         self.edit_button.pack(side=tk.LEFT, padx=(5, 5))
 
@@ -236,8 +415,28 @@ class P2PHelperApp(tk.Tk):
         self.save_button = ttk.Button(button_row_frame, text="Save", command=self.save_edited_program)
         self.cancel_button = ttk.Button(button_row_frame, text="Cancel", command=self.toggle_edit_mode)
 
+        # Search box: results are listed under it as the user types
+        search_frame = ttk.Frame(program_list_frame)
+        search_frame.grid(row=1, column=0, sticky="ew", pady=(0, 5))
+        search_frame.grid_columnconfigure(1, weight=1)
+        ttk.Label(search_frame, text="Search:").grid(row=0, column=0, sticky="w", padx=(0, 5))
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *args: self._update_search_results())
+        self.search_entry = ttk.Entry(search_frame, textvariable=self.search_var)
+        self.search_entry.grid(row=0, column=1, sticky="ew")
+        self.search_entry.bind("<Return>", lambda e: self._open_search_result(0))
+        self.search_entry.bind("<Down>", self._focus_search_results)
+        self.search_entry.bind("<Escape>", lambda e: self.search_var.set(""))
+        self.search_results_list = tk.Listbox(program_list_frame, height=6, activestyle="dotbox", exportselection=False)
+        self.search_results_list.grid(row=2, column=0, sticky="ew", pady=(0, 5))
+        self.search_results_list.grid_remove() # Only shown while there is a query
+        self.search_results_list.bind("<Return>", lambda e: self._open_search_result())
+        self.search_results_list.bind("<Double-1>", lambda e: self._open_search_result())
+        self.search_results_list.bind("<Escape>", lambda e: (self.search_var.set(""), self.search_entry.focus_set()))
+        self.search_result_keys = [] # Program keys, in the order listed
+
         self.program_notebook = ttk.Notebook(program_list_frame)
-        self.program_notebook.grid(row=1, column=0, sticky="nsew")
+        self.program_notebook.grid(row=3, column=0, sticky="nsew")
 
         # --- Program Details and Actions Frame ---
         details_frame = ttk.LabelFrame(top_frame, text="Program Details & Actions", padding="10")
@@ -318,7 +517,7 @@ class P2PHelperApp(tk.Tk):
         self.remote_last_updated_var = tk.StringVar(value="N/A")
         self.server_remote_updated_value = ttk.Label(common_server_frame, textvariable=self.remote_last_updated_var, font=("Segoe UI", 9, "italic"), foreground="gray")
         self.server_remote_updated_value.grid(row=5, column=1, sticky="w", padx=5, pady=3)
-        ToolTip(self.server_remote_updated_value, lambda: "Last modification date of the file on the remote server. 'N/A' may mean the server doesn't provide this info.")
+        self.tooltips.add(self.server_remote_updated_value, lambda: "Last modification date of the file on the remote server. 'N/A' may mean the server doesn't provide this info.")
 
 
         # --- Action Buttons ---
@@ -334,15 +533,73 @@ class P2PHelperApp(tk.Tk):
         self.remove_program_button = ttk.Button(action_buttons_frame, text="Remove Program", command=self.remove_program, state=tk.DISABLED)
         self.remove_program_button.pack(side=tk.RIGHT)
 
-        # --- Kademlia (Nodes) section, shown dynamically in Server List tab for eMule ---
-        self.nodes_frame = ttk.LabelFrame(server_tab, text="Kademlia (nodes.dat)", padding=10)
+        # --- Kademlia (nodes.dat) and WinMX patch sections of the Server List tab ---
+        # Their frames are only built the first time a program needs them (see _ensure_nodes_frame
+        # and _ensure_winmx_patch_frame), but the variables exist from the start.
+        self.server_tab = server_tab
+        self.nodes_frame = None
+        self.winmx_patch_frame = None
+        self.nodes_list_url_var = tk.StringVar()
+        self.nodes_list_url_var.trace_add("write", self.on_nodes_list_url_change)
+        self.nodes_list_target_var = tk.StringVar()
+        self.nodes_list_target_var.trace_add("write", self.on_nodes_list_url_change)
+        self.nodes_last_updated_var = tk.StringVar(value="N/A")
+        self.nodes_remote_last_updated_var = tk.StringVar(value="N/A")
+        self.winmx_patch_url_var = tk.StringVar()
+        self.winmx_patch_url_var.trace_add("write", self.on_winmx_patch_change)
+        self.winmx_patch_target_var = tk.StringVar()
+        self.winmx_patch_target_var.trace_add("write", self.on_winmx_patch_change)
+        self.winmx_patch_last_updated_var = tk.StringVar(value="N/A")
+        self.winmx_remote_last_updated_var = tk.StringVar(value="N/A")
+
+        # Log output
+        log_frame = ttk.LabelFrame(manager_tab, text="Log", padding="10")
+        log_frame.pack(fill=tk.BOTH, expand=True, pady=(10, 0))
+        log_frame.grid_columnconfigure(0, weight=1)
+        log_frame.grid_rowconfigure(1, weight=1)
+
+        log_filter_frame = ttk.Frame(log_frame)
+        log_filter_frame.grid(row=0, column=0, sticky="e", pady=(0, 5))
+        ttk.Label(log_filter_frame, text="Show:").pack(side=tk.LEFT, padx=(0, 5))
+        self.log_level_var = tk.StringVar(value="Info")
+        log_level_combo = ttk.Combobox(log_filter_frame, textvariable=self.log_level_var, values=list(LOG_LEVELS), state="readonly", width=10)
+        log_level_combo.pack(side=tk.LEFT)
+        log_level_combo.bind("<<ComboboxSelected>>", lambda e: self._render_log_records())
+
+        self.log_text = scrolledtext.ScrolledText(log_frame, wrap=tk.WORD, height=10)
+        # Make the widget read-only by intercepting key presses, but keep it
+        # in a 'normal' state so that text can be selected and copied.
+        self.log_text.bind("<KeyPress>", lambda e: "break")
+        self.log_text.grid(row=1, column=0, sticky="nsew")
+        self.log_text.tag_configure("Debug", foreground="gray")
+        self.log_text.tag_configure("Warning", foreground="#b36b00")
+        self.log_text.tag_configure("Error", foreground="red")
+
+        # --- Log Context Menu ---
+        self.log_context_menu = tk.Menu(self.log_text, tearoff=0)
+        self.log_context_menu.add_command(label="Copy", command=self.copy_log_text)
+        self.log_context_menu.add_command(label="Copy All", command=self.copy_all_log_text)
+        self.log_context_menu.add_separator()
+        self.log_context_menu.add_command(label="Clear Log", command=self.clear_log)
+        self.log_text.bind("<Button-3>", self.show_log_context_menu)
+
+        # --- The Client Downloads Tab is populated the first time it is shown ---
+        self.downloads_tab = downloads_tab
+        self.downloads_tab_built = False
+        self.diagnostics_tab = diagnostics_tab
+        self.diagnostics_tab_built = False
+        main_notebook.bind("<<NotebookTabChanged>>", self._on_main_tab_changed)
+
+    def _ensure_nodes_frame(self):
+        """Builds the Kademlia (nodes.dat) section of the Server List tab on first use and returns it."""
+        if self.nodes_frame is not None:
+            return self.nodes_frame
+        self.nodes_frame = ttk.LabelFrame(self.server_tab, text="Kademlia (nodes.dat)", padding=10)
         # This frame is gridded dynamically in display_details_panel
         self.nodes_frame.grid_columnconfigure(1, weight=1)
 
         self.nodes_url_label = ttk.Label(self.nodes_frame, text="Nodes List URL:")
         self.nodes_url_label.grid(row=0, column=0, sticky="w", pady=3)
-        self.nodes_list_url_var = tk.StringVar()
-        self.nodes_list_url_var.trace_add("write", self.on_nodes_list_url_change)
         self.nodes_list_url_entry = ttk.Entry(self.nodes_frame, textvariable=self.nodes_list_url_var, state="disabled")
         self.nodes_list_url_entry.grid(row=0, column=1, sticky="ew", padx=5)
         self.nodes_list_url_combo = ttk.Combobox(self.nodes_frame, textvariable=self.nodes_list_url_var, state="disabled")
@@ -355,8 +612,6 @@ class P2PHelperApp(tk.Tk):
 
         self.nodes_target_label = ttk.Label(self.nodes_frame, text="Nodes List Target:")
         self.nodes_target_label.grid(row=1, column=0, sticky="w", pady=3)
-        self.nodes_list_target_var = tk.StringVar()
-        self.nodes_list_target_var.trace_add("write", self.on_nodes_list_url_change)
         self.nodes_list_target_entry = ttk.Entry(self.nodes_frame, textvariable=self.nodes_list_target_var, state="disabled")
         self.nodes_list_target_entry.grid(row=1, column=1, sticky="ew", padx=5)
         self.browse_nodes_target_button = ttk.Button(self.nodes_frame, text="...", width=3, command=lambda: self.browse_generic_target(self.nodes_list_target_var, "nodes.dat"), state="disabled")
@@ -364,25 +619,30 @@ class P2PHelperApp(tk.Tk):
 
         self.nodes_last_updated_label = ttk.Label(self.nodes_frame, text="Last Local Update:")
         self.nodes_last_updated_label.grid(row=2, column=0, sticky="w", pady=3)
-        self.nodes_last_updated_var = tk.StringVar(value="N/A")
         self.nodes_last_updated_value = ttk.Label(self.nodes_frame, textvariable=self.nodes_last_updated_var, font=("Segoe UI", 9, "italic"), foreground="gray")
         self.nodes_last_updated_value.grid(row=2, column=1, sticky="w", padx=5, pady=3)
 
         self.nodes_remote_updated_label = ttk.Label(self.nodes_frame, text="Server Update:")
         self.nodes_remote_updated_label.grid(row=3, column=0, sticky="w", pady=3)
-        self.nodes_remote_last_updated_var = tk.StringVar(value="N/A")
         self.nodes_remote_updated_value = ttk.Label(self.nodes_frame, textvariable=self.nodes_remote_last_updated_var, font=("Segoe UI", 9, "italic"), foreground="gray")
         self.nodes_remote_updated_value.grid(row=3, column=1, sticky="w", padx=5, pady=3)
-        ToolTip(self.nodes_remote_updated_value, lambda: "Last modification date of the file on the remote server. 'N/A' may mean the server doesn't provide this info.")
-
-        # --- WinMX Patch section, shown dynamically in Server List tab ---
-        self.winmx_patch_frame = ttk.LabelFrame(server_tab, text="WinMX Connection Patch (oledlg.dll)", padding=10)
+        self.tooltips.add(self.nodes_remote_updated_value, lambda: "Last modification date of the file on the remote server. 'N/A' may mean the server doesn't provide this info.")
+        self.tooltips.add(self.nodes_list_url_combo, lambda: self.nodes_list_url_var.get())
+        self.tooltips.add(self.nodes_list_target_entry, lambda: self.nodes_list_target_var.get())
+        self.tooltips.add(self.test_nodes_url_button, lambda: "Test if the nodes.dat URL is reachable")
+        self.tooltips.add(self.download_nodes_list_button, lambda: "Download the nodes.dat file to the target path")
+        self.tooltips.add(self.browse_nodes_target_button, lambda: "Browse for the nodes.dat target file")
+        return self.nodes_frame
+
+    def _ensure_winmx_patch_frame(self):
+        """Builds the WinMX patch section of the Server List tab on first use and returns it."""
+        if self.winmx_patch_frame is not None:
+            return self.winmx_patch_frame
+        self.winmx_patch_frame = ttk.LabelFrame(self.server_tab, text="WinMX Connection Patch (oledlg.dll)", padding=10)
         # This frame is gridded dynamically in display_details_panel
         self.winmx_patch_frame.grid_columnconfigure(1, weight=1)
 
         ttk.Label(self.winmx_patch_frame, text="Patch URL:").grid(row=0, column=0, sticky="w", pady=3)
-        self.winmx_patch_url_var = tk.StringVar()
-        self.winmx_patch_url_var.trace_add("write", self.on_winmx_patch_change)
         self.winmx_patch_url_entry = ttk.Entry(self.winmx_patch_frame, textvariable=self.winmx_patch_url_var, state="disabled")
         self.winmx_patch_url_entry.grid(row=0, column=1, sticky="ew", padx=5)
         self.test_winmx_patch_url_button = ttk.Button(self.winmx_patch_frame, text="Test", command=lambda: self.test_url(self.winmx_patch_url_var), state="disabled")
@@ -391,8 +651,6 @@ class P2PHelperApp(tk.Tk):
         self.download_winmx_patch_button.grid(row=0, column=3, sticky="e")
 
         ttk.Label(self.winmx_patch_frame, text="Patch Target:").grid(row=1, column=0, sticky="w", pady=3)
-        self.winmx_patch_target_var = tk.StringVar()
-        self.winmx_patch_target_var.trace_add("write", self.on_winmx_patch_change)
         self.winmx_patch_target_entry = ttk.Entry(self.winmx_patch_frame, textvariable=self.winmx_patch_target_var, state="disabled")
         self.winmx_patch_target_entry.grid(row=1, column=1, sticky="ew", padx=5)
         self.browse_winmx_patch_target_button = ttk.Button(self.winmx_patch_frame, text="...", width=3, command=lambda: self.browse_generic_target(self.winmx_patch_target_var, "OLEDLG.DLL"), state="disabled")
@@ -400,39 +658,20 @@ class P2PHelperApp(tk.Tk):
 
         self.winmx_patch_last_updated_label = ttk.Label(self.winmx_patch_frame, text="Last Local Update:")
         self.winmx_patch_last_updated_label.grid(row=2, column=0, sticky="w", pady=3)
-        self.winmx_patch_last_updated_var = tk.StringVar(value="N/A")
         self.winmx_patch_last_updated_value = ttk.Label(self.winmx_patch_frame, textvariable=self.winmx_patch_last_updated_var, font=("Segoe UI", 9, "italic"), foreground="gray")
         self.winmx_patch_last_updated_value.grid(row=2, column=1, sticky="w", padx=5, pady=3)
 
         self.winmx_remote_updated_label = ttk.Label(self.winmx_patch_frame, text="Server Update:")
         self.winmx_remote_updated_label.grid(row=3, column=0, sticky="w", pady=3)
-        self.winmx_remote_last_updated_var = tk.StringVar(value="N/A")
         self.winmx_remote_updated_value = ttk.Label(self.winmx_patch_frame, textvariable=self.winmx_remote_last_updated_var, font=("Segoe UI", 9, "italic"), foreground="gray")
         self.winmx_remote_updated_value.grid(row=3, column=1, sticky="w", padx=5, pady=3)
-        ToolTip(self.winmx_remote_updated_value, lambda: "Last modification date of the file on the remote server. 'N/A' may mean the server doesn't provide this info.")
-
-        # Log output
-        log_frame = ttk.LabelFrame(manager_tab, text="Log", padding="10")
-        log_frame.pack(fill=tk.BOTH, expand=True, pady=(10, 0))
-        log_frame.grid_columnconfigure(0, weight=1)
-        log_frame.grid_rowconfigure(0, weight=1)
-
-        self.log_text = scrolledtext.ScrolledText(log_frame, wrap=tk.WORD, height=10)
-        # Make the widget read-only by intercepting key presses, but keep it
-        # in a 'normal' state so that text can be selected and copied.
-        self.log_text.bind("<KeyPress>", lambda e: "break")
-        self.log_text.grid(row=0, column=0, sticky="nsew")
-
-        # --- Log Context Menu ---
-        self.log_context_menu = tk.Menu(self.log_text, tearoff=0)
-        self.log_context_menu.add_command(label="Copy", command=self.copy_log_text)
-        self.log_context_menu.add_command(label="Copy All", command=self.copy_all_log_text)
-        self.log_context_menu.add_separator()
-        self.log_context_menu.add_command(label="Clear Log", command=self.clear_log)
-        self.log_text.bind("<Button-3>", self.show_log_context_menu)
-
-        # --- Populate the Client Downloads Tab ---
-        self._create_downloads_tab_widgets(downloads_tab)
+        self.tooltips.add(self.winmx_remote_updated_value, lambda: "Last modification date of the file on the remote server. 'N/A' may mean the server doesn't provide this info.")
+        self.tooltips.add(self.winmx_patch_url_entry, lambda: self.winmx_patch_url_var.get())
+        self.tooltips.add(self.winmx_patch_target_entry, lambda: self.winmx_patch_target_var.get())
+        self.tooltips.add(self.test_winmx_patch_url_button, lambda: "Test if the patch URL is reachable")
+        self.tooltips.add(self.download_winmx_patch_button, lambda: "Download the patch file to the target path")
+        self.tooltips.add(self.browse_winmx_patch_target_button, lambda: "Browse for the patch target file")
+        return self.winmx_patch_frame
 
     CLIENT_DOWNLOADS = {
         "BearShare": "https://drive.google.com/drive/folders/1EWyiP_d9drmVTv5vMQuj2t_Kn6muhebv?usp=drive_link",
@@ -472,6 +711,100 @@ class P2PHelperApp(tk.Tk):
         "Beacon1 Server": "https://drive.google.com/drive/folders/11Yv1PN3ZyT0GwMyEFTaj9C1OE15XFt0I?usp=sharing",
     }
 
+    def _on_main_tab_changed(self, event):
+        """Builds the Client & Server Downloads and Diagnostics tabs on their first view."""
+        notebook = event.widget
+        selected = notebook.nametowidget(notebook.select())
+        if not self.downloads_tab_built and selected is self.downloads_tab:
+            self.downloads_tab_built = True
+            self._create_downloads_tab_widgets(self.downloads_tab)
+            self.startup_timeline.mark("downloads tab built")
+        elif selected is self.diagnostics_tab:
+            if not self.diagnostics_tab_built:
+                self.diagnostics_tab_built = True
+                http_tracer.load(HTTP_TRACE_FILE) # Earlier sessions; this one's requests are in memory
+                self._create_diagnostics_tab_widgets(self.diagnostics_tab)
+            self._refresh_diagnostics()
+
+    def _create_diagnostics_tab_widgets(self, parent_tab):
+        """Populates the Diagnostics tab: per-host request timings and the latest failed requests."""
+        frame = ttk.Frame(parent_tab, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+        frame.grid_columnconfigure(0, weight=1)
+        frame.grid_rowconfigure(1, weight=3)
+        frame.grid_rowconfigure(2, weight=2)
+
+        top_bar_frame = ttk.Frame(frame)
+        top_bar_frame.grid(row=0, column=0, sticky="ew", pady=(0, 10))
+        description_text = ("Timings of the HTTP requests made by downloads, link tests and remote date checks, per host. "
+                            "Times are in milliseconds; the phase columns show the 95th percentile of each phase.")
+        ttk.Label(top_bar_frame, text=description_text, wraplength=600, justify=tk.LEFT).pack(side=tk.LEFT, anchor="w")
+        clear_button = ttk.Button(top_bar_frame, text="Clear", command=self._clear_diagnostics)
+        clear_button.pack(side=tk.RIGHT, padx=(5, 0))
+        self.tooltips.add(clear_button, lambda: f"Start the statistics over (the trace file {HTTP_TRACE_FILE} is kept)")
+        ttk.Button(top_bar_frame, text="Refresh", command=self._refresh_diagnostics).pack(side=tk.RIGHT)
+
+        hosts_frame = ttk.Frame(frame)
+        hosts_frame.grid(row=1, column=0, sticky="nsew")
+        hosts_frame.grid_columnconfigure(0, weight=1)
+        hosts_frame.grid_rowconfigure(0, weight=1)
+        columns = {"host": ("Host", 200), "requests": ("Requests", 70), "errors": ("Errors", 60), "kb": ("KB", 70),
+                   "p50": ("p50", 60), "p95": ("p95", 60), "p99": ("p99", 60)}
+        columns.update({phase: (f"{phase.upper() if phase in ('dns', 'tls', 'ttfb') else phase.capitalize()} p95", 80)
+                        for phase in DIAGNOSTICS_PHASES})
+        self.diagnostics_hosts_tree = ttk.Treeview(hosts_frame, columns=list(columns), show="headings")
+        for column, (heading, width) in columns.items():
+            self.diagnostics_hosts_tree.heading(column, text=heading)
+            self.diagnostics_hosts_tree.column(column, width=width, stretch=(column == "host"), anchor="w" if column == "host" else "e")
+        self.diagnostics_hosts_tree.tag_configure("errors", foreground="red")
+        scrollbar = ttk.Scrollbar(hosts_frame, orient=tk.VERTICAL, command=self.diagnostics_hosts_tree.yview)
+        self.diagnostics_hosts_tree.configure(yscrollcommand=scrollbar.set)
+        self.diagnostics_hosts_tree.grid(row=0, column=0, sticky="nsew")
+        scrollbar.grid(row=0, column=1, sticky="ns")
+
+        failures_frame = ttk.LabelFrame(frame, text="Recent Failures", padding="5")
+        failures_frame.grid(row=2, column=0, sticky="nsew", pady=(10, 0))
+        failures_frame.grid_columnconfigure(0, weight=1)
+        failures_frame.grid_rowconfigure(0, weight=1)
+        columns = {"time": ("Time", 130), "op": ("Request", 80), "phase": ("Failed During", 90),
+                   "ms": ("After (ms)", 70), "url": ("URL", 280), "error": ("Error", 260)}
+        self.diagnostics_failures_tree = ttk.Treeview(failures_frame, columns=list(columns), show="headings", height=6)
+        for column, (heading, width) in columns.items():
+            self.diagnostics_failures_tree.heading(column, text=heading)
+            self.diagnostics_failures_tree.column(column, width=width, stretch=column in ("url", "error"),
+                                                  anchor="e" if column == "ms" else "w")
+        scrollbar = ttk.Scrollbar(failures_frame, orient=tk.VERTICAL, command=self.diagnostics_failures_tree.yview)
+        self.diagnostics_failures_tree.configure(yscrollcommand=scrollbar.set)
+        self.diagnostics_failures_tree.grid(row=0, column=0, sticky="nsew")
+        scrollbar.grid(row=0, column=1, sticky="ns")
+
+    def _refresh_diagnostics(self):
+        """Refills the Diagnostics tab from the traces collected so far."""
+        if not self.diagnostics_tab_built:
+            return
+
+        def ms(value):
+            return "-" if value is None else f"{value:.0f}"
+
+        self.diagnostics_hosts_tree.delete(*self.diagnostics_hosts_tree.get_children())
+        for row in http_tracer.summary():
+            values = (row["host"], row["requests"], row["errors"], f"{row['bytes'] / 1024:.0f}",
+                      ms(row["p50_ms"]), ms(row["p95_ms"]), ms(row["p99_ms"]),
+                      *(ms(row["phase_p95_ms"][phase]) for phase in DIAGNOSTICS_PHASES))
+            self.diagnostics_hosts_tree.insert("", tk.END, values=values, tags=("errors",) if row["errors"] else ())
+        self.diagnostics_failures_tree.delete(*self.diagnostics_failures_tree.get_children())
+        for record in http_tracer.failures():
+            phase = record.get("error_phase") or ""
+            if phase == "status":
+                phase = f"HTTP {record.get('status')}"
+            self.diagnostics_failures_tree.insert("", tk.END, values=(
+                datetime.fromtimestamp(record.get("ts", 0)).strftime("%Y-%m-%d %H:%M:%S"), record.get("op", ""), phase,
+                ms(record.get("total_ms")), record.get("url", ""), record.get("error", "")))
+
+    def _clear_diagnostics(self):
+        http_tracer.clear()
+        self._refresh_diagnostics()
+
     def _create_downloads_tab_widgets(self, parent_tab):
         """Populates the Client & Server Downloads tab with categorized panels."""
         frame = ttk.Frame(parent_tab, padding="20")
@@ -487,6 +820,7 @@ class P2PHelperApp(tk.Tk):
 
         self.test_downloads_button = ttk.Button(top_bar_frame, text="Test All Links", command=self.test_all_download_links)
         self.test_downloads_button.pack(side=tk.RIGHT, padx=10, pady=10)
+        self.tooltips.add(self.test_downloads_button, lambda: "Check all download links and disable any that are unresponsive")
 
         # Progress bar for link testing, initially hidden
         self.download_test_progress = ttk.Progressbar(frame, orient='horizontal', mode='determinate')
@@ -550,6 +884,7 @@ class P2PHelperApp(tk.Tk):
 
     def _open_download_url(self, url):
         """Opens the specified URL in the default web browser."""
+        import webbrowser
         self.log_message(f"Opening URL in browser: {url}")
         webbrowser.open_new_tab(url)
 
@@ -565,28 +900,17 @@ class P2PHelperApp(tk.Tk):
         # Show and configure the progress bar
         total_links = len(self.CLIENT_DOWNLOADS)
         self.download_test_progress.config(maximum=total_links, value=0)
+        self.progress_handlers["link_test"] = lambda event: self.download_test_progress.config(value=event.done)
         self.download_test_progress.pack(fill=tk.X, padx=20, pady=(0, 10), before=self.download_buttons[next(iter(self.download_buttons))].master.master)
 
         threading.Thread(target=self._perform_download_links_test, args=(total_links,), daemon=True).start()
 
     def _perform_download_links_test(self, total_links):
         """Worker thread to test each download link."""
-        dead_links = []
-        for i, url in enumerate(self.CLIENT_DOWNLOADS.values()):
-            try:
-                # Use a HEAD request to check for existence without downloading the content
-                req = urllib.request.Request(url, method='HEAD')
-                # Google Drive links often redirect, so we need to handle that.
-                # A simple HEAD request might fail, but urlopen will follow redirects.
-                with urllib.request.urlopen(req, timeout=10) as response:
-                    if not (200 <= response.getcode() < 400): # 2xx is success, 3xx is redirect (also good)
-                        dead_links.append(url)
-            except Exception:
-                dead_links.append(url)
-            # Schedule a progress bar update on the main thread
-            self.after(0, self.download_test_progress.config, {'value': i + 1})
-
-        self.after(0, self._update_download_buttons_state, dead_links)
+        # Progress is coalesced by the event bus, so reporting every link is cheap
+        dead_links = check_links(self.CLIENT_DOWNLOADS.values(), timeout=10,
+                                 on_progress=lambda done, total: self.ui_events.progress("link_test", done, total))
+        self.ui_events.call(self._update_download_buttons_state, dead_links)
 
     def _update_download_buttons_state(self, dead_links):
         """Updates the state of download buttons based on the test results."""
@@ -596,10 +920,100 @@ class P2PHelperApp(tk.Tk):
         self.log_message(f"Link test complete. Found {len(dead_links)} unresponsive link(s).")
         self.test_downloads_button.config(state=tk.NORMAL, text="Test All Links")
         self.download_test_progress.pack_forget() # Hide the progress bar
+        self.progress_handlers.pop("link_test", None)
         messagebox.showinfo("Test Complete", f"Finished testing all download links.\n\nUnresponsive links have been greyed out.")
 
-    def log_message(self, message):
-        self.log_text.insert(tk.END, message + "\n")
+    def log_message(self, message, level=logging.INFO):
+        """Queues a line for the activity log. Safe to call from any thread; the UI picks it up on the next tick."""
+        self.log_sink.log(message, level)
+
+    def _pump_ui_events(self):
+        """Applies everything worker threads posted to the event bus since the last tick."""
+        # Re-arm first, so a modal popup shown below doesn't stall the pump.
+        self.after(self.UI_EVENT_INTERVAL_MS, self._pump_ui_events)
+        popups = []
+        for event in self.ui_events.drain():
+            # Applied strictly in posting order: a call can rely on the values and progress posted before it
+            if isinstance(event, ValueEvent):
+                try:
+                    event.target.set(event.value)
+                except tk.TclError:
+                    pass # The variable's widget is gone
+            elif isinstance(event, ProgressEvent):
+                handler = self.progress_handlers.get(event.task)
+                if handler:
+                    handler(event)
+            elif isinstance(event, CallEvent):
+                try:
+                    event.func(*event.args, **event.kwargs)
+                except Exception as e:
+                    self.log_message(f"Error in {getattr(event.func, '__name__', event.func)}: {e}", logging.ERROR)
+            else:
+                popups.append(event)
+        if popups:
+            self._pending_popups.extend(popups)
+            self._last_popup_at = time.monotonic()
+        if (self._pending_popups and not self._showing_popups
+                and (time.monotonic() - self._last_popup_at) * 1000 >= self.POPUP_SUMMARY_DELAY_MS):
+            self._show_pending_popups()
+
+    def _show_pending_popups(self):
+        """Shows the queued popups: a single one as it is, several as one summary box."""
+        popups, self._pending_popups = self._pending_popups, []
+        show = {"info": messagebox.showinfo, "warning": messagebox.showwarning, "error": messagebox.showerror}
+        self._showing_popups = True
+        try:
+            if len(popups) == 1:
+                popup = popups[0]
+                show.get(popup.kind, messagebox.showinfo)(popup.title, popup.message, parent=popup.parent or self)
+                return
+            kinds = {popup.kind for popup in popups}
+            kind = "error" if "error" in kinds else "warning" if "warning" in kinds else "info"
+            max_shown = 8
+            lines = [f"{popup.title}: {popup.message}" for popup in popups[:max_shown]]
+            if len(popups) > max_shown:
+                lines.append(f"...and {len(popups) - max_shown} more (see the log).")
+            show[kind](f"{len(popups)} Notifications", "\n\n".join(lines), parent=self)
+        finally:
+            self._showing_popups = False
+
+    def _drain_log(self):
+        """Moves queued log lines into the log widget in one insert, then re-arms itself."""
+        try:
+            records = self.log_sink.drain()
+            dropped = self.log_sink.take_dropped()
+            if dropped:
+                # Only shown in the widget; the log file has every line
+                records.insert(0, (time.time(), logging.WARNING, f"{dropped} log line(s) were logged faster than they could be shown and were skipped."))
+            if records:
+                self.log_records.extend(records)
+                self._append_log_records(records)
+        finally:
+            self.after(self.LOG_FLUSH_INTERVAL_MS, self._drain_log)
+
+    def _append_log_records(self, records):
+        min_level = LOG_LEVELS.get(self.log_level_var.get(), logging.INFO)
+        level_names = {level: name for name, level in LOG_LEVELS.items()}
+        chunks = []
+        for _, level, message in records:
+            if level >= min_level:
+                chunks.extend((message + "\n", level_names.get(level, "Info")))
+        if not chunks:
+            return
+        # Only follow the output if the user hasn't scrolled up to read something
+        at_bottom = self.log_text.yview()[1] >= 0.999
+        self.log_text.insert(tk.END, *chunks)
+        # Keep a bounded number of lines in the widget
+        excess = int(self.log_text.index("end-1c").split(".")[0]) - 1 - self.LOG_MAX_LINES
+        if excess > 0:
+            self.log_text.delete("1.0", f"{excess + 1}.0")
+        if at_bottom:
+            self.log_text.see(tk.END)
+
+    def _render_log_records(self):
+        """Refills the log widget from the kept records, e.g. after the severity filter changed."""
+        self.log_text.delete(1.0, tk.END)
+        self._append_log_records(list(self.log_records))
         self.log_text.see(tk.END)
 
     def show_log_context_menu(self, event):
@@ -635,52 +1049,53 @@ class P2PHelperApp(tk.Tk):
 
     def clear_log(self):
         """Clears all text from the log widget."""
+        self.log_records.clear()
         self.log_text.delete(1.0, tk.END)
 
     def _create_tooltips(self):
         """Create tooltips for widgets that might have truncated text."""
         # Tooltip for the program name in the details panel
         # General Tab
-        ToolTip(self.display_name_entry, lambda: self.display_name_var.get())
-        ToolTip(self.exe_path_entry, lambda: self.exe_path_var.get())
-        ToolTip(self.install_location_entry, lambda: self.install_location_var.get())
-        ToolTip(self.launch_button, lambda: "Launch the selected program")
-        ToolTip(self.open_config_button, lambda: "Open the installation folder for the selected program")
-        ToolTip(self.remove_program_button, lambda: "Remove the selected program from this list (does not uninstall)")
+        self.tooltips.add(self.display_name_entry, lambda: self.display_name_var.get())
+        self.tooltips.add(self.exe_path_entry, lambda: self.exe_path_var.get())
+        self.tooltips.add(self.install_location_entry, lambda: self.install_location_var.get())
+        self.tooltips.add(self.launch_button, lambda: "Launch the selected program")
+        self.tooltips.add(self.open_config_button, lambda: "Open the installation folder for the selected program")
+        self.tooltips.add(self.remove_program_button, lambda: "Remove the selected program from this list (does not uninstall)")
 
         # Program List Buttons
-        ToolTip(self.scan_button, lambda: "Scan the Windows Registry for installed P2P programs")
-        ToolTip(self.add_manual_button, lambda: "Add a program to the list manually")
-        ToolTip(self.edit_button, lambda: "Edit the details of the selected program")
-        ToolTip(self.save_button, lambda: "Save changes to the program details")
-        ToolTip(self.cancel_button, lambda: "Cancel editing and discard changes")
+        self.tooltips.add(self.scan_button, lambda: "Scan the Windows Registry for installed P2P programs")
+        self.tooltips.add(self.add_manual_button, lambda: "Add a program to the list manually")
+        self.tooltips.add(self.edit_button, lambda: "Edit the details of the selected program")
+        self.tooltips.add(self.save_button, lambda: "Save changes to the program details")
+        self.tooltips.add(self.cancel_button, lambda: "Cancel editing and discard changes")
 
         # Server List Tab
-        ToolTip(self.download_server_list_button, lambda: "Download server lists from all configured sources to their target paths")
-        ToolTip(self.add_target_button, lambda: "Add a new target file path for the selected source")
-        ToolTip(self.remove_target_button, lambda: "Remove the selected target file path")
-        ToolTip(self.add_multi_source_button, lambda: "Add a new server list source (URL or local file)")
-        ToolTip(self.remove_multi_source_button, lambda: "Remove the currently selected server list source")
-        ToolTip(self.add_custom_url_button, lambda: "Add a new custom server list URL to the dropdown for this network")
-        ToolTip(self.remove_custom_url_button, lambda: "Remove a custom server list URL from the dropdown")
-
-        # Kademlia (nodes.dat) section
-        ToolTip(self.nodes_list_url_combo, lambda: self.nodes_list_url_var.get())
-        ToolTip(self.nodes_list_target_entry, lambda: self.nodes_list_target_var.get())
-        ToolTip(self.test_nodes_url_button, lambda: "Test if the nodes.dat URL is reachable")
-        ToolTip(self.download_nodes_list_button, lambda: "Download the nodes.dat file to the target path")
-        ToolTip(self.browse_nodes_target_button, lambda: "Browse for the nodes.dat target file")
-
-        # WinMX Patch section
-        ToolTip(self.winmx_patch_url_entry, lambda: self.winmx_patch_url_var.get())
-        ToolTip(self.winmx_patch_target_entry, lambda: self.winmx_patch_target_var.get())
-        ToolTip(self.test_winmx_patch_url_button, lambda: "Test if the patch URL is reachable")
-        ToolTip(self.download_winmx_patch_button, lambda: "Download the patch file to the target path")
-        ToolTip(self.browse_winmx_patch_target_button, lambda: "Browse for the patch target file")
-
-        # Downloads Tab
-        ToolTip(self.test_downloads_button, lambda: "Check all download links and disable any that are unresponsive")
-
+        self.tooltips.add(self.download_server_list_button, lambda: "Download server lists from all configured sources to their target paths")
+        self.tooltips.add(self.add_target_button, lambda: "Add a new target file path for the selected source")
+        self.tooltips.add(self.remove_target_button, lambda: "Remove the selected target file path")
+        self.tooltips.add(self.add_multi_source_button, lambda: "Add a new server list source (URL or local file)")
+        self.tooltips.add(self.remove_multi_source_button, lambda: "Remove the currently selected server list source")
+        self.tooltips.add(self.add_custom_url_button, lambda: "Add a new custom server list URL to the dropdown for this network")
+        self.tooltips.add(self.remove_custom_url_button, lambda: "Remove a custom server list URL from the dropdown")
+        # The nodes.dat, WinMX patch and Downloads tab tooltips are created along with those widgets.
+
+
+    def _get_wine_prefixes(self):
+        """Returns the configured Wine prefixes plus any found in the default locations."""
+        prefixes = [WinePrefix(path) for path in self.wine_prefixes]
+        known = {p.path for p in prefixes}
+        prefixes.extend(p for p in default_wine_prefixes() if p.path not in known)
+        return [p for p in prefixes if p.is_valid()]
+
+    def _windows_env(self, program_info):
+        """
+        Returns the environment used to build default paths for a program.
+        Programs found in a Wine prefix get their Windows folders mapped into that prefix.
+        """
+        if program_info.get("WinePrefix"):
+            return WinePrefix(program_info["WinePrefix"]).environment()
+        return os.environ
 
     def _get_custom_lists_for_network(self, network):
         """Safely gets the custom server lists for a given network."""
@@ -689,35 +1104,95 @@ class P2PHelperApp(tk.Tk):
         return self.CUSTOM_SERVER_LISTS[network]
     def load_settings(self):
         """Loads program data from a JSON file."""
-        if os.path.exists(self.settings_file):
+        if self.settings_store.exists():
             try:
-                with open(self.settings_file, 'r') as f:
-                    self.settings = json.load(f)
-                    self.hidden_registry_keys = self.settings.get("hidden_registry_keys", [])
-                    self.CUSTOM_SERVER_LISTS = self.settings.get("custom_server_lists", {})
-                    self.installed_programs = self.settings.get("programs", [])
-                    self._update_program_list_ui()
-                    self.log_message("Loaded programs from settings file.")
+                self.settings, loaded_path = self.settings_store.load()
+                self.hidden_registry_keys = self.settings.get("hidden_registry_keys", [])
+                self.CUSTOM_SERVER_LISTS = self.settings.get("custom_server_lists", {})
+                self.wine_prefixes = self.settings.get("wine_prefixes", [])
+                self.installed_programs = self.settings.get("programs", [])
+                self.auto_refresh_var.set(self.settings.get("auto_refresh", True))
+                self._update_program_list_ui()
+                if loaded_path != self.settings_store.path:
+                    self.log_message(f"Settings file was missing or damaged. Restored settings from backup '{loaded_path}'.", logging.WARNING)
+                self.log_message("Loaded programs from settings file.")
             except json.JSONDecodeError as e:
-                self.log_message(f"Error decoding settings file (p2p_helper_settings.json): {e}")
+                self.log_message(f"Error decoding settings file (p2p_helper_settings.json): {e}", logging.ERROR)
             except Exception as e:
-                self.log_message(f"An unexpected error occurred while loading settings: {e}")
+                self.log_message(f"An unexpected error occurred while loading settings: {e}", logging.ERROR)
 
     def save_settings(self):
-        """Saves program data to a JSON file."""
+        """
+        Marks the settings as changed. Bursts of calls are coalesced into a single
+        snapshot, which is written to disk by the settings store's background thread.
+        """
+        if not self._settings_save_scheduled:
+            self._settings_save_scheduled = True
+            self.after(self.SETTINGS_SAVE_DELAY_MS, self.flush_settings)
+
+    def flush_settings(self):
+        """Snapshots the current settings and hands them to the background writer."""
+        self._settings_save_scheduled = False
         try:
-            # Save all current programs to the settings file.
             # Update the main settings dictionary before saving
             self.settings["programs"] = self.installed_programs
             self.settings["hidden_registry_keys"] = self.hidden_registry_keys
             self.settings["custom_server_lists"] = self.CUSTOM_SERVER_LISTS
-
-            with open(self.settings_file, 'w') as f:
-                json.dump(self.settings, f, indent=4)
-
-            self.log_message("Settings saved.")
+            self.settings["wine_prefixes"] = self.wine_prefixes
+            self.settings["auto_refresh"] = self.auto_refresh_var.get()
+            self.settings_store.save(self.settings)
         except Exception as e:
-            self.log_message(f"Error saving settings: {e}")
+            self.log_message(f"Error saving settings: {e}", logging.ERROR)
+
+    def _on_settings_saved(self, latency_ms):
+        """Called from the settings writer thread after a successful write."""
+        stats = self.settings_store.stats()
+        self.log_message(f"Settings saved ({latency_ms:.1f} ms, {stats['writes']} write(s) for {stats['save_requests']} save request(s)).", logging.DEBUG)
+
+    def _on_settings_save_error(self, error):
+        """Called from the settings writer thread when a write fails."""
+        self.log_message(f"Error saving settings: {error}", logging.ERROR)
+
+    def show_download_health(self):
+        """Summarizes stale, failing and slow download sources from the download journal."""
+        stale = self.download_journal.stale_targets(self.STALE_TARGET_DAYS, self._expected_download_targets())
+        failing = self.download_journal.failing()
+        slow = self.download_journal.slow(self.SLOW_FETCH_MS, top=5)
+
+        lines = [f"Targets not updated in {self.STALE_TARGET_DAYS} days: {len(stale)}"]
+        for url, target, last_ok in stale[:5]:
+            when = datetime.fromtimestamp(last_ok).strftime("%Y-%m-%d") if last_ok else "never"
+            lines.append(f"  {target} ({when})")
+        lines.append(f"\nSources whose last download failed: {len(failing)}")
+        for url, count, error in failing[:5]:
+            lines.append(f"  {url} ({count}x{': ' + error if error else ''})")
+        lines.append(f"\nSlow sources (over {self.SLOW_FETCH_MS / 1000:.0f} s on average): {len(slow)}")
+        for url, avg_ms in slow:
+            lines.append(f"  {url} ({avg_ms / 1000:.1f} s)")
+        messagebox.showinfo("Download Health", "\n".join(lines), parent=self)
+
+    def _expected_download_targets(self):
+        """
+        Returns {url: [target paths]} for every configured download across all programs,
+        with the URLs resolved the way downloads record them in the journal.
+        """
+        expected = {}
+        for program in self.installed_programs:
+            for item in self._plan_program_downloads(program):
+                expected.setdefault(item.url, []).extend(t for t in item.targets if t != REGISTRY_TARGET)
+        return expected
+
+    def shutdown_settings(self):
+        """Writes any pending settings and waits for the background writer. Used on exit."""
+        if self._settings_save_scheduled:
+            self.flush_settings()
+        # The window is gone by now, so there is nowhere left to log the result.
+        self.settings_store.on_saved = self.settings_store.on_error = None
+        self.settings_store.close()
+        try:
+            self.download_journal.save_index()
+        except OSError:
+            pass
 
     def scan_for_programs(self):
         self.log_message("Scanning for installed P2P programs...")
@@ -727,106 +1202,88 @@ class P2PHelperApp(tk.Tk):
 
         threading.Thread(target=self._scan_registry_for_programs, daemon=True).start()
 
+    @profiled("program_scan")
     def _scan_registry_for_programs(self):
-        uninstall_keys = [
-            winreg.HKEY_LOCAL_MACHINE,
-            winreg.HKEY_CURRENT_USER
-        ]
-        subkeys = [
-            r"Software\Microsoft\Windows\CurrentVersion\Uninstall",
-            r"Software\Wow6432Node\Microsoft\Windows\CurrentVersion\Uninstall" # For 32-bit apps on 64-bit Windows
-        ]
+        started = time.perf_counter()
+        # Collect (registry_key, values, wine_prefix) from the native registry and every Wine prefix.
+        entries = [(name, values, None) for name, values in read_windows_uninstall_entries(
+            on_error=lambda e: self.log_message(f"Error accessing registry: {e}", logging.ERROR))]
+
+        prefixes = self._get_wine_prefixes()
+        if prefixes:
+            self.log_message(f"Scanning {len(prefixes)} Wine prefix(es)...")
+            for prefix, prefix_entries in scan_wine_prefixes(
+                    prefixes, on_error=lambda prefix, e: self.log_message(f"Error reading Wine prefix '{prefix.path}': {e}", logging.ERROR)):
+                for name, values in prefix_entries:
+                    entries.append((name, values, prefix))
 
         programs_found = []
 
-        for hkey in uninstall_keys:
-            for subkey_path in subkeys:
-                try:
-                    key = winreg.OpenKey(hkey, subkey_path, 0, winreg.KEY_READ)
-                    i = 0
-                    while True:
-                        try:
-                            name = winreg.EnumKey(key, i)
-
-                            # Skip this program if it's in the hidden list
-                            if name in self.hidden_registry_keys:
-                                i += 1
-                                continue
-                            subkey = winreg.OpenKey(key, name)
-                            display_name = None
-                            install_location = None
-                            executable_path = None # Initialize here
-                            
-                            # Try to get DisplayName, InstallLocation, and DisplayIcon
-                            try:
-                                display_name = winreg.QueryValueEx(subkey, "DisplayName")[0]
-                            except FileNotFoundError:
-                                pass
-
-                            # Exclude specific programs that don't need this tool
-                            if display_name and "gtk-gnutella" in display_name.lower():
-                                i += 1
-                                continue
-                            try:
-                                install_location = winreg.QueryValueEx(subkey, "InstallLocation")[0]
-                            except FileNotFoundError:
-                                pass
-                            try:
-                                # DisplayIcon often contains the full path to the executable.
-                                # It might have a comma and a number for the icon index, so we strip that.
-                                display_icon_path = winreg.QueryValueEx(subkey, "DisplayIcon")[0]
-                                parsed_path = display_icon_path.split(',')[0].strip('"')
-                                if os.path.exists(parsed_path) and parsed_path.lower().endswith(('.exe', '.jar')):
-                                    executable_path = parsed_path # This is our best guess for the executable
-                                    # If InstallLocation is missing, derive it from the executable path
-                                    if not install_location:
-                                        install_location = os.path.dirname(executable_path)
-                            except FileNotFoundError:
-                                pass
-
-                            network_type, matched_keyword = None, None
-                            if display_name:
-                                for network, keywords in self.P2P_NETWORKS.items():
-                                    for keyword in keywords:
-                                        if keyword in display_name.lower():
-                                            network_type = network
-                                            matched_keyword = keyword
-                                            break
-                                    if network_type:
-                                        network_type = network
-                                        break
-                            
-                            if network_type:
-                                    program_info = {
-                                        "DisplayName": display_name,
-                                        "InstallLocation": install_location,
-                                        "ExecutablePath": executable_path,
-                                        "ServerListURL": "", # Placeholder for user input
-                                        "ServerListTargetPaths": {}, # Placeholder for user input
-                                        "Source": "Registry",
-                                        "Network": network_type,
-                                        "NodesListURL": "",
-                                        "RegistryKey": name, # Store the unique registry key name
-                                        "NodesLastUpdated": "N/A",
-                                        "MatchedKeyword": matched_keyword,
-                                        "NodesListTargetPath": "",
-                                    }
-                                    self._prefill_opennap_info(program_info)
-                                    self._prefill_gnutella_info(program_info)
-                                    self._prefill_edonkey_info(program_info)
-                                    self._prefill_gnucdna_info(program_info, client_type=matched_keyword)
-                                    self._prefill_winmx_info(program_info)
-                                    programs_found.append(program_info)
-
-                            winreg.CloseKey(subkey)
-                            i += 1
-                        except OSError:
+        for name, values, prefix in entries:
+            # Wine entries are keyed by prefix as well, so the same client can live in several prefixes.
+            registry_key = f"wine:{prefix.path}:{name}" if prefix else name
+
+            # Skip this program if it's in the hidden list
+            if registry_key in self.hidden_registry_keys:
+                continue
+
+            display_name = values.get("DisplayName")
+            install_location = values.get("InstallLocation")
+            executable_path = None
+
+            # Exclude specific programs that don't need this tool
+            if display_name and "gtk-gnutella" in display_name.lower():
+                continue
+            if prefix and install_location:
+                install_location = prefix.map_path(install_location)
+
+            display_icon_path = values.get("DisplayIcon")
+            if display_icon_path:
+                # DisplayIcon often contains the full path to the executable.
+                # It might have a comma and a number for the icon index, so we strip that.
+                parsed_path = display_icon_path.split(',')[0].strip('"')
+                if prefix:
+                    parsed_path = prefix.map_path(parsed_path)
+                if os.path.exists(parsed_path) and parsed_path.lower().endswith(('.exe', '.jar')):
+                    executable_path = parsed_path # This is our best guess for the executable
+                    # If InstallLocation is missing, derive it from the executable path
+                    if not install_location:
+                        install_location = os.path.dirname(executable_path)
+
+            network_type, matched_keyword = None, None
+            if display_name:
+                for network, keywords in self.P2P_NETWORKS.items():
+                    for keyword in keywords:
+                        if keyword in display_name.lower():
+                            network_type = network
+                            matched_keyword = keyword
                             break
-                    winreg.CloseKey(key)
-                except FileNotFoundError:
-                    pass
-                except Exception as e:
-                    self.after(0, self.log_message, f"Error accessing registry: {e}")
+                    if network_type:
+                        break
+
+            if network_type:
+                program_info = {
+                    "DisplayName": display_name,
+                    "InstallLocation": install_location,
+                    "ExecutablePath": executable_path,
+                    "ServerListURL": "", # Placeholder for user input
+                    "ServerListTargetPaths": {}, # Placeholder for user input
+                    "Source": "Registry",
+                    "Network": network_type,
+                    "NodesListURL": "",
+                    "RegistryKey": registry_key, # Store the unique registry key name
+                    "NodesLastUpdated": "N/A",
+                    "MatchedKeyword": matched_keyword,
+                    "NodesListTargetPath": "",
+                }
+                if prefix:
+                    program_info["WinePrefix"] = prefix.path
+                self._prefill_opennap_info(program_info)
+                self._prefill_gnutella_info(program_info)
+                self._prefill_edonkey_info(program_info)
+                self._prefill_gnucdna_info(program_info, client_type=matched_keyword)
+                self._prefill_winmx_info(program_info)
+                programs_found.append(program_info)
 
         # Get a set of registry keys for programs that have been manually edited.
         # This prevents re-adding a program that the user has customized.
@@ -840,209 +1297,326 @@ class P2PHelperApp(tk.Tk):
                 final_programs.append(p)
 
         self.installed_programs = sorted(final_programs, key=lambda x: x["DisplayName"].lower())
-        self.after(0, self._update_program_list_ui)
-        self.after(0, self.log_message, f"Scan complete. Found {len(programs_found)} new programs.")
+        metrics.observe("scan_duration_seconds", time.perf_counter() - started)
+        self.ui_events.call(self._update_program_list_ui)
+        self.log_message(f"Scan complete. Found {len(programs_found)} new programs.")
         # After a scan, check again for the BearShare Test warning in case it was just found.
-        self.after(0, self.show_bearshare_test_warning)
-        self.after(0, self.save_settings) # Save the updated list
+        self.ui_events.call(self.show_bearshare_test_warning)
+        self.ui_events.call(self.save_settings) # Save the updated list
 
-    def _load_icon(self, icon_path, size=(16, 16)):
-        """Loads an icon from a path, resizes it, and caches it."""
-        cache_key = os.path.basename(icon_path)
-        if not PIL_AVAILABLE or not cache_key:
+    def _load_icon(self, icon_path):
+        """
+        Returns the cached 16x16 PhotoImage for an icon. Before the icon atlas is ready
+        this is a blank placeholder, which _on_icon_atlas_ready() paints in place.
+        """
+        if not self.icons_available or not icon_path:
+            return None
+        # Resolve through the asset index; unknown icons are rejected without touching the disk.
+        cache_key = self.assets.resolve(icon_path)
+        if not cache_key:
             return None
         if cache_key in self.icon_cache:
             return self.icon_cache[cache_key]
-        
-        resolved_path = os.path.join(self.script_dir, cache_key)
-        try: # Check for existence before trying to open
-            img = Image.open(resolved_path)
-            img = img.resize(size, Image.Resampling.LANCZOS)
-            photo_img = ImageTk.PhotoImage(img)
-            self.icon_cache[cache_key] = photo_img # Cache it
-            return photo_img
-        except (FileNotFoundError, Exception) as e:
-            # Don't log file not found, as we try multiple paths.
-            if not isinstance(e, FileNotFoundError):
-                self.log_message(f"Warning: Could not load icon '{resolved_path}': {e}")
-            return None
+        if self.icon_atlas_ready and cache_key not in self.icon_atlas.cells:
+            return None # The file couldn't be decoded
+
+        size = self.icon_atlas.size
+        photo_img = tk.PhotoImage(width=size, height=size)
+        self.icon_cache[cache_key] = photo_img # Cache it
+        if self.icon_atlas_ready:
+            self._paint_icon(photo_img, [cache_key])
+        return photo_img
+
+    def _paint_icon(self, photo_img, names):
+        """Copies the atlas cells of `names` side by side into `photo_img`."""
+        size = self.icon_atlas.size
+        for index, name in enumerate(names):
+            cell = self.icon_atlas.cells.get(name)
+            if cell:
+                x, y = cell
+                photo_img.tk.call(photo_img, "copy", self._icon_atlas_image, "-from", x, y, x + size, y + size, "-to", index * size, 0)
+
+    def _on_icon_atlas_ready(self, available):
+        """Called on the UI thread once the icon atlas is on disk; paints every placeholder handed out so far."""
+        for name, error in self.icon_atlas.errors.items():
+            self.log_message(f"Could not load icon '{name}': {error}", logging.WARNING)
+        if not available:
+            self.log_message("Program icons are not available (the 'Pillow' library is needed to prepare them).", logging.DEBUG)
+            return
+        try:
+            self._icon_atlas_image = tk.PhotoImage(file=self.icon_atlas.image_path)
+        except tk.TclError as e:
+            self.log_message(f"Could not load the icon atlas '{self.icon_atlas.image_path}': {e}", logging.WARNING)
+            return
+        self.icon_atlas_ready = True
+        for cache_key, photo_img in self.icon_cache.items():
+            self._paint_icon(photo_img, self._composite_icons.get(cache_key, [cache_key]))
+        if self.icon_atlas.rebuilt:
+            self.log_message(f"Rebuilt icon atlas with {len(self.icon_atlas.cells)} icon(s).", logging.DEBUG)
+
+    # Icons for network tabs and the treeview fallback. Two icons are combined into one tab image.
+    NETWORK_ICON_MAP = {
+        "eDonkey/Kadmille": ["eDonkey.ico", "eDonkeyKadmille.ico"],
+        "Gnutella": ["gnutella.ico"],
+        "GnuCDNA/Gnutella2": ["gnucleus.ico", "gnutella2.ico"], # Will be combined if both exist
+        "OpenNapster": ["opennapster.ico", "opennap.ico"],
+        "WinMX": ["WinMX.ico"],
+    }
+    # For clients whose display name doesn't match their icon file name.
+    CLIENT_ICON_MAP = {
+        "eDonkey 2000": "eDonkey.ico",
+        "Lphant": "lphant.ico",
+        "LemonWire": "lemonwire.ico",
+        "TurboWire": "turbowire.ico"
+    }
+    TREE_NAME_MAX_LEN = 50 # Longer display names are truncated in the treeview
 
+    def _program_row_key(self, program):
+        """Returns the key identifying a program's row across refreshes (and rescans)."""
+        return program.get("RegistryKey") or program_key(program)
+
+    def _program_row_tooltip(self, network, item_id):
+        """Returns the full name of a program row whose name is truncated, else None."""
+        row = self.tree_rows.get(network, {}).get(item_id)
+        if row and row[0] != row[2]:
+            return row[2]
+        return None
+
+    @profiled("program_list")
     def _update_program_list_ui(self):
-        # Clear old data
-        self.tree_item_to_program.clear()
-        for tab in self.program_notebook.tabs():
-            self.program_notebook.forget(tab)
-        self.network_tabs.clear()
-        
-        # Group programs by network
+        """
+        Brings the network tabs and treeviews in line with self.installed_programs.
+        Only the differences are applied: rows are inserted, updated, moved or deleted
+        in the existing trees, and a tab is only created or removed when its network
+        appears or disappears, so selection and scroll positions survive a refresh.
+        """
+        # Group programs by network, in display order
         programs_by_network = {}
         for program in self.installed_programs:
             network = program.get("Network", "Unknown")
-            if network not in programs_by_network:
-                programs_by_network[network] = []
-            programs_by_network[network].append(program)
+            programs_by_network.setdefault(network, []).append(program)
 
             # Handle programs that should appear in multiple network tabs
             for also_in_network in program.get("AlsoInNetworks", []):
-                if also_in_network not in programs_by_network:
-                    programs_by_network[also_in_network] = []
-                programs_by_network[also_in_network].append(program)
-
-        # Define the network icon map for both tabs and treeview fallbacks
-        network_icon_map = {
-            "eDonkey/Kadmille": ["eDonkey.ico", "eDonkeyKadmille.ico"],
-            "Gnutella": ["gnutella.ico"],
-            "GnuCDNA/Gnutella2": ["gnucleus.ico", "gnutella2.ico"], # Will be combined if both exist
-            "OpenNapster": ["opennapster.ico", "opennap.ico"],
-            "WinMX": ["WinMX.ico"],
-        } 
-
-        # This map was missing, causing a NameError. It's for clients whose
-        # display name doesn't match their icon file name.
-        icon_map = {
-            "eDonkey 2000": "eDonkey.ico",
-            "Lphant": "lphant.ico",
-            "LemonWire": "lemonwire.ico",
-            "TurboWire": "turbowire.ico"
-        }
-        # Create a tab for each network
-        for network in sorted(programs_by_network.keys()):
-            # Create tab frame
-            tab_frame = ttk.Frame(self.program_notebook, padding=5)
-            tab_frame.grid_columnconfigure(0, weight=1)
-            tab_frame.grid_rowconfigure(0, weight=1) # This was missing
-
-            # --- Find and apply icon(s) for the tab label ---
-            tab_icon = None
-            possible_icons = network_icon_map.get(network, [])
-            found_icons = [os.path.join(self.script_dir, f) for f in possible_icons if os.path.exists(os.path.join(self.script_dir, f))]
-
-            if len(found_icons) > 1 and PIL_AVAILABLE: # Logic for combining multiple icons
-                # If multiple icons are found (e.g., for GnuCDNA/Gnutella2), create a composite image.
-                try:
-                    # Use a unique cache key for the combined image
-                    cache_key = "+".join(found_icons)
-                    if cache_key in self.icon_cache:
-                        tab_icon = self.icon_cache[cache_key]
-                    else:
-                        images = [Image.open(f).resize((16, 16), Image.Resampling.LANCZOS) for f in found_icons] # f is already a full path
-                        total_width = sum(img.width for img in images)
-                        max_height = max(img.height for img in images)
-                        
-                        composite_img = Image.new('RGBA', (total_width, max_height))
-                        x_offset = 0
-                        for img in images:
-                            composite_img.paste(img, (x_offset, 0), img if img.mode == 'RGBA' else None)
-                            x_offset += img.width
-                        
-                        tab_icon = ImageTk.PhotoImage(composite_img)
-                        self.icon_cache[cache_key] = tab_icon # Cache the new composite icon
-                except Exception as e:
-                    self.log_message(f"Warning: Could not create composite icon for tab '{network}': {e}")
-                    # Fallback to the first available icon
-                    if found_icons:
-                        tab_icon = self._load_icon(os.path.basename(found_icons[0]))
-            elif len(found_icons) == 1: # Logic for a single icon
-                # If only one icon is found, load it normally.
-                tab_icon = self._load_icon(os.path.basename(found_icons[0]))
-
-            if tab_icon:
-                self.program_notebook.add(tab_frame, text=network, image=tab_icon, compound=tk.LEFT)
-            else:
-                self.program_notebook.add(tab_frame, text=network)
-
-            self.network_tabs[network] = tab_frame
-
-            # Create Treeview for the tab
-            tree = ttk.Treeview(tab_frame, selectmode="browse", show="tree", columns=())
-            tree.grid(row=0, column=0, sticky="nsew")
-            tree.bind("<<TreeviewSelect>>", self.on_program_selection)
-
-            # Add scrollbar to the treeview
-            # Add a tooltip handler for the treeview
-            scrollbar = ttk.Scrollbar(tab_frame, orient="vertical", command=tree.yview)
-            scrollbar.grid(row=0, column=1, sticky="ns")
-            tree.configure(yscrollcommand=scrollbar.set)
-
-            # Populate the treeview
+                programs_by_network.setdefault(also_in_network, []).append(program)
+
+        # Drop the tabs of networks that no longer have any programs
+        for network in [n for n in self.network_tabs if n not in programs_by_network]:
+            tree = self.network_trees.pop(network)
+            for item_id in self.tree_rows.pop(network):
+                self.tree_item_to_program.pop((tree, item_id), None)
+            tab_frame = self.network_tabs.pop(network)
+            self.program_notebook.forget(tab_frame)
+            tab_frame.destroy()
+
+        programs_by_key = {}
+        for tab_index, network in enumerate(sorted(programs_by_network.keys())):
+            if network not in self.network_tabs:
+                self._create_network_tab(network, tab_index)
+            tree = self.network_trees[network]
+            rows = self.tree_rows[network] # item_id -> row values currently shown
+
+            # Work out the wanted rows. Item ids are the program keys, so they stay stable.
+            wanted = {}
+            order = []
             for program in sorted(programs_by_network[network], key=lambda p: p["DisplayName"]):
-                icon = None
+                item_id = self._program_row_key(program)
+                if item_id in wanted: # Two programs with the same registry key
+                    item_id = program_key(program)
+                icon = self._program_icon(program)
                 display_name = program["DisplayName"]
-                
-                # --- Icon Loading Logic ---
-                # 1. Check for an explicit IconPath in the program data (highest priority).
-                explicit_icon_filename = program.get("IconPath")
-                if explicit_icon_filename:
-                    icon = self._load_icon(explicit_icon_filename)
-
-                # 1b. Check the download icon map as a fallback
-                if not icon:
-                    icon_filename = icon_map.get(display_name)
-                    if icon_filename:
-                        icon = self._load_icon(icon_filename)
-                
-                # 2. If no icon, check for a local icon file based on the program's exact DisplayName.
-                #    e.g., "eMule v0.50a" -> "eMule v0.50a.ico"
-                if not icon and display_name:
-                    local_icon_filename = f"{display_name}.ico"
-                    icon = self._load_icon(local_icon_filename)
-
-                # 3. If still no icon, check for a local icon file based on the program's matched keyword.
-                #    e.g., MatchedKeyword "emule" -> "emule.ico"
-                if not icon:
-                    keyword = program.get("MatchedKeyword")
-                    if keyword:
-                        icon = self._load_icon(f"{keyword}.ico")
-                        if not icon:
-                            # Also check for the capitalized version as a fallback
-                            icon = self._load_icon(f"{keyword.capitalize()}.ico")
-
-                # 4. As a final fallback, check for an icon matching the network name.
-                #    e.g., "eDonkey/Kadmille" -> "eDonkeyKadmille.ico"
-                if not icon:
-                    network = program.get("Network")
-                    if network:
-                        possible_icons = network_icon_map.get(network, [])
-                        for icon_filename in possible_icons:
-                            icon = self._load_icon(icon_filename)
-                            if icon:
-                                break # Stop after finding the first valid icon
-
-                # Truncate the display name for the treeview to prevent layout issues
-                max_len = 50
+                max_len = self.TREE_NAME_MAX_LEN
                 truncated_name = (display_name[:max_len] + '...') if len(display_name) > max_len else display_name
-
-                # Only add the image argument if the icon was successfully loaded.
-                # Passing image=None causes a TclError.
-                if icon:
-                    item_id = tree.insert("", "end", text=truncated_name, image=icon, values=(display_name,))
-                else:
-                    item_id = tree.insert("", "end", text=truncated_name, values=(display_name,))
+                wanted[item_id] = (truncated_name, icon or "", display_name)
+                order.append(item_id)
                 self.tree_item_to_program[(tree, item_id)] = program
+                programs_by_key[item_id] = program
 
-            # --- Treeview Tooltip Logic ---
-            tree_tooltip = None
-            def on_tree_motion(event):
-                nonlocal tree_tooltip
-                item_id = tree.identify_row(event.y)
-                if item_id:
-                    full_text = tree.item(item_id, "values")[0]
-                    # Only show tooltip if the text is actually truncated
-                    if len(full_text) > max_len:
-                        if not tree_tooltip:
-                            tree_tooltip = ToolTip(tree, lambda: full_text)
-                        tree_tooltip.text_func = lambda: full_text
-                        tree_tooltip.schedule()
+            for item_id in [i for i in rows if i not in wanted]:
+                tree.delete(item_id)
+                del rows[item_id]
+                del self.tree_item_to_program[(tree, item_id)]
+
+            for index, item_id in enumerate(order):
+                text, icon, display_name = row = wanted[item_id]
+                if item_id not in rows:
+                    # Passing image=None causes a TclError, so only pass it when there is an icon.
+                    if icon:
+                        tree.insert("", index, iid=item_id, text=text, image=icon, values=(display_name,))
                     else:
-                        if tree_tooltip:
-                            tree_tooltip.hidetip()
-                elif tree_tooltip:
-                    tree_tooltip.hidetip()
-            tree.bind('<Motion>', on_tree_motion)
-
-        self.clear_details_panel()
+                        tree.insert("", index, iid=item_id, text=text, values=(display_name,))
+                elif rows[item_id] != row:
+                    tree.item(item_id, text=text, image=icon, values=(display_name,))
+                rows[item_id] = row
+
+            # Renames can change the sort order of rows that were already there
+            children = tree.get_children()
+            if list(children) != order:
+                for index, item_id in enumerate(order):
+                    if children[index] != item_id:
+                        tree.move(item_id, "", index)
+                        children = tree.get_children()
+
+        self.search_index.update(programs_by_key)
+        if self.search_var.get().strip():
+            self._update_search_results()
+
+        # Keep the selection if the program is still listed (possibly as a fresh dict after a rescan)
+        if self.selected_program is not None:
+            current = programs_by_key.get(self._program_row_key(self.selected_program))
+            if current is None:
+                self.selected_program = None
+                self.clear_details_panel()
+            elif current is not self.selected_program:
+                self.selected_program = current
+                self.display_details_panel(current)
+        else:
+            self.clear_details_panel()
         self.update_action_button_states()
 
+    def _create_network_tab(self, network, index):
+        """Creates the tab and treeview for a network at position `index` of the program notebook."""
+        tab_frame = ttk.Frame(self.program_notebook, padding=5)
+        tab_frame.grid_columnconfigure(0, weight=1)
+        tab_frame.grid_rowconfigure(0, weight=1)
+
+        position = index if index < len(self.program_notebook.tabs()) else "end"
+        tab_icon = self._network_tab_icon(network)
+        if tab_icon:
+            self.program_notebook.insert(position, tab_frame, text=network, image=tab_icon, compound=tk.LEFT)
+        else:
+            self.program_notebook.insert(position, tab_frame, text=network)
+
+        # Create Treeview for the tab
+        tree = ttk.Treeview(tab_frame, selectmode="browse", show="tree", columns=())
+        tree.grid(row=0, column=0, sticky="nsew")
+        tree.bind("<<TreeviewSelect>>", self.on_program_selection)
+
+        # Add scrollbar to the treeview
+        scrollbar = ttk.Scrollbar(tab_frame, orient="vertical", command=tree.yview)
+        scrollbar.grid(row=0, column=1, sticky="ns")
+        tree.configure(yscrollcommand=scrollbar.set)
+
+        # Only truncated names get a tooltip; the truncation is worked out once per row in _update_program_list_ui
+        self.tooltips.add_tree(tree, lambda item_id: self._program_row_tooltip(network, item_id))
+
+        self.network_tabs[network] = tab_frame
+        self.network_trees[network] = tree
+        self.tree_rows[network] = {}
+        return tree
+
+    def _network_tab_icon(self, network):
+        """Returns the tab image for a network, combining two icons side by side where the map lists two."""
+        possible_icons = self.NETWORK_ICON_MAP.get(network, [])
+        found_icons = []
+        for icon_name in possible_icons:
+            resolved = self.assets.resolve(icon_name)
+            if resolved and resolved not in found_icons:
+                found_icons.append(resolved)
+
+        if len(found_icons) == 1: # Logic for a single icon
+            return self._load_icon(found_icons[0])
+        if not found_icons or not self.icons_available:
+            return None
+
+        # If multiple icons are found (e.g., for GnuCDNA/Gnutella2), draw them side by side
+        # into one image, straight from the atlas cells.
+        cache_key = "+".join(found_icons)
+        if cache_key not in self.icon_cache:
+            size = self.icon_atlas.size
+            tab_icon = tk.PhotoImage(width=size * len(found_icons), height=size)
+            self.icon_cache[cache_key] = tab_icon # Cache the new composite icon
+            self._composite_icons[cache_key] = found_icons
+            if self.icon_atlas_ready:
+                self._paint_icon(tab_icon, found_icons)
+        return self.icon_cache[cache_key]
+
+    def _program_icon(self, program):
+        """Returns the treeview icon for a program, or None."""
+        icon = None
+        display_name = program["DisplayName"]
+
+        # 1. Check for an explicit IconPath in the program data (highest priority).
+        explicit_icon_filename = program.get("IconPath")
+        if explicit_icon_filename:
+            icon = self._load_icon(explicit_icon_filename)
+
+        # 1b. Check the download icon map as a fallback
+        if not icon:
+            icon_filename = self.CLIENT_ICON_MAP.get(display_name)
+            if icon_filename:
+                icon = self._load_icon(icon_filename)
+
+        # 2. If no icon, check for a local icon file based on the program's exact DisplayName.
+        #    e.g., "eMule v0.50a" -> "eMule v0.50a.ico"
+        if not icon and display_name:
+            icon = self._load_icon(f"{display_name}.ico")
+
+        # 3. If still no icon, check for a local icon file based on the program's matched keyword.
+        #    e.g., MatchedKeyword "emule" -> "emule.ico" (the asset index ignores case)
+        if not icon:
+            keyword = program.get("MatchedKeyword")
+            if keyword:
+                icon = self._load_icon(f"{keyword}.ico")
+
+        # 4. As a final fallback, check for an icon matching the network name.
+        #    e.g., "eDonkey/Kadmille" -> "eDonkeyKadmille.ico"
+        if not icon:
+            network = program.get("Network")
+            if network:
+                icon = self._load_icon(self.assets.resolve(*self.NETWORK_ICON_MAP.get(network, [])))
+        return icon
+
+    SEARCH_MAX_RESULTS = 50
+
+    def _update_search_results(self):
+        """Lists the programs matching the search box; hides the list when the box is empty."""
+        query = self.search_var.get()
+        listbox = self.search_results_list
+        if not query.strip():
+            self.search_result_keys = []
+            listbox.delete(0, tk.END)
+            listbox.grid_remove()
+            return
+        keys = self.search_index.search(query, limit=self.SEARCH_MAX_RESULTS)
+        if keys == self.search_result_keys and listbox.winfo_ismapped():
+            return
+        self.search_result_keys = keys
+        listbox.delete(0, tk.END)
+        if keys:
+            programs = self.search_index.programs
+            listbox.insert(tk.END, *(f"{programs[k]['DisplayName']}  [{programs[k].get('Network', 'Unknown')}]" for k in keys))
+        else:
+            listbox.insert(tk.END, "No matching programs")
+        listbox.grid()
+
+    def _focus_search_results(self, event=None):
+        if self.search_result_keys:
+            self.search_results_list.focus_set()
+            self.search_results_list.selection_clear(0, tk.END)
+            self.search_results_list.selection_set(0)
+            self.search_results_list.activate(0)
+
+    def _open_search_result(self, index=None):
+        """Switches to the tab of a search result and selects its row."""
+        if index is None:
+            selection = self.search_results_list.curselection()
+            index = selection[0] if selection else 0
+        if index >= len(self.search_result_keys):
+            return
+        key = self.search_result_keys[index]
+        program = self.search_index.programs[key]
+        # Prefer the program's own network tab; it may also be listed under others
+        networks = [program.get("Network", "Unknown"), *self.tree_rows]
+        for network in networks:
+            if key in self.tree_rows.get(network, {}):
+                tree = self.network_trees[network]
+                self.program_notebook.select(self.network_tabs[network])
+                tree.selection_set(key) # Fires <<TreeviewSelect>>, which shows the details
+                tree.focus(key)
+                tree.see(key)
+                return
+
     def on_program_selection(self, event):
         tree = event.widget
         selected_item = tree.selection()
@@ -1083,15 +1657,15 @@ class P2PHelperApp(tk.Tk):
         has_nodes_config = bool(program_info.get("NodesListTargetPath"))
         if has_nodes_config:
             # Show Kademlia frame only for eMule
-            self.nodes_frame.grid(row=2, column=0, sticky='ew', pady=(10, 0), padx=2)
-        else:
+            self._ensure_nodes_frame().grid(row=2, column=0, sticky='ew', pady=(10, 0), padx=2)
+        elif self.nodes_frame is not None:
             self.nodes_frame.grid_remove()
 
         # Show/Hide the WinMX Patch frame
         is_winmx = "winmx" in program_info.get("DisplayName", "").lower()
         if is_winmx:
-            self.winmx_patch_frame.grid(row=3, column=0, sticky='ew', pady=(10, 0), padx=2)
-        else:
+            self._ensure_winmx_patch_frame().grid(row=3, column=0, sticky='ew', pady=(10, 0), padx=2)
+        elif self.winmx_patch_frame is not None:
             self.winmx_patch_frame.grid_remove()
 
         # Always show the standard editor UI
@@ -1129,7 +1703,7 @@ class P2PHelperApp(tk.Tk):
             url_combo.grid(row=0, column=1, sticky='ew', padx=5)
 
             # Add tooltip for the URL field
-            ToolTip(url_combo, lambda v=url_var: v.get())
+            self.tooltips.add(url_combo, lambda v=url_var: v.get())
 
             test_button = ttk.Button(tab, text="Test", command=lambda u=url_var: self.test_url(u))
             test_button.grid(row=0, column=2, sticky='e')
@@ -1170,19 +1744,7 @@ class P2PHelperApp(tk.Tk):
             target_tree.heading("#0", text="Path", anchor="w")
 
             # Add tooltip for the target treeview
-            tree_tooltip = None
-            def on_target_tree_motion(event):
-                nonlocal tree_tooltip
-                item_id = target_tree.identify_row(event.y)
-                if item_id:
-                    full_text = target_tree.item(item_id, "text")
-                    if not tree_tooltip:
-                        tree_tooltip = ToolTip(target_tree, lambda: full_text)
-                    tree_tooltip.text_func = lambda: full_text
-                    tree_tooltip.schedule()
-                elif tree_tooltip:
-                    tree_tooltip.hidetip()
-            target_tree.bind('<Motion>', on_target_tree_motion)
+            self.tooltips.add_tree(target_tree, lambda item_id, tree=target_tree: tree.item(item_id, "text"))
             target_tree.bind("<Double-1>", self.on_target_tree_double_click)
 
             for path in paths:
@@ -1254,24 +1816,26 @@ class P2PHelperApp(tk.Tk):
             # The combobox should be 'readonly' when not editing, and 'normal' when editing.
             nodes_combo_state = tk.NORMAL if self.is_editing else "readonly"
 
-        self.nodes_list_url_entry.grid_remove()
-        self.nodes_list_url_combo.grid()
+        if self.nodes_frame is not None: # Not built until a program with a nodes.dat target is shown
+            self.nodes_list_url_entry.grid_remove()
+            self.nodes_list_url_combo.grid()
 
-        self.nodes_list_url_combo['values'] = list(self.EMULE_NODES_LISTS.keys()) + ["(Custom)"]
-        self.nodes_list_url_combo.config(state=nodes_state)
+            self.nodes_list_url_combo['values'] = list(self.EMULE_NODES_LISTS.keys()) + ["(Custom)"]
+            self.nodes_list_url_combo.config(state=nodes_state)
 
-        self.nodes_list_target_entry.config(state=nodes_state)
-        self.browse_nodes_target_button.config(state=state)
-        self.test_nodes_url_button.config(state=tk.NORMAL if self.nodes_list_url_var.get() else tk.DISABLED)
+            self.nodes_list_target_entry.config(state=nodes_state)
+            self.browse_nodes_target_button.config(state=state)
+            self.test_nodes_url_button.config(state=tk.NORMAL if self.nodes_list_url_var.get() else tk.DISABLED)
 
         # Handle WinMX Patch fields
         winmx_state = tk.DISABLED
         if is_winmx:
             winmx_state = tk.NORMAL if self.is_editing else tk.DISABLED
-        self.winmx_patch_url_entry.config(state=winmx_state)
-        self.winmx_patch_target_entry.config(state=winmx_state)
-        self.test_winmx_patch_url_button.config(state=tk.NORMAL if self.winmx_patch_url_var.get() and winmx_state != tk.DISABLED else tk.DISABLED)
-        self.browse_winmx_patch_target_button.config(state=winmx_state)
+        if self.winmx_patch_frame is not None:
+            self.winmx_patch_url_entry.config(state=winmx_state)
+            self.winmx_patch_target_entry.config(state=winmx_state)
+            self.test_winmx_patch_url_button.config(state=tk.NORMAL if self.winmx_patch_url_var.get() and winmx_state != tk.DISABLED else tk.DISABLED)
+            self.browse_winmx_patch_target_button.config(state=winmx_state)
 
         # Also disable the download button if the fields are disabled
         self.on_nodes_list_url_change()
@@ -1284,8 +1848,10 @@ class P2PHelperApp(tk.Tk):
         for tab in self.multi_url_notebook.tabs():
             self.multi_url_notebook.forget(tab)
         self.multi_url_widgets.clear()
-        self.nodes_frame.grid_remove() # Hide nodes frame
-        self.winmx_patch_frame.grid_remove() # Hide WinMX patch frame
+        if self.nodes_frame is not None:
+            self.nodes_frame.grid_remove() # Hide nodes frame
+        if self.winmx_patch_frame is not None:
+            self.winmx_patch_frame.grid_remove() # Hide WinMX patch frame
         self.last_updated_var.set("N/A")
         self.remote_last_updated_var.set("N/A")
         self.nodes_list_url_var.set("")
@@ -1297,7 +1863,8 @@ class P2PHelperApp(tk.Tk):
         self.winmx_patch_last_updated_var.set("N/A")
         self.winmx_remote_last_updated_var.set("N/A")
         self.download_server_list_button.config(state=tk.DISABLED)
-        self.nodes_list_url_combo.config(state=tk.DISABLED)
+        if self.nodes_frame is not None:
+            self.nodes_list_url_combo.config(state=tk.DISABLED)
         self.browse_exe_button.config(state=tk.DISABLED)
         self.browse_install_button.config(state=tk.DISABLED)
         self.display_name_var.set("")
@@ -1329,6 +1896,8 @@ class P2PHelperApp(tk.Tk):
             self.download_server_list_button.config(state=tk.DISABLED)
 
     def on_nodes_list_url_change(self, *args):
+        if self.nodes_frame is None:
+            return
         # The download button should only be active if the fields are also active (not disabled)
         is_active = self.nodes_list_target_entry.cget("state") != tk.DISABLED
 
@@ -1357,6 +1926,8 @@ class P2PHelperApp(tk.Tk):
         threading.Thread(target=self._get_last_modified, args=(url_to_check, self.remote_last_updated_var), daemon=True).start()
         
     def on_winmx_patch_change(self, *args):
+        if self.winmx_patch_frame is None:
+            return
         is_active = self.winmx_patch_target_entry.cget("state") != tk.DISABLED
         has_url = self.winmx_patch_url_var.get()
         if has_url and self.winmx_patch_target_var.get() and is_active:
@@ -1371,7 +1942,7 @@ class P2PHelperApp(tk.Tk):
         if selection in self.EMULE_NODES_LISTS:
             self.nodes_list_url_var.set(self.EMULE_NODES_LISTS[selection])
 
-    def add_program_manually(self):
+    def add_program_manually(self, exe_path=None):
         dialog = tk.Toplevel(self)
         dialog.title("Add Program Manually")
         dialog.geometry("500x380")
@@ -1538,6 +2109,10 @@ class P2PHelperApp(tk.Tk):
                 exe_var.set(filepath)
                 name_var.set(os.path.splitext(os.path.basename(filepath))[0])
 
+        if exe_path: # Path passed on the command line (--add-path)
+            exe_var.set(exe_path)
+            name_var.set(os.path.splitext(os.path.basename(exe_path))[0])
+
         def on_ok():
             filepath = exe_var.get()
             display_name = name_var.get()
@@ -1633,6 +2208,8 @@ class P2PHelperApp(tk.Tk):
         if program_info.get("Network") != "OpenNapster":
             return
 
+        env = self._windows_env(program_info)
+
         display_name = program_info.get("DisplayName", "").lower()
 
         # Auto-detect from display name if type isn't specified
@@ -1648,7 +2225,7 @@ class P2PHelperApp(tk.Tk):
 
         if client_type == "napigator":
             # Override paths for Napigator to ensure correctness, as registry can be unreliable.
-            program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+            program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
             if program_info.get("Source") == "Registry":
                 install_path = os.path.join(program_files_x86, "thirty4 interactive", "Napigator")
                 # The main executable is a shortcut, which is fine for display, but we point to the folder.
@@ -1661,10 +2238,10 @@ class P2PHelperApp(tk.Tk):
                 reg_url: ["(Windows Registry)"] # This is a virtual path
             }
             icon_filename = "Napigator.ico"
-            if os.path.exists(os.path.join(self.script_dir, icon_filename)):
+            if icon_filename in self.assets:
                 program_info["IconPath"] = icon_filename
         elif client_type == "filenavigator":
-            program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+            program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
             if program_info.get("Source") == "Registry":
                 install_path = os.path.join(program_files_x86, "FileNavigator")
                 exe_path = os.path.join(install_path, "FileNavigator.exe")
@@ -1677,7 +2254,7 @@ class P2PHelperApp(tk.Tk):
             }
 
         elif client_type == "swaptor":
-            program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+            program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
             if program_info.get("Source") == "Registry":
                 install_path = os.path.join(program_files_x86, "Swaptor")
                 exe_path = os.path.join(install_path, "Swaptor.exe")
@@ -1692,7 +2269,7 @@ class P2PHelperApp(tk.Tk):
         elif client_type == "napster":
             # This handles the original Napster client.
             if program_info.get("Source") == "Registry":
-                program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                 install_path = os.path.join(program_files_x86, "Napster")
                 exe_path = os.path.join(install_path, "napster.exe")
                 program_info["InstallLocation"] = install_path
@@ -1709,6 +2286,8 @@ class P2PHelperApp(tk.Tk):
         if program_info.get("Network") != "WinMX":
             return
 
+        env = self._windows_env(program_info)
+
         display_name = program_info.get("DisplayName", "").lower()
 
         # Auto-detect from display name if no specific prefill is requested
@@ -1720,8 +2299,8 @@ class P2PHelperApp(tk.Tk):
         if prefill_patch:
             # This handles both "WinMX" and "WinMX Community Patch".
             # It downloads a patched DLL for network connectivity.
+            program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
             if program_info.get("Source") == "Registry":
-                program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                 install_path = os.path.join(program_files_x86, "WinMX")
                 exe_path = os.path.join(install_path, "WinMX.exe")
                 program_info["InstallLocation"] = install_path
@@ -1743,6 +2322,8 @@ class P2PHelperApp(tk.Tk):
         if program_info.get("Network") != "Gnutella":
             return
 
+        env = self._windows_env(program_info)
+
         display_name = program_info.get("DisplayName", "")
         gnutella_keywords = ["limewire", "frostwire", "wireshare", "luckywire", "lemonwire", "turbowire", "cabos", "dexterwire"] # Known clients with predictable paths
         is_known_gnutella_client = False
@@ -1752,83 +2333,83 @@ class P2PHelperApp(tk.Tk):
                 # It's a known Gnutella client, pre-fill the server list info.
                 is_known_gnutella_client = True
                 program_info["ServerListURL"] = "https://raw.githubusercontent.com/GamerA1-99/gnutella.net/main/gnutella.net"
-                target_path = os.path.join(os.environ['APPDATA'], kw.capitalize(), "gnutella.net") # Default for most LimeWire forks
+                target_path = os.path.join(env['APPDATA'], kw.capitalize(), "gnutella.net") # Default for most LimeWire forks
                 program_info["ServerListTargetPaths"] = {
                     "https://raw.githubusercontent.com/GamerA1-99/gnutella.net/main/gnutella.net": [target_path]
                 }
                 if program_info.get("Source") == "Registry":
                     if kw == "limewire":
-                        program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                        program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                         install_path = os.path.join(program_files_x86, "LimeWire")
                         exe_path = os.path.join(install_path, "LimeWire.exe")
                         program_info["InstallLocation"] = install_path
                         program_info["ExecutablePath"] = exe_path
                         icon_filename = "LimeWire.ico"
-                        if os.path.exists(os.path.join(self.script_dir, icon_filename)):
+                        if icon_filename in self.assets:
                             program_info["IconPath"] = icon_filename
                     elif kw == "frostwire":
-                        program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                        program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                         install_path = os.path.join(program_files_x86, "FrostWire")
                         exe_path = os.path.join(install_path, "FrostWire.exe")
                         program_info["InstallLocation"] = install_path
                         program_info["ExecutablePath"] = exe_path
                     elif kw == "wireshare":
-                        program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                        program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                         install_path = os.path.join(program_files_x86, "WireShare")
                         exe_path = os.path.join(install_path, "WireShare.exe")
                         program_info["InstallLocation"] = install_path
                         program_info["ExecutablePath"] = exe_path
                     elif kw == "luckywire":
-                        program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                        program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                         install_path = os.path.join(program_files_x86, "LuckyWire")
                         exe_path = os.path.join(install_path, "LuckyWire.exe")
                         program_info["InstallLocation"] = install_path
                         program_info["ExecutablePath"] = exe_path
                         icon_filename = "LuckyWire.ico"
-                        if os.path.exists(os.path.join(self.script_dir, icon_filename)):
+                        if icon_filename in self.assets:
                             program_info["IconPath"] = icon_filename
                     elif kw == "lemonwire":
-                        program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                        program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                         install_path = os.path.join(program_files_x86, "LemonWire")
                         exe_path = os.path.join(install_path, "LemonWire.exe")
                         program_info["InstallLocation"] = install_path
                         program_info["ExecutablePath"] = exe_path
                         # Use the LimeWire icon for LemonWire as requested
                         icon_filename = "LemonWire.ico"
-                        if os.path.exists(os.path.join(self.script_dir, icon_filename)):
+                        if icon_filename in self.assets:
                             program_info["IconPath"] = icon_filename
                     elif kw == "turbowire":
-                        program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                        program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                         install_path = os.path.join(program_files_x86, "TurboWire")
                         exe_path = os.path.join(install_path, "TurboWire.exe")
                         program_info["InstallLocation"] = install_path
                         program_info["ExecutablePath"] = exe_path
                         icon_filename = "TurboWire.ico"
-                        if os.path.exists(os.path.join(self.script_dir, icon_filename)):
+                        if icon_filename in self.assets:
                             program_info["IconPath"] = icon_filename
                     elif kw == "cabos":
-                        program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                        program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                         install_path = os.path.join(program_files_x86, "Cabos")
                         exe_path = os.path.join(install_path, "Cabos.exe")
                         program_info["InstallLocation"] = install_path
                         program_info["ExecutablePath"] = exe_path
                         icon_filename = "Cabos.ico"
-                        if os.path.exists(os.path.join(self.script_dir, icon_filename)):
+                        if icon_filename in self.assets:
                             program_info["IconPath"] = icon_filename
                         # Update the target path specifically for Cabos
-                        cabos_target_path = os.path.join(os.environ['APPDATA'], "Cabos", "gnutella.net")
+                        cabos_target_path = os.path.join(env['APPDATA'], "Cabos", "gnutella.net")
                         program_info["ServerListTargetPaths"] = {program_info.get("ServerListURL", "https://raw.githubusercontent.com/GamerA1-99/gnutella.net/main/gnutella.net"): [cabos_target_path]}
                     elif kw == "dexterwire":
-                        program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                        program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                         install_path = os.path.join(program_files_x86, "DexterWire")
                         exe_path = os.path.join(install_path, "DexterWire.exe")
                         program_info["InstallLocation"] = install_path
                         program_info["ExecutablePath"] = exe_path
                         # Update the target path specifically for DexterWire
                         icon_filename = "DexterWire.ico"
-                        if os.path.exists(os.path.join(self.script_dir, icon_filename)):
+                        if icon_filename in self.assets:
                             program_info["IconPath"] = icon_filename
-                        dexterwire_target_path = os.path.join(os.environ['APPDATA'], "DexterWire", "gnutella.net")
+                        dexterwire_target_path = os.path.join(env['APPDATA'], "DexterWire", "gnutella.net")
                         program_info["ServerListTargetPaths"] = {program_info.get("ServerListURL", "https://raw.githubusercontent.com/GamerA1-99/gnutella.net/main/gnutella.net"): [dexterwire_target_path]}
 
 
@@ -1857,7 +2438,7 @@ class P2PHelperApp(tk.Tk):
         if "xnap" in display_name:
             # The registry path for XNap can be unreliable, so we set it here for consistency.
             if program_info.get("Source") == "Registry" or "xnap" in program_info.get("MatchedKeyword", ""):
-                program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                 install_path = os.path.join(program_files_x86, "XNap")
                 exe_path = os.path.join(install_path, "xnap.jar")
                 program_info["InstallLocation"] = install_path
@@ -1870,7 +2451,7 @@ class P2PHelperApp(tk.Tk):
             program_info.setdefault("AlsoInNetworks", []).append("OpenNapster")
             # Explicitly set the icon for XNap
             icon_filename = "XNap.ico"
-            if os.path.exists(os.path.join(self.script_dir, icon_filename)):
+            if icon_filename in self.assets:
                 program_info["IconPath"] = icon_filename
 
     def _prefill_edonkey_info(self, program_info, prefill_server=True, prefill_nodes=True, client_type=None, nodes_target_override=None, nodes_url_override=None):
@@ -1878,6 +2459,8 @@ class P2PHelperApp(tk.Tk):
         if program_info.get("Network") != "eDonkey/Kadmille":
             return
 
+        env = self._windows_env(program_info)
+
         display_name = program_info.get("DisplayName", "").lower()
         install_location = program_info.get("InstallLocation", "")
 
@@ -1931,19 +2514,19 @@ class P2PHelperApp(tk.Tk):
                 program_info["NodesListTargetPath"] = nodes_target_override
             else:
                 # C:\Users\<user>\AppData\Local\Lphant\nodes.dat
-                program_info["NodesListTargetPath"] = os.path.join(os.environ.get('LOCALAPPDATA', ''), 'Lphant', 'nodes.dat')
+                program_info["NodesListTargetPath"] = os.path.join(env.get('LOCALAPPDATA', ''), 'Lphant', 'nodes.dat')
 
             # Add icon path if it exists
             icon_filename = "lphant.ico"
-            if os.path.exists(os.path.join(self.script_dir, icon_filename)):
+            if icon_filename in self.assets:
                 program_info["IconPath"] = icon_filename
         elif client_type == "emule":
             icon_filename = "eMule.ico"
-            if os.path.exists(os.path.join(self.script_dir, icon_filename)):
+            if icon_filename in self.assets:
                 program_info["IconPath"] = icon_filename
         elif client_type == "edonkey2000":
             icon_filename = "eDonkey.ico"
-            if os.path.exists(os.path.join(self.script_dir, icon_filename)):
+            if icon_filename in self.assets:
                 program_info["IconPath"] = icon_filename
 
         # To display the friendly name, we find which key corresponds to the current URL
@@ -1961,8 +2544,10 @@ class P2PHelperApp(tk.Tk):
         if program_info.get("Network") != "GnuCDNA/Gnutella2":
             return
 
+        env = self._windows_env(program_info)
+
         display_name = program_info.get("DisplayName", "").lower()
-        app_data_path = os.environ.get('APPDATA')
+        app_data_path = env.get('APPDATA')
 
         if not app_data_path:
             return
@@ -1995,7 +2580,7 @@ class P2PHelperApp(tk.Tk):
         elif client_type == "morpheus":
             # Override paths for standard Morpheus to ensure correctness, as registry can be unreliable.
             if program_info.get("Source") == "Registry":
-                program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                 install_path = os.path.join(program_files_x86, "Morpheus")
                 exe_path = os.path.join(install_path, "Morpheus.exe")
                 program_info["InstallLocation"] = install_path
@@ -2013,7 +2598,7 @@ class P2PHelperApp(tk.Tk):
             program_info["ServerListType"] = "multi"
         elif client_type == "gnucleus":
             # Gnucleus also has multiple server files, typically in its installation directory.
-            program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+            program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
             gnucleus_data_dir = os.path.join(program_files_x86, "Gnucleus", "Data")
             base_url = "https://raw.githubusercontent.com/GamerA1-99/GnucDNA/Gnucleus/"
             program_info["ServerListURL"] = "Multiple Sources" # Special value for UI
@@ -2026,7 +2611,7 @@ class P2PHelperApp(tk.Tk):
         elif client_type == "xolox":
             # XoloX uses the same files as Gnucleus, but in its own directory.
             if program_info.get("Source") == "Registry":
-                program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                 install_path = os.path.join(program_files_x86, "XoloX")
                 exe_path = os.path.join(install_path, "Xolox.exe")
                 program_info["InstallLocation"] = install_path
@@ -2044,7 +2629,7 @@ class P2PHelperApp(tk.Tk):
         elif client_type == "neonapster":
             # NeoNapster uses the same files as Gnucleus, but in its own directory.
             if program_info.get("Source") == "Registry":
-                program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                 install_path = os.path.join(program_files_x86, "NeoNapster")
                 exe_path = os.path.join(install_path, "NeoNapster.exe")
                 program_info["InstallLocation"] = install_path
@@ -2065,7 +2650,7 @@ class P2PHelperApp(tk.Tk):
 
             # Override paths for MyNapster to ensure correctness.
             if program_info.get("Source") == "Registry":
-                program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                 install_path = os.path.join(program_files_x86, "MyNapster")
                 exe_path = os.path.join(install_path, "MyNapster.exe")
                 program_info["InstallLocation"] = install_path
@@ -2085,7 +2670,7 @@ class P2PHelperApp(tk.Tk):
         elif client_type == "phex":
             # Override paths for Phex to ensure correctness.
             if program_info.get("Source") == "Registry":
-                program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                 install_path = os.path.join(program_files_x86, "Phex")
                 exe_path = os.path.join(install_path, "Phex.exe")
                 program_info["InstallLocation"] = install_path
@@ -2104,7 +2689,7 @@ class P2PHelperApp(tk.Tk):
         elif client_type == "kceasy":
             # KCeasy uses a giFT backend and has its own cache files.
             if program_info.get("Source") == "Registry":
-                program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                 install_path = os.path.join(program_files_x86, "KCeasy")
                 exe_path = os.path.join(install_path, "KCeasy.exe")
                 program_info["InstallLocation"] = install_path
@@ -2121,7 +2706,7 @@ class P2PHelperApp(tk.Tk):
             is_test_version = "test" in display_name
             # Override paths for BearShare to ensure correctness.
             if program_info.get("Source") == "Registry":
-                program_files_x86 = os.environ.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
+                program_files_x86 = env.get("ProgramFiles(x86)", "C:\\Program Files (x86)")
                 # The installer might create "BearShare" or "BearShare Test"
                 install_path_base = "BearShare Test" if is_test_version else "BearShare"
                 install_path = os.path.join(program_files_x86, install_path_base)
@@ -2257,11 +2842,21 @@ class P2PHelperApp(tk.Tk):
             return
 
         try:
-            if exe_path.lower().endswith(".jar"):
+            wine_prefix = self.selected_program.get("WinePrefix")
+            if wine_prefix:
+                # Programs found in a Wine prefix are started through Wine with that prefix.
+                if not shutil.which("wine"):
+                    messagebox.showerror("Launch Error", "Wine was not found. Please install Wine to run programs from a Wine prefix.")
+                    return
+                command = ["wine", exe_path]
+                self.log_message(f"Attempting to launch in Wine prefix '{wine_prefix}': {exe_path}", logging.DEBUG)
+                subprocess.Popen(command, cwd=os.path.dirname(exe_path) or None, env={**os.environ, "WINEPREFIX": wine_prefix},
+                                 start_new_session=True)
+            elif exe_path.lower().endswith(".jar"):
                 # Check if Java is in PATH
                 if shutil.which("java"):
                     command = ["java", "-jar", exe_path]
-                    self.log_message(f"Attempting to launch JAR: {' '.join(command)}")
+                    self.log_message(f"Attempting to launch JAR: {' '.join(command)}", logging.DEBUG)
                     # Use DETACHED_PROCESS for Java apps as well
                     subprocess.Popen(command, creationflags=subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP)
                 else:
@@ -2270,11 +2865,11 @@ class P2PHelperApp(tk.Tk):
             else:
                 # For .exe and .lnk files, os.startfile() is the most reliable way on Windows.
                 # It correctly handles shortcuts and user-level file associations.
-                self.log_message(f"Attempting to launch via shell: {exe_path}")
+                self.log_message(f"Attempting to launch via shell: {exe_path}", logging.DEBUG)
                 os.startfile(exe_path)
             self.log_message(f"Successfully launched {self.selected_program['DisplayName']}.")
         except Exception as e:
-            self.log_message(f"Failed to launch {self.selected_program['DisplayName']}: {e}")
+            self.log_message(f"Failed to launch {self.selected_program['DisplayName']}: {e}", logging.ERROR)
             messagebox.showerror("Launch Error", f"Could not launch {self.selected_program['DisplayName']}:\n{e}")
 
     def browse_executable_path(self):
@@ -2432,21 +3027,16 @@ class P2PHelperApp(tk.Tk):
             if url and paths:
                 sources_to_download[url] = paths
 
-        # Handle special .reg file import if the virtual path is present
-        for url, paths in sources_to_download.items():
-            if "(Windows Registry)" in paths:
-                # This is handled in _perform_multi_download now
-                pass
-
         if not sources_to_download:
             messagebox.showwarning("No Sources", "There are no valid server list sources to download. Please add a source with a URL and at least one target path.", parent=self)
             return
 
         self.log_message(f"Starting multi-source server list download...")
-        threading.Thread(target=self._perform_multi_download, args=(sources_to_download,), daemon=True).start()
+        threading.Thread(target=self._perform_multi_download, args=(sources_to_download, self.selected_program), daemon=True).start()
 
     def add_multi_url_source(self):
         """Opens a dialog to add a new URL/path pair for multi-source mode."""
+        import urllib.request
         dialog = tk.Toplevel(self)
         dialog.title("Add Source (URL or Local File)")
         dialog.geometry("450x150")
@@ -2634,7 +3224,7 @@ class P2PHelperApp(tk.Tk):
                 return
 
         self.log_message(f"Attempting to download nodes list from: {url}")
-        self.log_message(f"Saving to: {target_path}")
+        self.log_message(f"Saving to: {target_path}", logging.DEBUG)
         threading.Thread(target=self._perform_download, args=(url, target_path, "NodesLastUpdated"), daemon=True).start()
 
     def download_winmx_patch(self):
@@ -2660,110 +3250,56 @@ class P2PHelperApp(tk.Tk):
         threading.Thread(target=self._perform_download, args=(url, target_path, "WinMXPatchLastUpdated", True), daemon=True).start()
 
     def _perform_reg_import(self, url):
-        """Downloads a .reg file, saves it temporarily, and runs it."""
-        temp_path = None
-        try:
-            self.after(0, self.log_message, f"Downloading .reg file from {url}...")
-            # Download to a temporary file with a .reg extension
-            temp_path, _ = urllib.request.urlretrieve(url)
-            reg_file_path = temp_path + ".reg"
-            shutil.move(temp_path, reg_file_path)
-            temp_path = reg_file_path # Update temp_path to the new name
-
-            self.after(0, self.log_message, f"Attempting to import registry file: {reg_file_path}")
-            # Use 'reg import' which is silent and doesn't require user interaction
-            # Using CREATE_NO_WINDOW to hide the command prompt
-            process = subprocess.run(['reg', 'import', reg_file_path], capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-
-            if process.returncode == 0:
-                self.after(0, self.log_message, "SUCCESS: Registry file imported successfully.")
-                self.after(0, messagebox.showinfo, "Import Complete", "Napigator server list has been imported successfully.")
-            else:
-                error_msg = f"FAILED to import registry file. Return code: {process.returncode}\nError: {process.stderr}"
-                self.after(0, self.log_message, error_msg)
-                self.after(0, messagebox.showerror, "Import Error", error_msg)
-        except Exception as e:
-            self.after(0, self.log_message, f"An unexpected error occurred during .reg import: {e}")
-            self.after(0, messagebox.showerror, "Import Error", f"An unexpected error occurred: {e}")
+        """Downloads a .reg file and imports it into the registry."""
+        error = self.update_engine.import_reg(url)
+        self._show_reg_import_result(error)
 
-    def _perform_multi_download(self, sources_to_download):
+    def _show_reg_import_result(self, error):
+        if error:
+            self.ui_events.popup("error", "Import Error", f"FAILED to import registry file.\nError: {error}")
+        else:
+            self.ui_events.popup("info", "Import Complete", "Napigator server list has been imported successfully.")
+
+    @profiled("multi_download")
+    def _perform_multi_download(self, sources_to_download, program=None):
         """Downloads files from multiple sources to their respective targets."""
+        plan = [PlannedDownload(program, "server_list", url, paths) for url, paths in sources_to_download.items()]
         success_count = 0
         fail_count = 0
-        total_count = sum(len(paths) for paths in sources_to_download.values())
-
-        for download_url, target_paths in sources_to_download.items():
-            # Handle special .reg file import
-            if "(Windows Registry)" in target_paths:
-                self.after(0, self.log_message, f"Starting .reg file import from {download_url}...")
-                # Run in the same thread to be part of the overall success/fail count
-                self._perform_reg_import(download_url)
-                continue # Move to the next source
-
-            is_local_file = download_url.startswith('file:')
-            temp_path = None
-            try:
-                if is_local_file:
-                    # The "download_url" is a file URI. Convert it back to a system path.
-                    local_path = urllib.request.url2pathname(urllib.parse.urlparse(download_url).path)
-                    self.after(0, self.log_message, f"Copying from local file {local_path}...")
-                    if not os.path.exists(local_path):
-                        raise FileNotFoundError(f"Local source file not found: {local_path}")
-                    temp_path = local_path # Use the local path directly for copying
-                else:
-                    # Download the file to a temporary location first
-                    self.after(0, self.log_message, f"Downloading from {download_url}...")
-                    temp_path, _ = urllib.request.urlretrieve(download_url)
-
-                for target_path in target_paths:
-                    try:
-                        # Ensure target directory exists
-                        target_dir = os.path.dirname(target_path)
-                        if not os.path.exists(target_dir):
-                            os.makedirs(target_dir, exist_ok=True)
-                        # Copy the temp file to the final destination
-                        shutil.copy(temp_path, target_path)
-                        self.after(0, self.log_message, f"  -> Successfully copied to: {target_path}")
-                        success_count += 1
-
-                        # Show special message for .wsx files that require manual import
-                        if target_path.lower().endswith(".wsx"):
-                            self.after(0, messagebox.showinfo, "Manual Import Required",
-                                       "The OpenNapster .WSX server list has been downloaded.\n\n"
-                                       "This file must be manually imported into your client."
-                                       )
-                    except Exception as e:
-                        self.after(0, self.log_message, f"  -> FAILED to copy to {target_path}: {e}")
-                        fail_count += 1
-            except Exception as e:
-                action = "copy" if is_local_file else "download"
-                self.after(0, self.log_message, f"FAILED to {action} from {download_url}: {e}")
-                fail_count += len(target_paths) # All targets for this URL failed
-            finally:
-                if not is_local_file and temp_path and os.path.exists(temp_path):
-                    os.remove(temp_path) # Clean up the temporary file
-
-        self.after(0, self._on_multi_download_complete, success_count, fail_count, total_count)
+        for outcome in self.update_engine.run(plan):
+            if outcome.target == REGISTRY_TARGET:
+                self._show_reg_import_result(outcome.error)
+                continue
+            if not outcome.ok:
+                fail_count += 1
+                continue
+            success_count += 1
+            # Show special message for .wsx files that require manual import
+            if outcome.target.lower().endswith(".wsx"):
+                self.ui_events.popup("info", "Manual Import Required",
+                           "The OpenNapster .WSX server list has been downloaded.\n\n"
+                           "This file must be manually imported into your client."
+                           )
+        self.ui_events.call(self._on_multi_download_complete, success_count, fail_count, success_count + fail_count, program)
 
     def _perform_download(self, url, target_path, last_updated_key="LastUpdated", show_popup=True):
-        try:
-            # Ensure target directory exists before download
-            target_dir = os.path.dirname(target_path)
-            if not os.path.exists(target_dir):
-                os.makedirs(target_dir)
+        program = self.selected_program
+        kind = next(kind for kind, field in LAST_UPDATED_FIELDS.items() if field == last_updated_key)
+        file_type = {"nodes": "Nodes list", "server_list": "Server list", "winmx_patch": "WinMX patch"}[kind]
+        outcome = self.update_engine.run_item(PlannedDownload(program, kind, url, [target_path]))[0]
+        if not outcome.ok:
+            self.log_message(f"Error downloading {file_type.lower()} from {url}: {outcome.error}", logging.ERROR)
+            if show_popup:
+                self.ui_events.popup("error", "Download Error", f"Could not download {file_type.lower()}:\n{outcome.error}")
+            return
 
-            urllib.request.urlretrieve(url, target_path)
-            
-            # --- Update successful, now update the UI and save ---
-            now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            file_type_map = {"NodesLastUpdated": "Nodes list", "LastUpdated": "Server list", "WinMXPatchLastUpdated": "WinMX patch"}
-            file_type = file_type_map.get(last_updated_key, "File")
+        # --- Update successful, now update the UI and save ---
+        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-            
-            def update_on_main_thread():
-                if self.selected_program: # Check if program is still selected
-                    self.selected_program[last_updated_key] = now_str
-                    
+        def update_on_main_thread():
+            if program is not None:
+                program[last_updated_key] = now_str
+                if program is self.selected_program: # Still shown in the details panel
                     # Only update the main "Last Updated" label if it's a server list
                     if last_updated_key == "LastUpdated":
                         self.last_updated_var.set(now_str)
@@ -2771,27 +3307,12 @@ class P2PHelperApp(tk.Tk):
                         self.nodes_last_updated_var.set(now_str)
                     elif last_updated_key == "WinMXPatchLastUpdated":
                         self.winmx_patch_last_updated_var.set(now_str)
-
-                    self.save_settings()
-                self.log_message(f"Successfully downloaded {file_type.lower()} to: {target_path}")
-                if show_popup:
-                    messagebox.showinfo("Download Complete", f"{file_type} downloaded successfully to:\n{target_path}")
-
-            self.after(0, update_on_main_thread)
-
-        except urllib.error.URLError as e:
-            file_type = file_type_map.get(last_updated_key, "File")
-            error_message = f"Error downloading {file_type.lower()} from {url}: {e.reason}"
-            self.after(0, self.log_message, error_message)
-            if show_popup:
-                self.after(0, messagebox.showerror, "Download Error", f"Could not download {file_type.lower()}:\n{e.reason}")
-            raise e # Re-raise for multi-download to catch
-        except Exception as e:
-            error_message = f"An unexpected error occurred during {file_type.lower()} download: {e}"
-            self.after(0, self.log_message, error_message)
+                self.save_settings()
+            self.log_message(f"Successfully downloaded {file_type.lower()} to: {target_path}")
             if show_popup:
-                self.after(0, messagebox.showerror, "Download Error", f"An unexpected error occurred:\n{e}")
-            raise e # Re-raise for multi-download to catch
+                self.ui_events.popup("info", "Download Complete", f"{file_type} downloaded successfully to:\n{target_path}")
+
+        self.ui_events.call(update_on_main_thread)
 
     def _fetch_remote_update_times(self, program_info):
         """Starts threads to fetch the Last-Modified headers for relevant URLs."""
@@ -2821,77 +3342,343 @@ class P2PHelperApp(tk.Tk):
             self.winmx_remote_last_updated_var.set("N/A")
 
     def _get_last_modified(self, url, result_var):
-        """Worker thread to get the Last-Modified header from a URL."""
+        """Worker thread to show when the file at `url` last changed on the server."""
+        modified = remote_last_modified(url)
+        self.ui_events.set_value(result_var, modified.strftime('%Y-%m-%d %H:%M') if modified else "N/A")
+
+    def handle_instance_request(self, request):
+        """Carries out a launch request (see parse_instance_command), either our own or one forwarded by a later launch."""
+        command = request.get("command")
+        # Bring the window to the front in every case
+        self.deiconify()
+        self.lift()
+        self.attributes("-topmost", True)
+        self.after_idle(self.attributes, "-topmost", False)
+        self.focus_force()
+        if command == "update_all":
+            self.update_programs(self.installed_programs)
+        elif command == "update":
+            name = request.get("program", "")
+            programs = [p for p in self.installed_programs if p.get("DisplayName", "").lower() == name.lower()]
+            if programs:
+                self.update_programs(programs)
+            else:
+                self.log_message(f"Update requested for unknown program '{name}'.", logging.WARNING)
+        elif command == "add_path":
+            self.add_program_manually(exe_path=request.get("path"))
+
+    def _plan_program_downloads(self, program):
+        server_lists = {**self.EDONKEY_SERVER_LISTS, **self._get_custom_lists_for_network(program.get("Network"))}
+        return plan_program_downloads(program, server_lists, self.EMULE_NODES_LISTS)
+
+    def update_all_programs(self):
+        self.update_programs(self.installed_programs)
+
+    def update_programs(self, programs):
+        """
+        Downloads everything configured for `programs` (server lists, nodes.dat, patches).
+        The sources are fetched in parallel (see ParallelUpdateRunner) and shown in a live
+        table; a single summary follows at the end.
+        """
+        if self.update_runner is not None:
+            self.log_message("An update is already running.", logging.WARNING)
+            self._show_update_window()
+            return
+        if self._refresh_running:
+            # Both would write the same targets and journal entries; start once the refresh is done
+            self._queued_update = list(programs)
+            self.log_message("The automatic refresh is running; the update will start when it finishes.")
+            return
+        plan = [item for program in programs for item in self._plan_program_downloads(program)]
+        if not plan:
+            self.log_message("Nothing to update: no download targets are configured.", logging.WARNING)
+            return
+        self.update_jobs = build_update_jobs(plan)
+        self.update_runner = ParallelUpdateRunner(self.update_engine)
+        self.log_message(f"Updating {len(self.update_jobs)} source(s) for {len({id(item.program) for item in plan})} program(s)...")
+        self.update_all_button.config(state=tk.DISABLED)
+        self._show_update_window(rebuild=True)
+        self.progress_handlers["update_jobs"] = lambda event: self._refresh_update_table()
+        threading.Thread(target=self._perform_program_updates, args=(self.update_runner, self.update_jobs), daemon=True).start()
+
+    def _perform_program_updates(self, runner, jobs):
+        """Worker thread for update_programs()."""
+        # Called for every chunk received; the event bus coalesces these into one table refresh per tick
+        def on_change(job):
+            self.ui_events.progress("update_jobs", sum(1 for j in jobs if j.finished_state), len(jobs))
         try:
-            # Use the GitHub API for raw.githubusercontent.com URLs for accurate timestamps
-            if 'raw.githubusercontent.com' in url:
-                self._get_github_last_modified(url, result_var)
-                return
+            runner.run(jobs, on_change=on_change)
+        finally:
+            self.ui_events.call(self._on_program_updates_complete, jobs)
 
-            # Do not attempt to make a web request for local file URIs.
-            if url.startswith('file:'):
-                self.after(0, result_var.set, "N/A")
-                return
+    def show_update_preview(self):
+        """Shows what Update All would download and write, and where, without doing any of it (see dry_run_plan())."""
+        plan = [item for program in self.installed_programs for item in self._plan_program_downloads(program)]
+        sources = dry_run_plan(plan, self.download_journal, self.settings_store, is_admin())
 
-            req = urllib.request.Request(url, method='HEAD')
-            with urllib.request.urlopen(req, timeout=10) as response:
-                # Only use 'Last-Modified'. The 'Date' header is often the current time and misleading.
-                last_modified = response.headers.get('Last-Modified')
-
-                if last_modified:
-                    # Try to parse the date and reformat it. If it fails for any reason, show N/A.
-                    try:
-                        dt = datetime.strptime(last_modified, '%a, %d %b %Y %H:%M:%S %Z')
-                        self.after(0, result_var.set, dt.strftime('%Y-%m-%d %H:%M'))
-                    except ValueError:
-                        self.after(0, result_var.set, "N/A") # If format is unexpected, just show N/A
-                else:
-                    self.after(0, result_var.set, "N/A")
-        except Exception:
-            self.after(0, result_var.set, "N/A")
+        dialog = tk.Toplevel(self)
+        dialog.title("Preview Update All")
+        dialog.geometry("860x420")
+        dialog.transient(self)
+
+        frame = ttk.Frame(dialog, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+        frame.grid_columnconfigure(0, weight=1)
+        frame.grid_rowconfigure(0, weight=1)
+
+        tree = ttk.Treeview(frame, columns=("status", "detail"), show="tree headings")
+        tree.heading("#0", text="Source / Target")
+        tree.heading("status", text="Status")
+        tree.heading("detail", text="Details")
+        tree.column("#0", width=420)
+        tree.column("status", width=80, stretch=False)
+        tree.column("detail", width=320)
+        tree.tag_configure("blocked", foreground="red")
+        tree.tag_configure("elevation", foreground="#b36b00")
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.grid(row=0, column=0, sticky="nsew")
+        scrollbar.grid(row=0, column=1, sticky="ns")
+
+        total_bytes = 0
+        counts = collections.Counter()
+        for source in sources:
+            size = f"~{source.estimated_bytes / 1024:.0f} KB" if source.estimated_bytes is not None else "Size unknown"
+            if source.estimated_ms is not None:
+                size += f", ~{source.estimated_ms / 1000:.1f} s"
+            total_bytes += source.estimated_bytes or 0
+            parent = tree.insert("", tk.END, text=source.url, open=True,
+                                 values=(source.kind.replace("_", " "), f"{size} for {', '.join(source.programs)}"))
+            for target in source.targets:
+                counts[target.status] += 1
+                tree.insert(parent, tk.END, text=target.path, values=(target.status.capitalize(), target.note), tags=(target.status,))
+
+        summary = (f"{len(sources)} source(s), about {total_bytes / 1024:.0f} KB, written to {sum(counts.values())} target(s). "
+                   f"Administrator rights needed: {counts['elevation']}. Can't be written: {counts['blocked']}.")
+        button_frame = ttk.Frame(frame)
+        button_frame.grid(row=1, column=0, columnspan=2, sticky="ew", pady=(10, 0))
+        ttk.Label(button_frame, text=summary, wraplength=600, justify=tk.LEFT).pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="Close", command=dialog.destroy).pack(side=tk.RIGHT, padx=5)
+        update_button = ttk.Button(button_frame, text="Update All", command=lambda: (dialog.destroy(), self.update_all_programs()))
+        update_button.pack(side=tk.RIGHT)
+        if not sources:
+            update_button.config(state=tk.DISABLED)
+
+    def _show_update_window(self, rebuild=False):
+        """Shows the table of update jobs: one row per source with its state, bytes, speed and time."""
+        if self.update_window is not None and self.update_window.winfo_exists():
+            self.update_window.deiconify()
+            self.update_window.lift()
+        else:
+            window = tk.Toplevel(self)
+            window.title("Update Programs")
+            window.geometry("860x360")
+            window.transient(self)
+            self.update_window = window
+
+            frame = ttk.Frame(window, padding="10")
+            frame.pack(fill=tk.BOTH, expand=True)
+            frame.grid_columnconfigure(0, weight=1)
+            frame.grid_rowconfigure(0, weight=1)
+
+            columns = {"source": ("Source", 280), "programs": ("Programs", 200), "state": ("State", 80),
+                       "bytes": ("Received", 80), "speed": ("Speed", 80), "time": ("Time", 60)}
+            self.update_tree = ttk.Treeview(frame, columns=list(columns), show="headings")
+            for column, (heading, width) in columns.items():
+                self.update_tree.heading(column, text=heading)
+                self.update_tree.column(column, width=width, stretch=column in ("source", "programs"),
+                                        anchor="w" if column in ("source", "programs", "state") else "e")
+            self.update_tree.tag_configure("failed", foreground="red")
+            self.update_tree.tag_configure("partial", foreground="#b36b00")
+            scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=self.update_tree.yview)
+            self.update_tree.configure(yscrollcommand=scrollbar.set)
+            self.update_tree.grid(row=0, column=0, sticky="nsew")
+            scrollbar.grid(row=0, column=1, sticky="ns")
+
+            self.update_status_var = tk.StringVar()
+            button_frame = ttk.Frame(frame)
+            button_frame.grid(row=1, column=0, columnspan=2, sticky="ew", pady=(10, 0))
+            ttk.Label(button_frame, textvariable=self.update_status_var).pack(side=tk.LEFT)
+            ttk.Button(button_frame, text="Close", command=window.destroy).pack(side=tk.RIGHT, padx=5)
+            self.update_stop_button = ttk.Button(button_frame, text="Stop", command=self._stop_program_updates)
+            self.update_stop_button.pack(side=tk.RIGHT)
+            rebuild = True
+        if rebuild:
+            self.update_tree.delete(*self.update_tree.get_children())
+            self.update_rows = {} # row id -> values currently shown
+            for index, job in enumerate(self.update_jobs):
+                self.update_tree.insert("", tk.END, iid=str(index))
+        self._refresh_update_table()
+
+    def _refresh_update_table(self):
+        """Brings the update window's rows in line with the jobs; only rows that changed are touched."""
+        if self.update_window is None or not self.update_window.winfo_exists():
+            return
+        for index, job in enumerate(self.update_jobs):
+            received = f"{job.bytes / 1024:.0f} KB" if job.bytes else ""
+            if job.total_bytes and job.state == "running":
+                received = f"{received} of {job.total_bytes / 1024:.0f}"
+            values = (job.url, ", ".join(job.program_names()), job.state.capitalize(), received,
+                      f"{job.speed / 1024:.0f} KB/s" if job.bytes else "",
+                      f"{job.duration:.1f} s" if job.started is not None else "")
+            row = str(index)
+            if self.update_rows.get(row) != values:
+                self.update_rows[row] = values
+                self.update_tree.item(row, values=values, tags=(job.state,))
+        finished = sum(1 for job in self.update_jobs if job.finished_state)
+        if self.update_runner is not None:
+            self.update_status_var.set(f"{finished} of {len(self.update_jobs)} source(s) finished...")
+        self.update_stop_button.config(state=tk.NORMAL if self.update_runner is not None else tk.DISABLED)
+
+    def _stop_program_updates(self):
+        if self.update_runner is not None:
+            self.update_runner.cancel()
+            self.log_message("Stopping the update after the downloads in progress...")
+
+    def _on_program_updates_complete(self, jobs):
+        self.update_runner = None
+        self.progress_handlers.pop("update_jobs", None)
+        self.update_all_button.config(state=tk.NORMAL)
+        outcomes = [outcome for job in jobs for outcome in job.outcomes]
+        # Stamp every download that reached at least one target
+        self._apply_update_stamps(list({(id(o.program), o.kind): (o.program, LAST_UPDATED_FIELDS[o.kind]) for o in outcomes if o.ok}.values()))
+
+        states = collections.Counter(job.state for job in jobs)
+        summary = f"{states['done'] + states['unchanged']} of {len(jobs)} source(s) updated"
+        details = [f"{count} {state}" for state, count in states.items() if state not in ("done", "unchanged")]
+        if details:
+            summary += f" ({', '.join(details)})"
+        summary += "."
+        self._refresh_update_table()
+        if self.update_window is not None and self.update_window.winfo_exists():
+            self.update_status_var.set(summary)
+        self.log_message(f"Update finished: {summary}", logging.WARNING if details else logging.INFO)
+
+        failed = [job for job in jobs if job.state in ("failed", "partial")]
+        if not failed and not states["cancelled"]:
+            self.ui_events.popup("info", "Update Complete", f"All {len(outcomes)} target(s) were updated.")
+        else:
+            lines = [f"{job.url}: {job.error}" for job in failed[:5]]
+            if len(failed) > 5:
+                lines.append(f"...and {len(failed) - 5} more (see the log).")
+            self.ui_events.popup("warning", "Update Incomplete", "\n".join([summary, ""] + lines if lines else [summary]))
+
+    def _apply_update_stamps(self, stamps):
+        """Sets each (program, LastUpdated field) in `stamps` to now and saves."""
+        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for program, field in stamps:
+            program[field] = now_str
+        if stamps:
+            if self.selected_program is not None and any(program is self.selected_program for program, field in stamps):
+                self.display_details_panel(self.selected_program)
+            self.save_settings()
+
+    def _refresh_tick(self):
+        self.after(self.REFRESH_TICK_MS, self._refresh_tick)
+        if self.auto_refresh_var.get():
+            self.start_scheduled_refresh()
 
-    def _get_github_last_modified(self, raw_url, result_var):
-        """Fetches the last commit date for a file from raw.githubusercontent.com using the GitHub API."""
+    def start_scheduled_refresh(self):
+        """Refreshes the download sources that are due (see RefreshScheduler) in the background."""
+        if self._refresh_running or self.update_runner is not None:
+            return
+        plan = [item for program in self.installed_programs for item in self._plan_program_downloads(program)]
+        self.refresh_scheduler.sync(plan, self.settings.get("refresh_intervals"))
+        if self.refresh_scheduler.due():
+            self._refresh_running = True
+            threading.Thread(target=self._perform_scheduled_refresh, args=(plan,), daemon=True).start()
+
+    def _perform_scheduled_refresh(self, plan):
+        """Worker thread for start_scheduled_refresh()."""
+        # A background refresh never raises a UAC prompt: protected targets are only
+        # written if the elevated helper is already running, and fail otherwise.
+        engine = UpdateEngine(self.download_journal, self.settings_store,
+                              self.broker if self.broker.running else None, self.log_message)
         try:
-            # Example raw_url: https://raw.githubusercontent.com/USER/REPO/BRANCH/PATH/TO/FILE.txt
-            parts = urllib.parse.urlparse(raw_url).path.split('/')
-            if len(parts) < 5:
-                self.after(0, result_var.set, "N/A")
+            outcomes = self.refresh_scheduler.run_due(plan, engine)
+        except Exception as e:
+            self.log_message(f"Automatic refresh failed: {e}", logging.ERROR)
+            outcomes = []
+        self.ui_events.call(self._on_scheduled_refresh_complete, outcomes)
+
+    def _on_scheduled_refresh_complete(self, outcomes):
+        self._refresh_running = False
+        self._apply_update_stamps(list({(id(o.program), o.kind): (o.program, LAST_UPDATED_FIELDS[o.kind])
+                                        for o in outcomes if o.ok and not o.unchanged}.values()))
+        checked = {o.url for o in outcomes}
+        failed = {o.url for o in outcomes if not o.ok}
+        unchanged = {o.url for o in outcomes if o.unchanged}
+        if checked:
+            self.log_message(f"Automatic refresh: {len(checked)} source(s) checked, {len(checked - failed - unchanged)} updated, "
+                             f"{len(unchanged)} unchanged, {len(failed)} failed.", logging.WARNING if failed else logging.INFO)
+        if self._refresh_schedule_view:
+            self._refresh_schedule_view()
+        if self._queued_update is not None:
+            programs, self._queued_update = self._queued_update, None
+            self.update_programs(programs)
+
+    def show_refresh_schedule(self):
+        """Shows when each download source was last refreshed and when it is due next."""
+        dialog = tk.Toplevel(self)
+        dialog.title("Refresh Schedule")
+        dialog.geometry("800x320")
+        dialog.transient(self)
+
+        frame = ttk.Frame(dialog, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        columns = {"next": ("Next Run", 120), "every": ("Every", 60), "last": ("Last Run", 120),
+                   "status": ("Status", 170), "url": ("Source", 300)}
+        tree = ttk.Treeview(frame, columns=list(columns), show="headings")
+        for column, (heading, width) in columns.items():
+            tree.heading(column, text=heading)
+            tree.column(column, width=width, stretch=(column == "url"))
+        tree.pack(fill=tk.BOTH, expand=True)
+
+        def format_time(timestamp):
+            return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M") if timestamp else "-"
+
+        def refresh_view():
+            if not dialog.winfo_exists():
                 return
+            plan = [item for program in self.installed_programs for item in self._plan_program_downloads(program)]
+            self.refresh_scheduler.sync(plan, self.settings.get("refresh_intervals"))
+            tree.delete(*tree.get_children())
+            for row in self.refresh_scheduler.status():
+                status = (row["last_status"] or "never run").replace("_", " ")
+                if row["failures"]:
+                    status += f" ({row['failures']}x: {row['last_error']})"
+                tree.insert("", tk.END, values=(format_time(row["next_run"]), f"{row['interval_h']:g} h",
+                                                format_time(row["last_run"]), status, row["url"]))
+
+        def refresh_now():
+            self.refresh_scheduler.mark_due()
+            self.start_scheduled_refresh()
+            refresh_view()
+
+        def close():
+            self._refresh_schedule_view = None
+            dialog.destroy()
 
-            user = parts[1]
-            repo = parts[2]
-            branch = parts[3]
-            file_path = '/'.join(parts[4:])
-
-            api_url = f"https://api.github.com/repos/{user}/{repo}/commits?path={file_path}&sha={branch}&per_page=1"
-
-            # GitHub API requires a User-Agent header
-            req = urllib.request.Request(api_url, headers={'User-Agent': 'P2P-Connection-Helper'})
-
-            with urllib.request.urlopen(req, timeout=10) as response:
-                data = json.load(response)
-                if data:
-                    # Date is in ISO 8601 format, e.g., "2023-10-27T18:30:00Z"
-                    commit_date_str = data[0]['commit']['committer']['date']
-                    # Parse ISO 8601 format and convert to local time for display
-                    dt_utc = datetime.fromisoformat(commit_date_str.replace('Z', '+00:00'))
-                    dt_local = dt_utc.astimezone(None)
-                    self.after(0, result_var.set, dt_local.strftime('%Y-%m-%d %H:%M'))
-                else:
-                    self.after(0, result_var.set, "N/A")
-        except Exception:
-            # If API fails for any reason, fall back to N/A
-            self.after(0, result_var.set, "N/A")
+        self._refresh_schedule_view = refresh_view
+        dialog.protocol("WM_DELETE_WINDOW", close)
+        refresh_view()
 
-    def _on_multi_download_complete(self, success_count, fail_count, total_count):
+        button_frame = ttk.Frame(frame)
+        button_frame.pack(fill='x', pady=(10, 0))
+        ttk.Checkbutton(button_frame, text="Refresh sources automatically", variable=self.auto_refresh_var,
+                        command=self.save_settings).pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="Close", command=close).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="Refresh Now", command=refresh_now).pack(side=tk.RIGHT)
+
+    def _on_multi_download_complete(self, success_count, fail_count, total_count, program=None):
         """Updates UI after a multi-target download is finished."""
         now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        if success_count > 0:
-            if self.selected_program: # Check if program is still selected
-                self.selected_program["LastUpdated"] = now_str
+        if success_count > 0 and program is not None:
+            program["LastUpdated"] = now_str
+            if program is self.selected_program: # Still shown in the details panel
                 self.last_updated_var.set(now_str)
-                self.save_settings()
+            self.save_settings()
 
         if fail_count == 0:
             messagebox.showinfo("Download Complete", f"Server list(s) successfully downloaded to {success_count} location(s).")
@@ -2952,40 +3739,43 @@ class P2PHelperApp(tk.Tk):
 
     def _perform_url_test(self, url, parent):
         """Worker function to perform the URL HEAD request."""
+        import urllib.request
         # Handle local file URIs
         if url.startswith('file:'):
             try:
                 # Convert file URI to a system-specific path
                 file_path = urllib.request.url2pathname(urllib.parse.urlparse(url).path)
                 if os.path.exists(file_path):
-                    self.after(0, self.log_message, f"SUCCESS: Local file exists at '{file_path}'.")
-                    self.after(0, messagebox.showinfo, "Test Successful", "Local file exists.", parent=parent)
+                    self.log_message(f"Local file exists at '{file_path}'.")
+                    self.ui_events.popup("info", "Test Successful", "Local file exists.", parent=parent)
                 else:
-                    self.after(0, self.log_message, f"FAILURE: Local file not found at '{file_path}'.")
-                    self.after(0, messagebox.showerror, "Test Failed", "Local file not found.", parent=parent)
+                    self.log_message(f"Local file not found at '{file_path}'.", logging.ERROR)
+                    self.ui_events.popup("error", "Test Failed", "Local file not found.", parent=parent)
             except Exception as e:
-                self.after(0, self.log_message, f"FAILURE: Invalid file path. Error: {e}")
-                self.after(0, messagebox.showerror, "Test Failed", f"Could not test the file path.\n\nError: {e}", parent=parent)
+                self.log_message(f"Invalid file path. Error: {e}", logging.ERROR)
+                self.ui_events.popup("error", "Test Failed", f"Could not test the file path.\n\nError: {e}", parent=parent)
             return
         try:
             # Use a HEAD request to check for existence without downloading the content
             req = urllib.request.Request(url, method='HEAD')
-            with urllib.request.urlopen(req, timeout=10) as response:
+            with http_tracer.trace(url, "head"), open_url(req, timeout=10) as response:
                 status = response.getcode()
                 if 200 <= status < 300:
-                    self.after(0, self.log_message, f"SUCCESS: URL is reachable (Status: {status}).")
-                    self.after(0, messagebox.showinfo, "Test Successful", f"URL is reachable.\n\nStatus Code: {status}", parent=parent)
+                    self.log_message(f"URL is reachable (Status: {status}).")
+                    self.ui_events.popup("info", "Test Successful", f"URL is reachable.\n\nStatus Code: {status}", parent=parent)
                 else:
-                    self.after(0, self.log_message, f"WARNING: URL returned status {status}.")
-                    self.after(0, messagebox.showwarning, "Test Warning", f"URL returned a non-success status code: {status}", parent=parent)
+                    self.log_message(f"URL returned status {status}.", logging.WARNING)
+                    self.ui_events.popup("warning", "Test Warning", f"URL returned a non-success status code: {status}", parent=parent)
         except Exception as e:
-            self.after(0, self.log_message, f"FAILURE: Could not reach URL. Error: {e}")
-            self.after(0, messagebox.showerror, "Test Failed", f"Could not reach the URL.\n\nError: {e}", parent=parent)
+            self.log_message(f"Could not reach URL. Error: {e}", logging.ERROR)
+            self.ui_events.popup("error", "Test Failed", f"Could not reach the URL.\n\nError: {e}", parent=parent)
 
     def show_faq_window(self):
         """Creates and shows the Information & FAQ window."""
-        # If window already exists, just bring it to the front
+        # The window is built once and hidden instead of destroyed when closed,
+        # so reopening it is instant.
         if self.faq_window and self.faq_window.winfo_exists():
+            self.faq_window.deiconify()
             self.faq_window.lift()
             return
 
@@ -2993,32 +3783,44 @@ class P2PHelperApp(tk.Tk):
         self.faq_window.title("Information & FAQ")
         self.faq_window.geometry("750x550")
         self.faq_window.transient(self)
+        self.faq_window.protocol("WM_DELETE_WINDOW", self.faq_window.withdraw)
 
         notebook = ttk.Notebook(self.faq_window)
         notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
-        # Create and add tabs with content
-        self._create_faq_tab(notebook, "About This Program", self._get_about_program_text())
-        self._create_faq_tab(notebook, "P2P Networks", self._get_networks_faq_text())
-        self._create_faq_tab(notebook, "Clients & Servers", self._get_clients_servers_faq_text())
-        self._create_faq_tab(notebook, "Supported Software", self._get_supported_software_text())
-
-    def _create_faq_tab(self, notebook, title, text_content):
-        """Helper function to create a tab with scrollable, read-only text."""
-        tab_frame = ttk.Frame(notebook, padding=10)
-        notebook.add(tab_frame, text=title)
-
+        # Add empty tabs; each one's text is only formatted when the tab is first shown.
+        pending_tabs = {}
+        for title, text_func in (("About This Program", self._get_about_program_text),
+                                 ("P2P Networks", self._get_networks_faq_text),
+                                 ("Clients & Servers", self._get_clients_servers_faq_text),
+                                 ("Supported Software", self._get_supported_software_text)):
+            tab_frame = ttk.Frame(notebook, padding=10)
+            notebook.add(tab_frame, text=title)
+            pending_tabs[str(tab_frame)] = text_func
+
+        def on_faq_tab_changed(event):
+            text_func = pending_tabs.pop(notebook.select(), None)
+            if text_func:
+                self._create_faq_tab(notebook.nametowidget(notebook.select()), text_func())
+        notebook.bind("<<NotebookTabChanged>>", on_faq_tab_changed)
+        on_faq_tab_changed(None) # The first tab was selected before the binding existed
+
+    def _create_faq_tab(self, tab_frame, text_content):
+        """Helper function to fill a tab with scrollable, read-only text."""
         st = scrolledtext.ScrolledText(tab_frame, wrap=tk.WORD, font=("Segoe UI", 10))
         st.tag_configure("bold", font=("Segoe UI", 10, "bold"), foreground="#000080") # Use a navy blue for better visibility
         st.tag_configure("heading", font=("Segoe UI", 12, "bold"), spacing1=5, spacing3=5)
         st.tag_configure("bullet", lmargin1=20, lmargin2=20)
         st.pack(fill=tk.BOTH, expand=True)
 
-        # Simple parser for markdown-like formatting
-        for i, line in enumerate(text_content.split('\n')):
+        # Simple parser for markdown-like formatting. The (text, tag) pairs are
+        # collected first and inserted with a single call.
+        lines = text_content.split('\n')
+        chunks = []
+        for i, line in enumerate(lines):
             # Check for headings (text followed by ---)
-            if (i + 1) < len(text_content.split('\n')) and text_content.split('\n')[i+1].startswith('---'):
-                st.insert(tk.END, line + '\n', "heading")
+            if (i + 1) < len(lines) and lines[i + 1].startswith('---'):
+                chunks.extend((line + '\n', "heading"))
                 continue
             if line.startswith('---'): # Skip the '---' line itself
                 continue
@@ -3027,15 +3829,17 @@ class P2PHelperApp(tk.Tk):
                 parts = re.split(r'(\*\*.*?\*\*)', line)
                 for part in parts:
                     if part.startswith('**') and part.endswith('**'):
-                        st.insert(tk.END, part[2:-2], "bold") # This handles explicit **bold** markdown
-                    else:
-                        st.insert(tk.END, part)
-                
+                        chunks.extend((part[2:-2], "bold")) # This handles explicit **bold** markdown
+                    elif part:
+                        chunks.extend((part, ()))
+
                 # Handle bullet points by applying margin tags
                 if line.strip().startswith('•'):
-                    st.insert(tk.END, '\n', "bullet")
+                    chunks.extend(('\n', "bullet"))
                 else:
-                    st.insert(tk.END, '\n')
+                    chunks.extend(('\n', ()))
+        if chunks:
+            st.insert(tk.END, *chunks)
 
         st.config(state=tk.DISABLED) # Make it read-only
 
@@ -3173,28 +3977,96 @@ A utility to help manage and update server lists for legacy P2P applications.
 {self.DISCLAIMER_TEXT}"""
         messagebox.showinfo(f"About P2P Connection Helper v{self.VERSION}", about_text, parent=self)
 
+    def manage_wine_prefixes(self):
+        """Opens a dialog to add or remove Wine prefixes that are included in registry scans."""
+        dialog = tk.Toplevel(self)
+        dialog.title("Wine Prefixes")
+        dialog.geometry("500x300")
+        dialog.transient(self)
+        dialog.grab_set()
+
+        frame = ttk.Frame(dialog, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        ttk.Label(frame, text="Wine prefixes scanned for installed programs (default locations are always included):",
+                  wraplength=460, justify=tk.LEFT).pack(anchor='w', pady=(0, 5))
+
+        listbox = tk.Listbox(frame)
+        listbox.pack(fill=tk.BOTH, expand=True)
+
+        def refresh_list():
+            listbox.delete(0, tk.END)
+            for path in self.wine_prefixes:
+                listbox.insert(tk.END, path)
+            for prefix in default_wine_prefixes():
+                if prefix.path not in self.wine_prefixes:
+                    listbox.insert(tk.END, f"{prefix.path} (default)")
+
+        def add_prefix():
+            folderpath = filedialog.askdirectory(title="Select Wine Prefix Folder", initialdir=os.path.expanduser("~"), parent=dialog)
+            if not folderpath:
+                return
+            prefix = WinePrefix(folderpath)
+            if not prefix.is_valid():
+                messagebox.showwarning("Not a Wine Prefix", "The selected folder does not contain a 'system.reg' file.", parent=dialog)
+                return
+            if prefix.path not in self.wine_prefixes:
+                self.wine_prefixes.append(prefix.path)
+                self.save_settings()
+                self.log_message(f"Added Wine prefix: {prefix.path}")
+            refresh_list()
+
+        def remove_prefix():
+            selection_indices = listbox.curselection()
+            if not selection_indices:
+                messagebox.showwarning("No Selection", "Please select a prefix to remove.", parent=dialog)
+                return
+            path = listbox.get(selection_indices[0])
+            if path not in self.wine_prefixes:
+                messagebox.showinfo("Default Prefix", "Default prefixes are detected automatically and cannot be removed.", parent=dialog)
+                return
+            self.wine_prefixes.remove(path)
+            self.save_settings()
+            self.log_message(f"Removed Wine prefix: {path}")
+            refresh_list()
+
+        refresh_list()
+
+        button_frame = ttk.Frame(frame)
+        button_frame.pack(fill='x', pady=(10, 0))
+        ttk.Button(button_frame, text="Close", command=dialog.destroy).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="Remove", command=remove_prefix).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="Add...", command=add_prefix).pack(side=tk.RIGHT)
+
     def reset_settings(self):
         """Deletes the settings file and restarts the application."""
         if messagebox.askyesno("Reset Settings?",
                                "This will delete all saved settings, including manually added programs and custom URLs, and restart the application.\n\nAre you sure you want to continue?",
                                icon='warning', parent=self):
             try:
-                if os.path.exists(self.settings_file):
-                    os.remove(self.settings_file)
-                    self.log_message(f"Settings file '{self.settings_file}' deleted.")
+                # Drop any pending write so the settings file isn't recreated after deleting it.
+                self.settings_store.close(discard=True)
+                deleted = self.settings_store.delete()
+                if not isinstance(self.settings_store, JsonSettingsStore):
+                    # The old JSON file would otherwise be migrated into a new database again.
+                    deleted = JsonSettingsStore(self.settings_file).delete() or deleted
+                if deleted:
+                    self.log_message(f"Settings file '{self.settings_store.path}' deleted.")
                 else:
                     self.log_message("No settings file to delete.")
 
                 self.log_message("Restarting application...")
                 # Use Popen for a more reliable restart, especially when elevated.
                 # It correctly handles the working directory.
+                if self.instance_server:
+                    self.instance_server.close() # Otherwise the new process would just hand over to this one
                 args = [sys.executable] + sys.argv
                 subprocess.Popen(args, cwd=self.script_dir)
                 self.quit() # Close the current instance
 
             except Exception as e:
                 error_msg = f"Failed to reset settings and restart: {e}"
-                self.log_message(error_msg)
+                self.log_message(error_msg, logging.ERROR)
                 messagebox.showerror("Reset Error", error_msg, parent=self)
 
     def show_startup_disclaimer(self):
@@ -3210,8 +4082,8 @@ A utility to help manage and update server lists for legacy P2P applications.
         
         # Set the same icon as the main window
         try:
-            icon_path = os.path.join(self.script_dir, "p2p.ico")
-            if os.path.exists(icon_path):
+            icon_path = self.assets.path("p2p.ico")
+            if icon_path:
                 dialog.iconbitmap(icon_path)
         except Exception:
             pass # Ignore if icon setting fails
@@ -3259,8 +4131,8 @@ A utility to help manage and update server lists for legacy P2P applications.
         dialog.resizable(False, False)
 
         try:
-            icon_path = os.path.join(self.script_dir, "p2p.ico")
-            if os.path.exists(icon_path):
+            icon_path = self.assets.path("p2p.ico")
+            if icon_path:
                 dialog.iconbitmap(icon_path)
         except Exception:
             pass
@@ -3289,13 +4161,6 @@ A utility to help manage and update server lists for legacy P2P applications.
         ok_button = ttk.Button(frame, text="OK", command=on_ok)
         ok_button.pack()
 
-def is_admin():
-    """Check if the script is running with administrator privileges."""
-    try:
-        return ctypes.windll.shell32.IsUserAnAdmin()
-    except:
-        return False
-
 def set_window_app_id(tk_window):
     """
     Forcefully sets the AppUserModelID on a specific tkinter window handle (HWND).
@@ -3338,38 +4203,28 @@ def set_window_app_id(tk_window):
         print(f"Warning: Could not set window AppUserModelID: {e}")
 
 def main():
+    """Main function. The GUI runs without administrator rights; see ElevatedBroker."""
+    if len(sys.argv) > 3 and sys.argv[1] == "--broker":
+        # The elevated helper started by ElevatedBroker: no window, just the requested file operations
+        run_broker(sys.argv[2], sys.argv[3])
+        return
+
+    # Become the running instance. Later launches forward their request to us (see the top of this file).
+    request = parse_instance_command(sys.argv[1:])
+    instance_server = InstanceServer()
+    if not instance_server.acquire():
+        # Another instance started at the same moment; hand over to it if it answers
+        if forward_to_running_instance(request) is not None:
+            return
+        instance_server = None
+
     # Set the AppUserModelID for the process *before* creating any windows.
     # This is crucial for the taskbar icon to be correct from the start.
     if ctypes and hasattr(ctypes, 'windll') and hasattr(ctypes.windll, 'shell32'):
         myappid = f'mycompany.p2phelper.v{P2PHelperApp.VERSION}'
         ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
-    """Main function to handle UAC elevation."""
 
-    # This function now handles the full elevation and application lifecycle.
     try:
-        # If the script is not running as an admin, we attempt to relaunch it with elevation.
-        if not is_admin():
-            # The 'run_as_admin' function will show the UAC prompt.
-            # We pass 'wait=True' to make the current (non-admin) process wait for the
-            # elevated process to finish. This is the key to associating the taskbar icon correctly.
-            return_code = run_as_admin(wait=True)
-
-            # A return code of 1223 (ERROR_CANCELLED) means the user clicked "No" on the UAC prompt.
-            # A return code of 0 means the elevated process ran and exited successfully.
-            # Any other code is an error from the child process.
-            if return_code == 1223: # ERROR_CANCELLED
-                # We can inform the user and then proceed to run the app with limited rights.
-                # This is better than just exiting.
-                messagebox.showwarning("Admin Rights Not Granted",
-                                       "The application will continue without administrator privileges.\n\n"
-                                       "Some features, like modifying files in 'Program Files', may not work correctly.")
-            # If the user approved UAC, the elevated process will run and this non-admin
-            # process will simply wait here until it's closed, then exit.
-            # We exit with the code from the child process.
-            sys.exit(0) # Exit the non-admin process cleanly.
-        
-        # --- This code will only be reached by the elevated process (or if admin is not needed) ---
-
         # Show a warning if the optional 'Pillow' library is not installed.
         if not PIL_AVAILABLE:
             messagebox.showwarning("Optional Dependency Missing",
@@ -3380,12 +4235,26 @@ def main():
         # Schedule the window-specific AppUserModelID call after the window is fully initialized.
         # This reinforces the icon association and sets the window icon.
         # It's important to set the AUMID before setting the icon for best results.
-        icon_path = os.path.join(app.script_dir, "p2p.ico")
-        if os.path.exists(icon_path):
+        icon_path = app.assets.path("p2p.ico")
+        if icon_path:
             app.iconbitmap(icon_path)
         app.after_idle(lambda: set_window_app_id(app))
+        if instance_server:
+            app.instance_server = instance_server
+            instance_server.serve(lambda forwarded: app.ui_events.call(app.handle_instance_request, forwarded))
+        if request["command"] != "focus":
+            app.after_idle(app.handle_instance_request, request)
 
         app.mainloop()
+        app.stall_watchdog.stop() # No more heartbeats from here on
+        app.shutdown_settings() # Make sure the last changes reach the disk
+        app.broker.close()
+        if instance_server:
+            instance_server.close()
+        app.log_sink.close()
+        http_tracer.close()
+        if app.metrics_server:
+            app.metrics_server.close()
     except Exception as e:
         # Log the exception to a file for debugging, as the GUI may not be available.
         error_log_file = "p2p_helper_error.log"
@@ -3396,10 +4265,11 @@ def main():
         messagebox.showerror("Fatal Startup Error", f"The application failed to start: {e}\n\nCheck 'p2p_helper_error.log' for details.")
         sys.exit(1) # Exit with an error code
 
-def run_as_admin(wait=False):
+def run_as_admin(wait=False, arguments=None):
     """
     Re-run the script with administrator privileges using ShellExecuteExW
-    to allow waiting for the new process to complete.
+    to allow waiting for the new process to complete. `arguments` replaces
+    the command line arguments of the current process.
     """
     if not (ctypes and hasattr(ctypes, 'windll') and hasattr(ctypes.windll, 'shell32')):
         return -1 # Cannot elevate on non-Windows or if ctypes is missing
@@ -3439,7 +4309,13 @@ def run_as_admin(wait=False):
         ]
 
     try:
-        params = " ".join(f'"{arg}"' for arg in sys.argv)
+        if arguments is None:
+            command_line = sys.argv
+        elif getattr(sys, "frozen", False):
+            command_line = arguments # A bundled .exe takes the arguments directly
+        else:
+            command_line = [os.path.abspath(sys.argv[0])] + list(arguments)
+        params = " ".join(f'"{arg}"' for arg in command_line)
         
         proc_info = SHELLEXECUTEINFO()
         proc_info.cbSize = ctypes.sizeof(proc_info)
@@ -3463,7 +4339,6 @@ def run_as_admin(wait=False):
         return -1 # Indicate a general failure
 
 if __name__ == "__main__":
-    # On Windows, run the main function which handles elevation.
-    # On other OSes where ctypes is None, it will also run main, which will
-    # then just start the app without elevation logic.
+    # On Windows, privileged writes are handed to an elevated helper on demand (see ElevatedBroker).
+    # On other OSes where ctypes is None, elevation isn't available and those writes simply fail.
     main()